@@ -20,6 +20,8 @@ interface IAddressChecker {
 
     function nativeBalances(address[] calldata addresses) external view returns (uint[] memory);
 
+    function tokenBalances(address token, address[] calldata addresses) external view returns (uint[] memory);
+
     function contractsDeployed(address[] calldata addresses) external view returns (bool[] memory);
 
     function addressStates(address[] calldata addresses) external view returns (AddressState[] memory);
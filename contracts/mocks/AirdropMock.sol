@@ -0,0 +1,26 @@
+pragma solidity ^0.8.0;
+
+import "@openzeppelin/contracts/token/ERC20/IERC20.sol";
+import "../interfaces/IAirdrop.sol";
+
+// Minimal implementation of the wenTokens airdrop interface to test the airdrop scripts locally
+contract AirdropMock is IAirdrop {
+    function airdropETH(address[] calldata, uint256[] calldata) external pure override {
+        revert("Not implemented");
+    }
+
+    function airdropERC20(
+        address _token,
+        address[] calldata _recipients,
+        uint256[] calldata _amounts,
+        uint256 _total
+    ) external override {
+        require(_recipients.length == _amounts.length, "AirdropMock: length mismatch");
+        uint256 sent;
+        for (uint256 i = 0; i < _recipients.length; ++i) {
+            require(IERC20(_token).transferFrom(msg.sender, _recipients[i], _amounts[i]));
+            sent += _amounts[i];
+        }
+        require(sent == _total, "AirdropMock: wrong total");
+    }
+}
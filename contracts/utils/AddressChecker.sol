@@ -4,11 +4,12 @@ pragma solidity ^0.8.0;
 
 import "../interfaces/IAddressChecker.sol";
 import "../interfaces/AggregatorV3Interface.sol";
+import "@openzeppelin/contracts/token/ERC20/IERC20.sol";
 
 /**
  * @title    Address Checker contract
  * @notice   Gets data from multiple addresses in single function calls.
- *           It can be used to check balances and to check whether there is bytecode
+ *           It can be used to check native and ERC20 balances and to check whether there is bytecode
  *           (contract deployed) for multiple addresses. This is useful in order to avoid
  *           issuing a separate call for each address, which is very innefficient.
  *           It is also used to query all price feed data for multiple assets in a single call.
@@ -37,6 +38,25 @@ contract AddressChecker is IAddressChecker {
         return balances;
     }
 
+    /**
+     * @notice  Returns an array of the ERC20 token balances for array of addresses.
+     * @param token      Address of the ERC20 token.
+     * @param addresses  Array of addresses to check.
+     */
+    function tokenBalances(address token, address[] calldata addresses) external view override returns (uint[] memory) {
+        uint256 length = addresses.length;
+
+        uint[] memory balances = new uint[](length);
+
+        for (uint i = 0; i < length; ) {
+            balances[i] = IERC20(token).balanceOf(addresses[i]);
+            unchecked {
+                ++i;
+            }
+        }
+        return balances;
+    }
+
     /**
      * @notice  Returns an array of booleans signaling whether there is bytecode deployed for an array of addresses.
      * @param addresses  Array of addresses to check.
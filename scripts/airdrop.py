@@ -1,18 +1,30 @@
 import sys
 import os
 import csv
-import time
 
 sys.path.append(os.path.abspath("tests"))
 from consts import *
 from deploy import (
     transaction_params,
 )
-from utils import prompt_user_continue_or_break
+from utils import prompt_user_continue_or_break, get_token_balances
+from tx_pipeline import wait_for_confirmations
+from airdrop_batches import (
+    AIRDROP_GAS_CEILING,
+    AIRDROP_TX_WINDOW,
+    allowance_override,
+    plan_airdrop,
+    pending_batches,
+    read_airdrop_plan,
+    send_airdrop_batches,
+    update_sent_batches,
+    write_airdrop_plan,
+)
 from brownie import (
     project,
     chain,
     accounts,
+    AddressChecker,
     FLIP,
     network,
     web3,
@@ -42,9 +54,19 @@ columns = [
 AUTONOMY_SEED = os.environ["SEED"]
 cf_accs = accounts.from_mnemonic(AUTONOMY_SEED, count=10)
 DEPLOYER_ACCOUNT_INDEX = int(os.environ.get("DEPLOYER_ACCOUNT_INDEX") or 0)
+verify_confirmations = 3
+
+# Batches are sized to stay under AIRDROP_GAS_CEILING. The plan is kept in AIRDROP_PLAN_FILE,
+# which is updated as batches are confirmed so that rerunning the script resumes the airdrop.
+airdrop_tx_window = int(os.environ.get("AIRDROP_TX_WINDOW") or AIRDROP_TX_WINDOW)
+AIRDROP_PLAN_FILE = os.environ.get("AIRDROP_PLAN_FILE", "airdropPlan.json")
 
 DEPLOYER = cf_accs[DEPLOYER_ACCOUNT_INDEX]
 
+# Set ADDRESS_CHECKER_ADDRESS to verify the balances in batches of eth_calls instead of one
+# balanceOf call per recipient
+ADDRESS_CHECKER_ADDRESS = os.environ.get("ADDRESS_CHECKER_ADDRESS")
+
 print(f"DEPLOYER = {DEPLOYER}")
 transaction_params()
 
@@ -121,12 +143,28 @@ def main():
         sum(recipient_to_amount_E18.values()) == flip_total_E18
     ), "Total amount doesn't match"
 
+    # Columns are materialized once, batches are slices of them
+    recipients = list(recipient_to_amount_E18.keys())
+    amounts_E18 = list(recipient_to_amount_E18.values())
+
+    # A plan file left by a previous run is resumed, skipping the batches already airdropped
+    plan = None
+    pending_total_E18 = flip_total_E18
+    if os.path.isfile(AIRDROP_PLAN_FILE):
+        plan = read_airdrop_plan(AIRDROP_PLAN_FILE, flip, recipients, amounts_E18)
+        update_sent_batches(plan, DEPLOYER)
+        write_airdrop_plan(AIRDROP_PLAN_FILE, plan)
+        pending_total_E18 = sum(batch["total"] for batch in pending_batches(plan))
+        print(
+            f"Resuming airdrop from {AIRDROP_PLAN_FILE}, {pending_total_E18/E_18:,} FLIP left to airdrop"
+        )
+
     print("Deployer balance: ", flip.balanceOf(DEPLOYER) / E_18)
-    print(f"Amount of FLIP required    = {flip_total_E18/E_18:,}")
-    assert flip_total_E18 <= flip.balanceOf(
+    print(f"Amount of FLIP required    = {pending_total_E18/E_18:,}")
+    assert pending_total_E18 <= flip.balanceOf(
         DEPLOYER
     ), "Not enough FLIP tokens to fund the vestings"
-    expected_final_balance = flip.balanceOf(DEPLOYER) - flip_total_E18
+    expected_final_balance = flip.balanceOf(DEPLOYER) - pending_total_E18
 
     # For live deployment, add a confirmation step to allow the user to verify the row.
     print(f"DEPLOYER = {DEPLOYER}")
@@ -140,35 +178,69 @@ def main():
     print(f"Final deployer's FLIP balance   = {expected_final_balance:,}")
     print(f"Final deployer's FLIP balance / E_18   = {expected_final_balance / E_18:,}")
 
-    transfer_batch_size = 100
-    batches = []
-
-    # Iterate over batches of 100 lists
-    for i in range(0, len(recipient_to_amount_E18), transfer_batch_size):
-        recipient_batch = list(recipient_to_amount_E18.keys())[
-            i : i + transfer_batch_size
-        ]
-        amounts_E18_batch = list(recipient_to_amount_E18.values())[
-            i : i + transfer_batch_size
-        ]
-
-        assert len(recipient_batch) == len(amounts_E18_batch), "Length doesn't match"
-        assert len(recipient_batch) <= transfer_batch_size, "Length doesn't match"
-        # Process the batch
-        total_amount_batch = 0
-        for amount in amounts_E18_batch:
-            total_amount_batch += amount
-        batches.append([recipient_batch, amounts_E18_batch, total_amount_batch])
+    # Multisend using wenTokens optimized airdrop tool
+    # Same address in mainnet and test networks
+    airdrop_contract = IAirdropContract(address_wenTokens)
+
+    # The allowance left by a previous run is exactly what its pending batches need
+    allowance = flip.allowance(DEPLOYER, address_wenTokens)
+    approved = allowance == pending_total_E18
+    assert (
+        approved or allowance == 0
+    ), "Allowance doesn't match the pending batches, check the airdrop transactions"
+
+    def approve():
+        flip.approve(
+            address_wenTokens,
+            pending_total_E18,
+            {"from": DEPLOYER, "required_confs": 1},
+        )
 
+    # Batches are sized by gas, and the estimates need the approval. It's simulated with a
+    # state override so that the plan can be reviewed before approving. Nodes that don't
+    # support state overrides need the approval to be sent first.
+    if plan is None:
+        print("Planning airdrop batches...")
+        state_override = None
+        if not approved:
+            state_override = allowance_override(
+                flip, DEPLOYER, address_wenTokens, pending_total_E18
+            )
+        if approved or state_override is not None:
+            try:
+                plan = plan_airdrop(
+                    airdrop_contract,
+                    flip,
+                    DEPLOYER,
+                    recipients,
+                    amounts_E18,
+                    state_override=state_override,
+                )
+            except ValueError as e:
+                print(f"Couldn't estimate the batches before the approval: {e}")
+        if plan is None:
+            prompt_user_continue_or_break(
+                "Can't plan the batches before the approval. Approving Token to plan them",
+                True,
+            )
+            approve()
+            approved = True
+            plan = plan_airdrop(
+                airdrop_contract, flip, DEPLOYER, recipients, amounts_E18
+            )
+        write_airdrop_plan(AIRDROP_PLAN_FILE, plan)
+
+    batches = plan["batches"]
     total_amount_batches = 0
     total_number_recipients = 0
     print(f"\nNumber of batches = {len(batches)}")
     for i, batch in enumerate(batches):
+        status = "pending" if batch["blockNumber"] is None else "done"
         print(
-            f"   Batch {i} has {len(batch[0]):>3} recipients and a total of {batch[2]/E_18} FLIP"
+            f"   Batch {i} has {len(batch['recipients']):>3} recipients and a total of {batch['total']/E_18} FLIP ({status})"
         )
-        total_amount_batches += batch[2]
-        total_number_recipients += len(batch[0])
+        total_amount_batches += batch["total"]
+        total_number_recipients += len(batch["recipients"])
     assert total_amount_batches == flip_total_E18, "Total amount doesn't match"
     assert total_number_recipients == len(
         recipient_to_amount_E18
@@ -176,52 +248,69 @@ def main():
 
     print(f"Total unique recipients = {total_number_recipients}")
     print(f"Total amount to airdrop = {total_amount_batches/E_18}")
+    print(f"Airdrop plan written to {AIRDROP_PLAN_FILE}")
+
     prompt_user_continue_or_break(
         "Airdrop with the parameter above. Approving Token", True
     )
-
-    # Multisend using wenTokens optimized airdrop tool
-    # Same address in mainnet and test networks
-    airdrop_contract = IAirdropContract(address_wenTokens)
-
-    flip.approve(
-        address_wenTokens,
-        flip_total_E18,
-        {"from": DEPLOYER, "required_confs": 1},
-    )
+    if not approved:
+        approve()
 
     prompt_user_continue_or_break("Token approved. Proceedding with the transfer", True)
 
-    for batch in batches:
-        print("Airdropping batch with total amount of ", batch[2] / E_18, " FLIP")
-        airdrop_contract.airdropERC20(
-            flip,
-            batch[0],
-            batch[1],
-            batch[2],
-            {"from": DEPLOYER, "required_confs": 1},
-        )
+    # All the batches are signed and broadcasted with consecutive nonces upfront (up to
+    # airdrop_tx_window in flight) and their confirmations are tracked together
+    send_airdrop_batches(
+        AIRDROP_PLAN_FILE,
+        plan,
+        airdrop_contract,
+        flip,
+        DEPLOYER,
+        window=airdrop_tx_window,
+        on_sent=lambda i, txHash: print(f"Airdropping batch {i} in tx {txHash}"),
+    )
 
     print("Airdrop done!")
 
-    # Wait to make sure all contracts are deployed and we don't get a failure when doing checks
-    if chain.id not in [eth_localnet, arb_localnet, hardhat]:
-        print("Waiting for a short time for safety...")
-        time.sleep(12)
-
-    print("Verifying airdop...")
-    assert flip.allowance(DEPLOYER, address_wenTokens) == 0, "Allowance not correct"
+    verify_block = max(batch["blockNumber"] for batch in batches)
 
-    for i, (recipient, amount_E18) in enumerate(recipient_to_amount_E18.items()):
-        balance = flip.balanceOf(recipient)
-        assert (
-            flip.balanceOf(recipient) == amount_E18
-        ), f"Tokens not transferred correctly, expecting {amount_E18} but got {balance} for recipient {recipient}"
-        print(
-            f"- {str(i):>3}: Recipient {recipient} has been airdropped {str(amount_E18/E_18):>8} FLIP"
-        )
+    # Wait for the last batch to be deep enough to not be reorged and check all the balances
+    # at that block, so the checks don't depend on which node serves each call
+    if chain.id not in [eth_localnet, arb_localnet, hardhat]:
+        print(f"Waiting for {verify_confirmations} confirmations...")
+        wait_for_confirmations(verify_block, verify_confirmations)
 
-    assert expected_final_balance == flip.balanceOf(DEPLOYER), "Incorrect final balance"
+    print(f"Verifying airdop at block {verify_block}...")
+    assert (
+        flip.allowance(DEPLOYER, address_wenTokens, block_identifier=verify_block) == 0
+    ), "Allowance not correct"
+
+    addressChecker = None
+    if ADDRESS_CHECKER_ADDRESS is not None:
+        addressChecker = AddressChecker.at(ADDRESS_CHECKER_ADDRESS)
+    balances = get_token_balances(
+        addressChecker,
+        flip,
+        recipients + [DEPLOYER],
+        block_identifier=verify_block,
+        on_progress=lambda done, total: print(
+            f"Fetched {done}/{total} balances", end="\r"
+        ),
+    )
+    print()
+
+    mismatches = 0
+    for recipient, balance in zip(recipients, balances):
+        amount_E18 = recipient_to_amount_E18[recipient]
+        if balance != amount_E18:
+            mismatches += 1
+            print(
+                f"Tokens not transferred correctly, expecting {amount_E18} but got {balance} for recipient {recipient}"
+            )
+    assert mismatches == 0, f"{mismatches} recipients not airdropped correctly"
+    print(f"All {len(recipients)} recipients have been airdropped correctly")
+
+    assert expected_final_balance == balances[-1], "Incorrect final balance"
 
     print(f"Final deployer's FLIP balance   = {expected_final_balance}")
     print(f"Final deployer's FLIP balance / E_18  = {expected_final_balance / E_18}")
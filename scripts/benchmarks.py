@@ -0,0 +1,89 @@
+import sys
+import os
+import time
+
+sys.path.append(os.path.abspath("tests"))
+from consts import *
+from brownie import Deposit
+
+# Microbenchmarks for the python tooling used by the tests and the scripts. They don't
+# interact with any contract, so any network will do.
+# Run with `brownie run benchmarks <function_name> --network hardhat`
+
+NUM_ITERATIONS = int(os.environ.get("NUM_ITERATIONS") or 1000)
+
+
+# Time `fcn` over all the inputs and return the results so they can be compared
+def _time_fcn(label, fcn, inputs):
+    initial_time = time.perf_counter()
+    results = [fcn(input) for input in inputs]
+    elapsed = time.perf_counter() - initial_time
+    print(
+        f"{label:<35} {len(inputs)} calls in {elapsed:.3f}s ({elapsed / len(inputs) * 10**6:.1f} us/call)"
+    )
+    return results, elapsed
+
+
+def signer():
+    msgHashes = [
+        keccak(i.to_bytes(32, byteorder="big")).hex() for i in range(NUM_ITERATIONS)
+    ]
+
+    # Build the generator table outside of the measurement
+    AGG_SIGNER_1.sign(msgHashes[0])
+
+    reference, reference_time = _time_fcn(
+        "Signer.sign_py_ecc", AGG_SIGNER_1.sign_py_ecc, msgHashes
+    )
+    fast, fast_time = _time_fcn("Signer.sign", AGG_SIGNER_1.sign, msgHashes)
+
+    assert reference == fast, "Signatures don't match"
+    print(f"Speedup: {reference_time / fast_time:.1f}x")
+
+
+def sign_batch():
+    msgHashes = [
+        keccak(i.to_bytes(32, byteorder="big")).hex() for i in range(NUM_ITERATIONS)
+    ]
+
+    initial_time = time.perf_counter()
+    sigDatas = AGG_SIGNER_1.sign_batch(ZERO_ADDR, msgHashes, {AGG: 0})
+    elapsed = time.perf_counter() - initial_time
+    print(f"Signer.sign_batch signed {len(sigDatas)} msgHashes in {elapsed:.3f}s")
+
+
+def create2():
+    vault_address = "0xe7f1725E7734CE288F8367e1Bb143E90bb3F0512"
+    argsHex = cleanHexStrPad(NATIVE_ADDR)
+    swapIDs = list(range(NUM_ITERATIONS))
+
+    reference, reference_time = _time_fcn(
+        "getCreate2Addr",
+        lambda swapID: getCreate2Addr(
+            vault_address, cleanHexStrPad(swapID), Deposit, argsHex
+        ),
+        swapIDs,
+    )
+
+    initial_time = time.perf_counter()
+    addresses = list(getCreate2Addrs(vault_address, swapIDs, Deposit, argsHex))
+    checksum_time = time.perf_counter() - initial_time
+    assert reference == addresses, "Addresses don't match"
+    print(
+        f"getCreate2Addrs                     speedup {reference_time / checksum_time:.1f}x"
+    )
+
+    initial_time = time.perf_counter()
+    addresses = list(
+        getCreate2Addrs(vault_address, swapIDs, Deposit, argsHex, checksum=False)
+    )
+    raw_time = time.perf_counter() - initial_time
+    print(
+        f"getCreate2Addrs (checksum=False)    speedup {reference_time / raw_time:.1f}x"
+    )
+
+
+def main():
+    signer()
+    sign_batch()
+    create2()
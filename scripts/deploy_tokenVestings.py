@@ -1,17 +1,24 @@
 import sys
 import os
 import csv
-import time
 
 sys.path.append(os.path.abspath("tests"))
 from consts import *
 from deploy import (
     deploy_addressHolder,
-    deploy_tokenVestingStaking,
-    deploy_tokenVestingNoStaking,
     transaction_params,
 )
-from utils import prompt_user_continue_or_break
+from utils import prompt_user_continue_or_break, getCreateAddr
+from tx_pipeline import TxPipeline, wait_for_confirmations
+from receipt_tracker import batch_eth_call
+from airdrop_batches import (
+    plan_airdrop,
+    pending_batches,
+    read_airdrop_plan,
+    send_airdrop_batches,
+    update_sent_batches,
+    write_airdrop_plan,
+)
 from brownie import (
     project,
     chain,
@@ -34,6 +41,10 @@ address_wenTokens = "0x2c952eE289BbDB3aEbA329a4c41AE4C836bcc231"
 # parameters described in the order dictionary below but it can have others, which will be ignored.
 VESTING_INFO_FILE = os.environ["VESTING_INFO_FILE"]
 DEPLOYMENT_INFO_FILE = os.environ["DEPLOYMENT_INFO_FILE"]
+# Airdrop of the tokens to the vesting contracts, updated as the batches are confirmed
+VESTING_AIRDROP_PLAN_FILE = os.environ.get(
+    "VESTING_AIRDROP_PLAN_FILE", "vestingAirdropPlan.json"
+)
 columns = [
     "Full name/Company Name",
     "Email Address",
@@ -62,6 +73,9 @@ DEPLOYER_ACCOUNT_INDEX = int(os.environ.get("DEPLOYER_ACCOUNT_INDEX") or 0)
 
 DEPLOYER = cf_accs[DEPLOYER_ACCOUNT_INDEX]
 
+# Maximum number of vesting deployments in flight
+vesting_tx_window = int(os.environ.get("VESTING_TX_WINDOW") or 64)
+
 print(f"DEPLOYER = {DEPLOYER}")
 transaction_params()
 
@@ -268,8 +282,18 @@ def main():
             stFlip_address,
         )
 
-        # Deploy all the vesting contracts
-        for vesting in vesting_list:
+        # Deploy all the vesting contracts. The deployments are signed with local nonces and
+        # sent without waiting for the previous ones, so the address of each contract is known
+        # (from the deployer and its nonce) before anything is broadcasted.
+        pipeline = TxPipeline(
+            DEPLOYER,
+            window=vesting_tx_window,
+            on_sent=lambda i, txHash: print(
+                f"Deploying vesting {i} for beneficiary {vesting_list[i][0]} in tx {txHash}"
+            ),
+        )
+        deploy_txs = []
+        for i, vesting in enumerate(vesting_list):
             (
                 beneficiary,
                 amount_E18,
@@ -279,23 +303,17 @@ def main():
             ) = vesting
 
             if lockup_type == options_lockup_type[0]:
-
-                tv = deploy_tokenVestingStaking(
-                    DEPLOYER,
-                    TokenVestingStaking,
+                data = TokenVestingStaking.deploy.encode_input(
                     beneficiary,
                     revoker,
                     staking_start,
                     staking_end,
                     transferable_beneficiary,
                     addressHolder.address,
-                    flip,
+                    flip.address,
                 )
-
             elif lockup_type == options_lockup_type[1]:
-                tv = deploy_tokenVestingNoStaking(
-                    DEPLOYER,
-                    TokenVestingNoStaking,
+                data = TokenVestingNoStaking.deploy.encode_input(
                     beneficiary,
                     revoker,
                     noStaking_cliff,
@@ -306,54 +324,79 @@ def main():
                 raise Exception(
                     f"Incorrect lockup type parameter {lockup_type}. Should have been dropped earlier"
                 )
-            vesting.append(tv)
+            vesting.append(getCreateAddr(DEPLOYER, pipeline.nonce + i))
+            deploy_txs.append({"data": data})
 
-        # Wait to make sure all contracts are deployed and we don't get a failure when doing checks
-        if chain.id not in [eth_localnet, arb_localnet, hardhat]:
-            print("Waiting for a short time for safety...")
-            time.sleep(36)
-
-        # Write the data to a CSV file
-        print(f"Storing deployment info in {DEPLOYMENT_INFO_FILE}")
-        with open(DEPLOYMENT_INFO_FILE, "w", newline="") as csvfile:
+        # Record the addresses before broadcasting anything. The file is only moved to
+        # DEPLOYMENT_INFO_FILE once all the contracts are deployed and verified.
+        print(f"Storing expected deployment info in {DEPLOYMENT_INFO_FILE}.pending")
+        with open(DEPLOYMENT_INFO_FILE + ".pending", "w", newline="") as csvfile:
             writer = csv.writer(csvfile)
             writer.writerows(vesting_list)
 
+        try:
+            for i, tx in enumerate(deploy_txs):
+                pipeline.send(tx, label=i)
+            receipts = pipeline.wait_all()
+        finally:
+            pipeline.close()
+        for vesting, receipt in zip(vesting_list, receipts):
+            assert (
+                receipt["contractAddress"] == vesting[5]
+            ), f"Vesting deployed at {receipt['contractAddress']} instead of {vesting[5]}"
+
+        # Wait to make sure all contracts are deployed and we don't get a failure when doing checks
+        verify_block = receipts[-1]["blockNumber"]
+        if chain.id not in [eth_localnet, arb_localnet, hardhat]:
+            print("Waiting for confirmations...")
+            wait_for_confirmations(verify_block, transaction_params())
+
         # AddressHolder deployment will already wait for several confirmations
         print("Address holder deployed at: ", addressHolder.address)
 
+        # The state of all the contracts is fetched in batched eth_calls
         print("Verifying correct deployment of vesting contracts...")
-        for vesting in vesting_list:
+        states = getVestingStates(vesting_list, verify_block)
+        for vesting, state in zip(vesting_list, states):
             (
                 beneficiary,
                 amount_E18,
                 lockup_type,
                 transferable_beneficiary,
                 revoker,
-                tv,
+                tv_address,
             ) = vesting
+            assert state is not None, f"Vesting not deployed at {tv_address}"
 
             if lockup_type == options_lockup_type[0]:
                 assert (
-                    tv.addressHolder() == addressHolder.address
+                    state["addressHolder"] == addressHolder.address
                 ), "Address holder not set correctly"
-                assert tv.FLIP() == flip.address, "FLIP not set correctly"
-                assert tv.start() == staking_start, "Staking end not set correctly"
-                assert tv.end() == staking_end, "NoStaking end not set correctly"
+                assert state["FLIP"] == flip.address, "FLIP not set correctly"
+                assert state["start"] == staking_start, "Staking end not set correctly"
+                assert state["end"] == staking_end, "NoStaking end not set correctly"
 
             else:
                 assert (
-                    tv.cliff() == noStaking_cliff
+                    state["cliff"] == noStaking_cliff
                 ), "NoStaking Cliff not set correctly"
-                assert tv.end() == noStaking_end, "NoStaking end not set correctly"
+                assert state["end"] == noStaking_end, "NoStaking end not set correctly"
 
-            assert tv.getBeneficiary() == beneficiary, "Beneficiary not set correctly"
-            assert tv.getRevoker() == revoker, "Revoker not set correctly"
+            assert state["getBeneficiary"] == web3.toChecksumAddress(
+                beneficiary
+            ), "Beneficiary not set correctly"
+            assert state["getRevoker"] == web3.toChecksumAddress(
+                revoker
+            ), "Revoker not set correctly"
 
             assert (
-                tv.transferableBeneficiary() == transferable_beneficiary
+                state["transferableBeneficiary"] == transferable_beneficiary
             ), "Transferability not set correctly"
 
+        # Write the data to a CSV file
+        print(f"Storing deployment info in {DEPLOYMENT_INFO_FILE}")
+        os.replace(DEPLOYMENT_INFO_FILE + ".pending", DEPLOYMENT_INFO_FILE)
+
     prompt_user_continue_or_break(
         "Deployment of contracts finalized. Proceeding with token airdrop", True
     )
@@ -372,30 +415,60 @@ def main():
     vesting_amounts_E18 = [vesting[1] for vesting in vesting_list]
     assert len(vesting_addresses) == len(vesting_amounts_E18)
 
-    if "expected_final_balance" not in locals():
-        expected_final_balance = flip.balanceOf(DEPLOYER) - sum(vesting_amounts_E18)
+    # A plan left by a previous run is resumed, skipping the batches already airdropped
+    plan = None
+    pending_total_E18 = sum(vesting_amounts_E18)
+    if os.path.isfile(VESTING_AIRDROP_PLAN_FILE):
+        plan = read_airdrop_plan(
+            VESTING_AIRDROP_PLAN_FILE, flip, vesting_addresses, vesting_amounts_E18
+        )
+        update_sent_batches(plan, DEPLOYER)
+        write_airdrop_plan(VESTING_AIRDROP_PLAN_FILE, plan)
+        pending_total_E18 = sum(batch["total"] for batch in pending_batches(plan))
 
-    total_amount_E18 = sum(vesting_amounts_E18)
+    if "expected_final_balance" not in locals():
+        expected_final_balance = flip.balanceOf(DEPLOYER) - pending_total_E18
 
     # Same address in mainnet and test networks
     airdrop_contract = IAirdropContract(address_wenTokens)
 
-    flip.approve(
-        address_wenTokens,
-        total_amount_E18,
-        {"from": DEPLOYER, "required_confs": 1},
-    )
-    airdrop_contract.airdropERC20(
+    # The allowance left by a previous run is exactly what its pending batches need
+    allowance = flip.allowance(DEPLOYER, address_wenTokens)
+    if allowance != pending_total_E18:
+        assert (
+            allowance == 0
+        ), "Allowance doesn't match the pending batches, check the airdrop transactions"
+        flip.approve(
+            address_wenTokens,
+            pending_total_E18,
+            {"from": DEPLOYER, "required_confs": 1},
+        )
+
+    # Batches are sized by gas, which needs the approval for the estimates to succeed
+    if plan is None:
+        plan = plan_airdrop(
+            airdrop_contract, flip, DEPLOYER, vesting_addresses, vesting_amounts_E18
+        )
+        write_airdrop_plan(VESTING_AIRDROP_PLAN_FILE, plan)
+
+    # All the batches are signed and broadcasted with consecutive nonces upfront and their
+    # confirmations are tracked together
+    send_airdrop_batches(
+        VESTING_AIRDROP_PLAN_FILE,
+        plan,
+        airdrop_contract,
         flip,
-        vesting_addresses,
-        vesting_amounts_E18,
-        total_amount_E18,
-        {"from": DEPLOYER, "required_confs": 1},
+        DEPLOYER,
+        on_sent=lambda i, txHash: print(f"Airdropping batch {i} in tx {txHash}"),
     )
-    # Wait to make sure all contracts are deployed and we don't get a failure when doing checks
+
+    # Wait to make sure the last batch won't be reorged before doing the checks
     if chain.id not in [eth_localnet, arb_localnet, hardhat]:
-        print("Waiting for a short time for safety...")
-        time.sleep(12)
+        print("Waiting for confirmations...")
+        wait_for_confirmations(
+            max(batch["blockNumber"] for batch in plan["batches"]),
+            transaction_params(),
+        )
 
     assert flip.allowance(DEPLOYER, address_wenTokens) == 0, "Allowance not correct"
 
@@ -422,6 +495,65 @@ def main():
     print(f"Final deployer's FLIP balance // E_18  = {expected_final_balance // E_18}")
 
 
+# Getters checked for each type of vesting contract
+vesting_getters = {
+    options_lockup_type[0]: [
+        "addressHolder",
+        "FLIP",
+        "start",
+        "end",
+        "getBeneficiary",
+        "getRevoker",
+        "transferableBeneficiary",
+    ],
+    options_lockup_type[1]: [
+        "cliff",
+        "end",
+        "getBeneficiary",
+        "getRevoker",
+        "transferableBeneficiary",
+    ],
+}
+
+
+# Fetch the getters of all the vesting contracts at `block` in batched eth_calls. Returns a
+# dict of getter => value per vesting, or None if there is no contract at its address.
+def getVestingStates(vesting_list, block):
+    containers = {
+        options_lockup_type[0]: TokenVestingStaking,
+        options_lockup_type[1]: TokenVestingNoStaking,
+    }
+    calls = []
+    outputs = []
+    for vesting in vesting_list:
+        lockup_type, tv_address = vesting[2], vesting[5]
+        contract = web3.eth.contract(abi=containers[lockup_type].abi)
+        for getter in vesting_getters[lockup_type]:
+            calls.append((tv_address, contract.encodeABI(fn_name=getter)))
+            outputs.append(
+                [
+                    output["type"]
+                    for output in contract.get_function_by_name(getter).abi["outputs"]
+                ]
+            )
+
+    results = iter(zip(batch_eth_call(calls, block_identifier=block), outputs))
+    states = []
+    for vesting in vesting_list:
+        state = {}
+        for getter in vesting_getters[vesting[2]]:
+            result, types = next(results)
+            # Calls to an address without code return no data
+            if state is not None and len(result) > 0:
+                (state[getter],) = web3.codec.decode_abi(types, result)
+                if types[0] == "address":
+                    state[getter] = web3.toChecksumAddress(state[getter])
+            else:
+                state = None
+        states.append(state)
+    return states
+
+
 def release():
     token_vesting_address = os.environ["TOKEN_VESTING_ADDRESS"]
     token_vesting = TokenVestingStaking.at(f"0x{cleanHexStr(token_vesting_address)}")
@@ -1,10 +1,13 @@
 import sys
+import csv
 from os import environ, path
 
 sys.path.append(path.abspath("tests"))
 from consts import *
+from receipt_tracker import ReceiptTracker
+from tx_pipeline import get_fees
 
-from brownie import accounts, StateChainGateway, FLIP
+from brownie import accounts, web3, StateChainGateway, FLIP
 
 FLIP_ADDRESS = environ["FLIP_ADDRESS"]
 SC_GATEWAY_ADDRESS = environ["SC_GATEWAY_ADDRESS"]
@@ -16,6 +19,11 @@ NODE_ID_FILE = environ["NODE_ID_FILE"]
 
 DEPLOYER_ACCOUNT_INDEX = int(environ.get("DEPLOYER_ACCOUNT_INDEX") or 0)
 
+# Only used by concurrent_funding
+FUNDING_SUMMARY_FILE = environ.get("FUNDING_SUMMARY_FILE", "fundingSummary.csv")
+FUNDING_DROP_TIMEOUT = int(environ.get("FUNDING_DROP_TIMEOUT") or 120)
+FUNDING_GAS_LIMIT = 1000000
+
 cf_accs = accounts.from_mnemonic(AUTONOMY_SEED, count=10)
 
 node_ids = []
@@ -24,26 +32,114 @@ funding_amount = FLIP_AMOUNT * E_18
 
 
 def main():
+    stateChainGateway, funder, node_ids = approve_funding()
+    for i, node_id in enumerate(node_ids):
+        to_fund = funding_amount + (i * E_18)
+        tx = stateChainGateway.fundStateChainAccount(
+            node_id,
+            to_fund,
+            {"from": funder, "required_confs": 0, "gas_limit": FUNDING_GAS_LIMIT},
+        )
+        print(f"Funding {to_fund / E_18} FLIP to node {node_id} in tx {tx.txid}")
+
+
+# Same as main but all the funding transactions are built and signed upfront with sequential
+# local nonces and the same fees, broadcasted back to back in nonce order (nodes reject nonce
+# gaps) and their receipts are then fetched in bulk. The result of every funding is written to
+# FUNDING_SUMMARY_FILE, including the transactions that couldn't be broadcasted.
+def concurrent_funding():
+    stateChainGateway, funder, node_ids = approve_funding()
+
+    nonce = web3.eth.get_transaction_count(str(funder), "pending")
+    fees = get_fees()
+    chainId = web3.eth.chain_id
+    signedTxs = []
+    for i, node_id in enumerate(node_ids):
+        to_fund = funding_amount + (i * E_18)
+        tx = {
+            "to": stateChainGateway.address,
+            "data": stateChainGateway.fundStateChainAccount.encode_input(
+                node_id, to_fund
+            ),
+            "value": 0,
+            "gas": FUNDING_GAS_LIMIT,
+            "nonce": nonce + i,
+            "chainId": chainId,
+            **fees,
+        }
+        signedTxs.append(web3.eth.account.sign_transaction(tx, funder.private_key))
+    print(f"Signed {len(signedTxs)} funding transactions")
+
+    txHashes = [""] * len(signedTxs)
+    statuses = ["not sent"] * len(signedTxs)
+    errors = [""] * len(signedTxs)
+    try:
+        for i, signedTx in enumerate(signedTxs):
+            try:
+                txHashes[i] = web3.eth.send_raw_transaction(
+                    signedTx.rawTransaction
+                ).hex()
+            except Exception as e:
+                statuses[i] = "failed"
+                errors[i] = str(e)
+                # The following nonces can't be included until this one is
+                print(f"Failed to broadcast funding of node {node_ids[i]}: {e}")
+                break
+            statuses[i] = "pending"
+            to_fund = funding_amount + (i * E_18)
+            print(
+                f"Funding {to_fund / E_18} FLIP to node {node_ids[i]} in tx {txHashes[i]}"
+            )
+
+        # Transactions are only taken as dropped once their nonce is used by another
+        # transaction or the node hasn't known them for FUNDING_DROP_TIMEOUT seconds
+        sent = {
+            txHash: (str(funder), nonce + i)
+            for i, txHash in enumerate(txHashes)
+            if txHash
+        }
+        with ReceiptTracker(drop_timeout=FUNDING_DROP_TIMEOUT) as tracker:
+            receipts = tracker.wait(
+                list(sent),
+                on_progress=lambda confirmed, total: print(
+                    f"Confirmed {confirmed}/{total} funding transactions", end="\r"
+                ),
+                drop_unknown=True,
+                nonces=sent,
+            )
+        print()
+
+        for i, txHash in enumerate(txHashes):
+            if txHash:
+                receipt = receipts[txHash]
+                if receipt is None:
+                    statuses[i] = "dropped"
+                else:
+                    statuses[i] = "success" if receipt["status"] == 1 else "reverted"
+    finally:
+        # Written even if tracking fails, so the hashes already broadcasted aren't lost
+        with open(FUNDING_SUMMARY_FILE, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["node_id", "tx_hash", "status", "error"])
+            writer.writerows(zip(node_ids, txHashes, statuses, errors))
+        print(f"Summary written to {FUNDING_SUMMARY_FILE}")
+
+    failed = len(statuses) - statuses.count("success")
+    print(f"Funded {len(statuses) - failed} nodes, {failed} failed")
+
+
+def approve_funding():
     flip = FLIP.at(f"0x{cleanHexStr(FLIP_ADDRESS)}")
     stateChainGateway = StateChainGateway.at(f"0x{cleanHexStr(SC_GATEWAY_ADDRESS)}")
     with open(NODE_ID_FILE, "r") as f:
-        node_ids = f.readlines()
-        f.close()
+        node_ids = [node_id.strip() for node_id in f.readlines()]
     funder = cf_accs[DEPLOYER_ACCOUNT_INDEX]
     to_approve = flip.balanceOf(funder)
     tx = flip.approve(
         stateChainGateway, to_approve, {"from": funder, "required_confs": 1}
     )
     print(f"Approving {to_approve / E_18} FLIP in tx {tx.txid}")
-    for i, node_id in enumerate(node_ids):
-        to_fund = funding_amount + (i * E_18)
-        node_id = node_id.strip()
-        tx = stateChainGateway.fundStateChainAccount(
-            node_id,
-            to_fund,
-            {"from": funder, "required_confs": 0, "gas_limit": 1000000},
-        )
-        print(f"Funding {to_fund / E_18} FLIP to node {node_id} in tx {tx.txid}")
+    return stateChainGateway, funder, node_ids
 
 
 def cleanHexStr(thing):
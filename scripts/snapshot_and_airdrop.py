@@ -4,11 +4,22 @@ import csv
 import logging
 import os.path
 import math
+import json
 
 sys.path.append(os.path.abspath("tests"))
 from consts import ZERO_ADDR, INIT_SUPPLY, E_18
-from utils import fetch_events, get_contract_object
-from brownie import chain, accounts, FLIP, web3, network, MultiSend
+from utils import (
+    get_contract_object,
+    get_token_balances,
+    reconcileAirdrop,
+)
+from event_cache import EventCache, EVENT_CACHE_CONFIRMATIONS
+from snapshot_file import SnapshotFile, write_snapshot_file
+from tx_pipeline import TxPipeline, wait_for_pending_transactions
+from receipt_tracker import ReceiptTracker
+from batch_planner import BatchPlanner
+from eth_abi import encode_abi
+from brownie import chain, accounts, FLIP, web3, network, MultiSend, AddressChecker
 
 
 logname = "airdrop.log"
@@ -44,12 +55,34 @@ airdropScGatewaySuccess = "Airdrop to ScGateway sent and confirmed!"
 airdropSuccessMessage = "😎  Airdrop transactions sent and confirmed! 😎"
 multiSendDeploySuccessMessage = "MultiSend deployed at: "
 
-# Amount of transfers per transaction so we don't reach gas limit
+# Maximum amount of transfers per transaction. Batches are sized by gas (airdrop_gas_ceiling)
+# up to this amount.
 # NOTE: When forking with hardhat, doing more than 100 transfers per transaction times out.
 # However in a real network we can easily do 200, gas limit is the only limitation.
 # We can fork at a particular block doing this --fork-block-number 14390000
 transfer_batch_size = 200
 
+# Gas budget of every airdrop transaction. Well below the block gas limit so the transactions
+# are easily included.
+airdrop_gas_ceiling = 10000000
+
+# Maximum number of airdrop transactions in flight (sent but not confirmed)
+airdrop_tx_window = 16
+
+# Differences between the snapshot and the airdrop transfers found by verifyAirdrop
+airdropReportFilename = "airdropVerificationReport.csv"
+
+# Block range and number of concurrent requests when fetching events
+log_fetch_chunk_size = 10000
+log_fetch_workers = 8
+
+# Local store of the fetched Transfer events so following runs only fetch the new blocks
+eventCacheFilename = "transferEvents.db"
+
+# Balances are checkpointed at most every this many blocks while taking the snapshot
+snapshotCheckpointFilename = "snapshotCheckpoint.json"
+snapshot_checkpoint_interval = 100000
+
 # Set the priority fee for all transactions
 network.priority_fee("1 gwei")
 
@@ -69,6 +102,11 @@ def main():
     # Use alchemy when running the old flip snapshot function
     snapshot_blocknumber = os.environ.get("SNAPSHOT_BLOCKNUMBER")
 
+    # Set ADDRESS_CHECKER_ADDRESS to verify the balances of all the holders in batches. It doesn't
+    # need to have been deployed before the snapshot block as long as the node supports state
+    # overrides in eth_call, otherwise the balances are checked one by one.
+    addressChecker_address = os.environ.get("ADDRESS_CHECKER_ADDRESS")
+
     # --------------------------- Start of the script logic  ----------------------------
 
     parsedLog = []
@@ -108,7 +146,12 @@ def main():
         if takeSnapshot not in userInputConfirm:
             printAndLog("Script stopped by user")
             return False
-        snapshot(int(snapshot_blocknumber), goerliOldFlip, oldFlipSnapshotFilename)
+        snapshot(
+            int(snapshot_blocknumber),
+            goerliOldFlip,
+            oldFlipSnapshotFilename,
+            addressChecker_address,
+        )
     else:
         printAndLog("Skipped old FLIP snapshot - snapshot already taken")
 
@@ -155,6 +198,7 @@ def main():
             newStateChainGateway,
             airdropScGatewaySuccess not in parsedLog,
             multiSend_address,
+            parsedLog,
         )
     else:
         printAndLog("Skipped Airdrop - already completed succesfully")
@@ -169,84 +213,243 @@ def main():
     )
 
 
+# Take a new snapshot from an existing binary snapshot (PREVIOUS_SNAPSHOT, by default the one of
+# the airdrop) only processing the blocks after it. Run with:
+# brownie run snapshot_and_airdrop incrementalSnapshot --network goerli
+def incrementalSnapshot():
+    previous_snapshot = os.environ.get(
+        "PREVIOUS_SNAPSHOT", getBinarySnapshotFilename(oldFlipSnapshotFilename)
+    )
+    snapshot_blocknumber = int(
+        os.environ.get("SNAPSHOT_BLOCKNUMBER") or web3.eth.block_number
+    )
+    addressChecker_address = os.environ.get("ADDRESS_CHECKER_ADDRESS")
+
+    previousSnapshot = SnapshotFile(previous_snapshot)
+    previous_blocknumber = previousSnapshot.snapshot_blocknumber
+    previousSnapshot.close()
+
+    name = os.path.splitext(oldFlipSnapshotFilename)[0]
+    snapshotFromPrevious(
+        previous_snapshot,
+        snapshot_blocknumber,
+        goerliOldFlip,
+        name + "_" + str(snapshot_blocknumber) + ".csv",
+        name
+        + "Delta_"
+        + str(previous_blocknumber)
+        + "_"
+        + str(snapshot_blocknumber)
+        + ".csv",
+        addressChecker_address,
+    )
+
+
 # Take a snapshot of all token holders and their balances at a certain block number. Store the data in a
 # csv file. Last line is used as a checksum stating the total number of holders and the total balance
 def snapshot(
     snapshot_blocknumber,
     goerliOldFlip,
     filename,
+    addressChecker_address=None,
 ):
     (oldFlipContract, oldFlipContractObject) = getContractFromAddress(
         "FLIP", goerliOldFlip
     )
-    # It will throw an error if there are more than 10.000 events (free Infura Limitation)
-    # Split it if that is the case - there is no time requirement anyway
+    # Resume from the latest checkpoint of the holders' balances (if any)
+    holder_dict, totalBalance, from_block = loadSnapshotCheckpoint(
+        goerliOldFlip, snapshot_blocknumber
+    )
 
-    # lets do a fetch every 10000 blocks - in total it's around 1,3M blocks. That's to avoid
-    # the providers 10k limits. It might need to be reduced to 1k if Infura rpc calls fail.
-    step = 10000
-    next_block = oldFlip_deployment_block + step
-    from_block = oldFlip_deployment_block
+    totalBalance += foldTransferEvents(
+        goerliOldFlip,
+        oldFlipContractObject,
+        holder_dict,
+        from_block,
+        snapshot_blocknumber,
+        totalBalance,
+    )
 
-    events = []
+    writeSnapshot(
+        oldFlipContract,
+        holder_dict,
+        totalBalance,
+        snapshot_blocknumber,
+        filename,
+        addressChecker_address,
+    )
 
-    while True:
-        print(
-            "Fetching events from block " + str(from_block) + " to " + str(next_block)
-        )
-        new_events = list(
-            fetch_events(
-                oldFlipContractObject.events.Transfer,
-                from_block=from_block,
-                to_block=next_block,
-            )
-        )
-        events.extend(new_events)
 
-        if next_block == snapshot_blocknumber:
-            break
-        else:
-            # Both from & to_block are inclusive
-            from_block = next_block + 1
-            next_block += step
-            if next_block > snapshot_blocknumber:
-                next_block = snapshot_blocknumber
-
-    # Alternative to avoid the slow getBalance calls which take hourse
-    print("Number of events to be processed: ", len(events))
-    totalBalance = 0
-    holder_dict = {}
-    for event in events:
-        if event.args["value"] == 0:
-            continue
+# Take a snapshot at a later block from an existing (binary) snapshot of the same token, only
+# folding the Transfer events after the block of the existing snapshot. Also write a csv with
+# the previous and new balance of every holder whose balance has changed.
+def snapshotFromPrevious(
+    previous_snapshot,
+    snapshot_blocknumber,
+    goerliOldFlip,
+    filename,
+    delta_filename,
+    addressChecker_address=None,
+):
+    (oldFlipContract, oldFlipContractObject) = getContractFromAddress(
+        "FLIP", goerliOldFlip
+    )
 
-        if event.args["from"] != "0x0000000000000000000000000000000000000000":
-            holder_dict[event.args["from"]] -= event.args["value"]
-            assert holder_dict[event.args["from"]] >= 0
-            if holder_dict[event.args["from"]] == 0:
-                del holder_dict[event.args["from"]]
-        else:
-            totalBalance += event.args["value"]
+    previousSnapshot = SnapshotFile(previous_snapshot)
+    previousSnapshot.verify()
+    previous_blocknumber = previousSnapshot.snapshot_blocknumber
+    assert previous_blocknumber <= snapshot_blocknumber, logging.error(
+        "Previous snapshot is after the snapshot block"
+    )
+    holder_dict = {
+        previousSnapshot.address(i): previousSnapshot.balance(i)
+        for i in range(len(previousSnapshot))
+    }
+    totalBalance = previousSnapshot.totalBalance
+    previousSnapshot.close()
+    printAndLog(
+        "Updating snapshot "
+        + previous_snapshot
+        + " from block "
+        + str(previous_blocknumber)
+        + " to block "
+        + str(snapshot_blocknumber)
+    )
+
+    previous_balances = {}
+    totalBalance += foldTransferEvents(
+        goerliOldFlip,
+        oldFlipContractObject,
+        holder_dict,
+        previous_blocknumber + 1,
+        snapshot_blocknumber,
+        totalBalance,
+        previous_balances,
+    )
 
-        if event.args["to"] != "0x0000000000000000000000000000000000000000":
-            holder_dict[event.args["to"]] = (
-                holder_dict.get(event.args["to"], 0) + event.args["value"]
+    writeSnapshot(
+        oldFlipContract,
+        holder_dict,
+        totalBalance,
+        snapshot_blocknumber,
+        filename,
+        addressChecker_address,
+    )
+
+    # Holders whose balance is back to the previous one after several transfers are skipped
+    delta_rows = [
+        [holder, previous_balance, holder_dict.get(holder, 0)]
+        for holder, previous_balance in sorted(previous_balances.items())
+        if holder_dict.get(holder, 0) != previous_balance
+    ]
+    with open(delta_filename, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(["holder", "previousBalance", "balance", "delta"])
+        for holder, previous_balance, balance in delta_rows:
+            writer.writerow(
+                [holder, previous_balance, balance, balance - previous_balance]
             )
-            assert holder_dict[event.args["to"]] > 0
-        else:
-            totalBalance -= event.args["value"]
+    printAndLog(
+        "Balance changes of "
+        + str(len(delta_rows))
+        + " holders written to "
+        + delta_filename
+    )
 
-    sorted_dict = dict(sorted(holder_dict.items(), key=lambda x: x[1], reverse=True))
 
-    # Verify that at least the most relevant accounts' balances are correct
-    print("Verifying balances of top holders")
-    for holder, balance in sorted_dict.items():
-        if balance < verify_amount_cutoff:
-            break
-        else:
-            assert balance == oldFlipContract.balanceOf(
-                holder, block_identifier=snapshot_blocknumber
+# Fold the Transfer events from `from_block` to `to_block` (inclusive) into `holder_dict`,
+# checkpointing the balances on the way. `totalBalance` is the total supply before `from_block`
+# (for the checkpoints). Returns the change in total supply. If `previous_balances` is passed,
+# the balance of every holder before its first transfer is stored in it.
+def foldTransferEvents(
+    token,
+    contractObject,
+    holder_dict,
+    from_block,
+    to_block,
+    totalBalance,
+    previous_balances=None,
+):
+    # Only checkpoint blocks that can't be reorged
+    confirmed_block = web3.eth.block_number - EVENT_CACHE_CONFIRMATIONS
+
+    # Providers limit the number of results (e.g. 10k events in Infura) and the block range
+    # of eth_getLogs. Fetch the range in chunks of 10k blocks concurrently. Chunks returning
+    # too many results are bisected and the chunk size adapts, so no manual tuning is needed.
+    # Events are stored locally so only the blocks not fetched in previous runs are requested.
+    print("Fetching events from block " + str(from_block) + " to " + str(to_block))
+    eventCache = EventCache(eventCacheFilename)
+    events = eventCache.fetch_events(
+        contractObject.events.Transfer,
+        from_block=from_block,
+        to_block=to_block,
+        chunk_size=log_fetch_chunk_size,
+        max_workers=log_fetch_workers,
+    )
+
+    # Alternative to avoid the slow getBalance calls which take hourse. Events are folded into
+    # the balances as they arrive so they are never all held in memory.
+    numberEvents = 0
+    supplyChange = 0
+    next_checkpoint = from_block + snapshot_checkpoint_interval - 1
+    for event in events:
+        # All the events before this block have already been folded
+        if next_checkpoint < event.blockNumber and event.blockNumber <= confirmed_block:
+            writeSnapshotCheckpoint(
+                token, event.blockNumber - 1, holder_dict, totalBalance + supplyChange
             )
+            next_checkpoint = event.blockNumber + snapshot_checkpoint_interval - 1
+        if previous_balances is not None:
+            for holder in [event.args["from"], event.args["to"]]:
+                if holder != ZERO_ADDR and holder not in previous_balances:
+                    previous_balances[holder] = holder_dict.get(holder, 0)
+        supplyChange += foldTransferEvent(holder_dict, event)
+        numberEvents += 1
+    eventCache.close()
+    print("Number of events processed: ", numberEvents)
+
+    return supplyChange
+
+
+# Verify the holders' balances at the snapshot block and store them sorted by balance in the
+# csv and binary snapshot files
+def writeSnapshot(
+    oldFlipContract,
+    holder_dict,
+    totalBalance,
+    snapshot_blocknumber,
+    filename,
+    addressChecker_address=None,
+):
+    sorted_dict = dict(sorted(holder_dict.items(), key=lambda x: x[1], reverse=True))
+    # Verify the balances against the chain. With an AddressChecker all the holders are verified
+    # with batched balanceOf calls. Otherwise only the most relevant accounts one by one.
+    if addressChecker_address != None:
+        print("Verifying balances of all holders")
+        addressChecker = AddressChecker.at(addressChecker_address)
+        balances = get_token_balances(
+            addressChecker,
+            oldFlipContract,
+            sorted_dict.keys(),
+            block_identifier=snapshot_blocknumber,
+        )
+        mismatches = [
+            holder
+            for (holder, balance), onchainBalance in zip(sorted_dict.items(), balances)
+            if balance != onchainBalance
+        ]
+        assert len(mismatches) == 0, logging.error(
+            "Balance mismatch for holders: " + str(mismatches)
+        )
+    else:
+        print("Verifying balances of top holders")
+        for holder, balance in sorted_dict.items():
+            if balance < verify_amount_cutoff:
+                break
+            else:
+                assert balance == oldFlipContract.balanceOf(
+                    holder, block_identifier=snapshot_blocknumber
+                )
 
     holder_list = list(sorted_dict.keys())
     holder_balances = list(sorted_dict.values())
@@ -270,6 +473,16 @@ def snapshot(
         + str(snapshot_blocknumber)
     )
 
+    # Binary snapshot (see snapshot_file.py). Much faster to load and verify than the csv.
+    printAndLog("Writing data into binary file")
+    write_snapshot_file(
+        getBinarySnapshotFilename(filename),
+        holder_list,
+        holder_balances,
+        totalBalance,
+        snapshot_blocknumber,
+    )
+
     # Add checksum for security purposes
     holder_list.append("TotalNumberHolders:" + str(len(holder_list)))
     holder_balances.append(totalBalance)
@@ -284,6 +497,68 @@ def snapshot(
     printAndLog(snapshotSuccessMessage + filename)
 
 
+# Apply a Transfer event to the holders' balances. Returns the change in total supply (mints
+# and burns). Holders are removed when their balance reaches zero.
+def foldTransferEvent(holder_dict, event):
+    value = event.args["value"]
+    if value == 0:
+        return 0
+    supplyChange = 0
+
+    if event.args["from"] != ZERO_ADDR:
+        holder_dict[event.args["from"]] -= value
+        assert holder_dict[event.args["from"]] >= 0
+        if holder_dict[event.args["from"]] == 0:
+            del holder_dict[event.args["from"]]
+    else:
+        supplyChange += value
+
+    if event.args["to"] != ZERO_ADDR:
+        holder_dict[event.args["to"]] = holder_dict.get(event.args["to"], 0) + value
+        assert holder_dict[event.args["to"]] > 0
+    else:
+        supplyChange -= value
+
+    return supplyChange
+
+
+# Store the balances after folding all the events up to `block` (inclusive)
+def writeSnapshotCheckpoint(token, block, holder_dict, totalBalance):
+    checkpoint = {
+        "chainId": chain.id,
+        "token": str(token),
+        "block": block,
+        "totalBalance": totalBalance,
+        "holders": holder_dict,
+    }
+    with open(snapshotCheckpointFilename + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(snapshotCheckpointFilename + ".tmp", snapshotCheckpointFilename)
+    logging.info("Snapshot checkpoint stored at block " + str(block))
+
+
+# Returns the (holders' balances, total balance, next block to process) of the checkpoint if
+# it's valid for this snapshot. Otherwise start from the token deployment.
+def loadSnapshotCheckpoint(token, snapshot_blocknumber):
+    if os.path.exists(snapshotCheckpointFilename):
+        with open(snapshotCheckpointFilename, "r") as f:
+            checkpoint = json.load(f)
+        if (
+            checkpoint["chainId"] == chain.id
+            and checkpoint["token"] == str(token)
+            and checkpoint["block"] <= snapshot_blocknumber
+        ):
+            printAndLog(
+                "Resuming snapshot from checkpoint at block " + str(checkpoint["block"])
+            )
+            return (
+                checkpoint["holders"],
+                checkpoint["totalBalance"],
+                checkpoint["block"] + 1,
+            )
+    return ({}, 0, oldFlip_deployment_block)
+
+
 # --- Airdrop process ----
 # 1- Craft a list of addresses that should not receive an airdrop or that have already receieved it.
 # To make sure no holder is Airdropped twice we check all the newFLIP airdrop transfer events.
@@ -303,28 +578,39 @@ def airdrop(
     newStateChainGateway,
     airdrop_scGateway,
     multiSend_address,
+    parsedLog=None,
 ):
     printAndLog("Starting airdrop process")
 
+    # Transactions from a previous run might still be in flight. Wait for them to be included
+    # so that they show up in the transfer events and are not airdropped twice.
+    printAndLog("Waiting for pending transactions from the airdropper..")
+    wait_for_pending_transactions(airdropper)
+    waitForLogTXsToComplete(parsedLog or [], airdropper)
+
     (
         oldFlipHolderAccounts,
         oldFlipholderBalances,
         oldFliptotalSupply,
         oldStateChainGatewayBalance,
         oldFlipDeployerBalance,
-    ) = readCSVSnapshotChecksum(snapshot_csv)
+    ) = readSnapshotChecksum(snapshot_csv)
 
     newFlipContract, newFlipContractObject = getContractFromAddress("FLIP", newFlip)
 
     # Craft list of addresses that should be skipped when airdropping. Skip following receivers: airdropper,
     # newStateChainGateway, oldStateChainGateway and oldFlipDeployer. Also skip receivers that have already received
     # their airdrop. OldFlipDeployer can be the same as airdropper, that should be fine.
-    skip_receivers_list = [
-        str(airdropper),
-        newStateChainGateway,
-        oldStateChainGateway,
-        oldFlipDeployer,
-    ]
+    # Addresses are checksummed so membership doesn't depend on the casing of each source.
+    skip_receivers = {
+        web3.toChecksumAddress(str(address))
+        for address in [
+            airdropper,
+            newStateChainGateway,
+            oldStateChainGateway,
+            oldFlipDeployer,
+        ]
+    }
 
     listAirdropTXs, stateChainGatewayMinted = getTXsAndMintBalancesFromTransferEvents(
         airdropper, newFlipContractObject, newStateChainGateway, multiSend_address
@@ -397,9 +683,10 @@ def airdrop(
         printAndLog("Script stopped by user")
         sys.exit("Script stopped by user")
 
-    # Full list of addresses to skip - add already airdropped accounts
-    for airdropTx in listAirdropTXs:
-        skip_receivers_list.append(airdropTx[0])
+    # Full set of addresses to skip - add already airdropped accounts. The transfer events are
+    # served from the local event cache, so a resumed run only fetches the blocks since the
+    # previous one.
+    skip_receivers |= {airdropTx[0] for airdropTx in listAirdropTXs}
 
     printAndLog(startAirdropMessage)
 
@@ -408,7 +695,7 @@ def airdrop(
     skip_counter = 0
     totalAmount_toTransfer = 0
     for i in range(len(oldFlipHolderAccounts)):
-        if oldFlipHolderAccounts[i] not in skip_receivers_list:
+        if web3.toChecksumAddress(oldFlipHolderAccounts[i]) not in skip_receivers:
             if int(oldFlipholderBalances[i]) >= airdrop_amount_cutoff:
                 listOfTxtoSend.append(
                     [oldFlipHolderAccounts[i], oldFlipholderBalances[i]]
@@ -422,8 +709,6 @@ def airdrop(
     # Check that the airdropper has the balance to airdrop for the loop airdrop transfer (remaining Txs)
     assert newFlipContract.balanceOf(str(airdropper)) >= totalAmount_toTransfer
 
-    listOfTxSent = []
-
     multiSend = MultiSend.at(multiSend_address)
 
     # Approve the entire amount in one call. If there is any approval already we assume it has approved
@@ -433,33 +718,73 @@ def airdrop(
             multiSend.address, totalAmount_toTransfer, {"from": airdropper}
         )
 
-    # Iterate over batches of 200 lists
-    for i in range(0, len(listOfTxtoSend), transfer_batch_size):
-        transfer_batches = listOfTxtoSend[i : i + transfer_batch_size]
-        # Process the batch
-        total_transfer_batch = 0
-        for transfer in transfer_batches:
-            total_transfer_batch += int(transfer[1])
-
-        # NOTE: This might not work when running a local hardhat fork. There is some error that
-        # the nonce is too low. It's probably a HH bug, it's not a problem in a fresh hardhat
-        # network nor in a live network. Doing batches of more than 100 causes timeouts on forks.
-        tx = multiSend.multiSendToken(
+    # Pack the transfers into MultiSend calls sized by gas. Every batch is checked with
+    # eth_estimateGas before anything is broadcasted.
+    printAndLog("Planning airdrop batches")
+    planner = BatchPlanner(
+        lambda transfers: multiSend.multiSendToken.encode_input(
             newFlipContract,
-            transfer_batches,
-            total_transfer_batch,
-            {"from": airdropper, "required_confs": 1},
-        )
-        # Logging each individually - if logged at the end of the loop and it breaks before that, then transfers won't be logged
-        logging.info("Airdrop transaction Tx Hash:" + tx.txid)
+            transfers,
+            sum(int(transfer[1]) for transfer in transfers),
+        ),
+        lambda transfer: encode_abi(
+            ["address", "uint256"], [transfer[0], int(transfer[1])]
+        ),
+        lambda data: web3.eth.estimate_gas(
+            {"from": str(airdropper), "to": multiSend.address, "data": data}
+        ),
+        airdrop_gas_ceiling,
+        max_items=transfer_batch_size,
+    )
+    listOfBatches = planner.verify(planner.plan(listOfTxtoSend))
+    printAndLog(
+        "Number of airdrop batches: "
+        + str(len(listOfBatches))
+        + ". Estimated gas: "
+        + str(sum(gas for _, gas in listOfBatches))
+    )
 
-        listOfTxSent.append(tx.txid)
+    # Transactions are signed with local nonces and sent without waiting for the previous ones
+    # to be confirmed, with up to airdrop_tx_window of them in flight. Every hash is logged
+    # as soon as it's broadcasted (including gas-bumped replacements) along with its nonce.
+    with TxPipeline(
+        airdropper,
+        window=airdrop_tx_window,
+        on_sent=lambda _, txHash: logging.info(
+            "Airdrop transaction Tx Hash:"
+            + txHash
+            + " Nonce:"
+            + str(pipeline.nonces[txHash])
+        ),
+    ) as pipeline:
+        for transfer_batches, gas in listOfBatches:
+            # Process the batch
+            total_transfer_batch = 0
+            for transfer in transfer_batches:
+                total_transfer_batch += int(transfer[1])
+
+            # NOTE: This might not work when running a local hardhat fork. There is some error that
+            # the nonce is too low. It's probably a HH bug, it's not a problem in a fresh hardhat
+            # network nor in a live network. Doing batches of more than 100 causes timeouts on forks.
+            pipeline.send(
+                {
+                    "to": multiSend.address,
+                    "data": multiSend.multiSendToken.encode_input(
+                        newFlipContract, transfer_batches, total_transfer_batch
+                    ),
+                    "gas": int(gas * pipeline.gas_buffer),
+                }
+            )
+
+        # After all tx's have been send wait for the receipts. This could break (or could have broken before) so extra safety mechanism is added when rerunning script
+        printAndLog("Waiting for airdrop transactions to be confirmed..")
+        listOfTxSent = [
+            receipt.transactionHash.hex() for receipt in pipeline.wait_all()
+        ]
 
     assert newFlipContract.allowance(airdropper, multiSend.address) == 0
     assert newFlipContract.balanceOf(multiSend.address) == 0
-    assert len(listOfTxSent) == int(
-        math.ceil(len(listOfTxtoSend) / transfer_batch_size)
-    )
+    assert len(listOfTxSent) == len(listOfBatches)
 
     # Should have skipped oldStateChainGateway and oldFlipDeployer for sure. NewStateChainGateway might have
     # been airdropped depending on the airdrop_scGateway flag but won't be in the lists anyway.
@@ -470,11 +795,6 @@ def airdrop(
         + ". Should have skipped at least 2 (oldStateChainGateway and oldFlipDeployer)"
     )
 
-    # After all tx's have been send wait for the receipts. This could break (or could have broken before) so extra safety mechanism is added when rerunning script
-    printAndLog("Waiting for airdrop transactions to be confirmed..")
-    for txSent in listOfTxSent:
-        web3.eth.wait_for_transaction_receipt(txSent)
-
     printAndLog(airdropSuccessMessage)
 
 
@@ -509,67 +829,74 @@ def verifyAirdrop(
         oldFliptotalSupply,
         oldStateChainGatewayBalance,
         oldFlipDeployerBalance,
-    ) = readCSVSnapshotChecksum(initalSnapshot)
+    ) = readSnapshotChecksum(initalSnapshot)
+
+    # Holders keyed by address so that removing the special accounts below and the join with
+    # the airdrop transfers don't need a pass over the whole list each.
+    oldFlipHolders = dict(
+        zip(oldFlipHolderAccounts, [int(balance) for balance in oldFlipholderBalances])
+    )
+    airdropperAddress = web3.toChecksumAddress(str(airdropper))
 
     # Remove oldStateChainGateway - balance is different, will be checked separately below
     assert oldFlipHolderAccounts[1] == oldStateChainGateway
-    del oldFlipHolderAccounts[1]
-    del oldFlipholderBalances[1]
+    del oldFlipHolders[oldStateChainGateway]
 
     # New airdropper should get the old airdropper balance, assuming it had a balance. Delete oldFlipDeployer from the list.
-    if oldFlipDeployer in oldFlipHolderAccounts:
-        index = oldFlipHolderAccounts.index(oldFlipDeployer)
-        assert index == 0
+    if oldFlipDeployer in oldFlipHolders:
+        assert oldFlipHolderAccounts[0] == oldFlipDeployer
         # New airdropper should get the oldFlipAirdropper balance plus the oldFlipBalance of the airdropper if any
-        if airdropper in oldFlipHolderAccounts and airdropper != oldFlipDeployer:
-            index_airdropper = oldFlipHolderAccounts.index(airdropper)
-            amount = int(oldFlipholderBalances[index_airdropper])
+        if airdropperAddress != oldFlipDeployer:
+            amount = oldFlipHolders.get(airdropperAddress, 0)
         else:
             amount = 0
         # >= because we might have not airdropped to all original holders
         assert (
             int(newFlipContract.balanceOf(str(airdropper)))
-            >= int(oldFlipholderBalances[index]) + amount
+            >= oldFlipHolders[oldFlipDeployer] + amount
         )
         assert (
             int(newFlipContract.balanceOf(airdropper))
             >= oldFlipDeployerBalance + amount
         )
 
-        del oldFlipHolderAccounts[index]
-        del oldFlipholderBalances[index]
+        del oldFlipHolders[oldFlipDeployer]
 
     # Delete airdropper if it's still in the list, as it won't airdrop itself.
-    if airdropper in oldFlipHolderAccounts:
-        index = oldFlipHolderAccounts.index(airdropper)
-        del oldFlipHolderAccounts[index]
-        del oldFlipholderBalances[index]
+    oldFlipHolders.pop(airdropperAddress, None)
+
+    # Holders below airdrop_amount_cutoff are skipped by the airdrop
+    belowCutoff = [
+        holder
+        for holder, balance in oldFlipHolders.items()
+        if balance < airdrop_amount_cutoff
+    ]
+    for holder in belowCutoff:
+        del oldFlipHolders[holder]
+    printAndLog(
+        "Holders below the airdrop cutoff, not verified: " + str(len(belowCutoff))
+    )
+
+    # Join the snapshot holders with the airdrop transfers in a single pass. Every holder above
+    # the cutoff must have been airdropped exactly its balance.
+    report = reconcileAirdrop(oldFlipHolders, listAirdropTXs)
+    writeAirdropReport(airdropReportFilename, report)
+    printAndLog(
+        "Airdrop verification report written to "
+        + airdropReportFilename
+        + ". "
+        + ", ".join(kind + ": " + str(len(entries)) for kind, entries in report.items())
+    )
+    assert not any(report.values())
 
     # Sanity check - this could potentially fail if the batch transfers have been broken and it has ended up
     # doing a different amount of batches than if it had all succeeded.
     assert int(math.ceil(len(listAirdropTXs) / transfer_batch_size)) <= int(
-        math.ceil(len(oldFlipHolderAccounts) / transfer_batch_size)
+        math.ceil(len(oldFlipHolders) / transfer_batch_size)
     )
 
-    # oldFlipHolderAccounts is ordered so we can break as soon as an amount is < verify_amount_cutoff
-    # It is check that oldFlipHolders have been airdropped the correct amount
-    for (holder, balance) in zip(oldFlipHolderAccounts, oldFlipholderBalances):
-        if int(balance) < verify_amount_cutoff:
-            continue
-        else:
-            airdrop_found = False
-            for listAirdropTX in listAirdropTXs:
-                if listAirdropTX[0] == str(holder):
-                    assert listAirdropTX[1] == int(balance)
-                    airdrop_found = True
-                    break
-            assert airdrop_found
-            continue
-
     # Extra check
-    assert (
-        len(listAirdropTXs) <= len(oldFlipHolderAccounts) == len(oldFlipholderBalances)
-    )
+    assert len(listAirdropTXs) <= len(oldFlipHolders)
 
     # Check that the final supply difference and that the difference is in the stateChainGateway
     # This should be the case regardless of Chainflip having burnt/mint FLIP from the stateChainGateway
@@ -609,13 +936,17 @@ def getTXsAndMintBalancesFromTransferEvents(
     airdropper, flipContractObject, stateChainGateway, multiSend_address
 ):
     printAndLog("Getting all transfer events")
+    eventCache = EventCache(eventCacheFilename)
     events = list(
-        fetch_events(
+        eventCache.fetch_events(
             flipContractObject.events.Transfer,
             from_block=0,
             to_block=web3.eth.block_number,
+            chunk_size=log_fetch_chunk_size,
+            max_workers=log_fetch_workers,
         )
     )
+    eventCache.close()
 
     listAirdropTXs = []
     initialMintTXs = []
@@ -628,10 +959,8 @@ def getTXsAndMintBalancesFromTransferEvents(
         # If there has been an airdrop to the stateChainGateway just account for the amount to make checking easier
         if fromAddress == str(airdropper) and toAddress == stateChainGateway:
             continue
-        # Addresses should be unique but just in case
-        elif fromAddress == str(multiSend_address) and (
-            toAddress not in listAirdropTXs
-        ):
+        # Receivers should be unique, duplicates are reported by verifyAirdrop
+        elif fromAddress == str(multiSend_address):
             listAirdropTXs.append([toAddress, amount])
         # Mint events
         elif fromAddress == ZERO_ADDR:
@@ -648,19 +977,58 @@ def getTXsAndMintBalancesFromTransferEvents(
     return listAirdropTXs, int(initialMintTXs[0][1])
 
 
-def waitForLogTXsToComplete(parsedLog):
+def waitForLogTXsToComplete(parsedLog, sender):
     printAndLog("Waiting for sent transactions to complete...")
     # Get all previous sent transactions (if any) from the log and check that they have been included in a block and we get a receipt back
+    listOfTxSent = []
+    nonces = {}
     for line in parsedLog:
         parsedLine = line.split("Airdrop transaction Tx Hash:")
         if len(parsedLine) > 1:
-            tx = parsedLine[1]
-            receipt = web3.eth.wait_for_transaction_receipt(tx)
-            # Logging these only if running in debug level
+            # Logs from older runs don't have the nonce
+            tx, _, nonce = parsedLine[1].partition(" Nonce:")
+            listOfTxSent.append(tx)
+            if nonce:
+                nonces[tx] = (str(sender), int(nonce))
+
+    # All the receipts are polled at once in batched requests. Transactions unknown to the node
+    # have been replaced by a gas-bumped one (also logged) or dropped, which is known as soon as
+    # another transaction with their nonce is included.
+    def printProgress(confirmed, total):
+        print("Confirmed transactions: " + str(confirmed) + "/" + str(total))
+
+    with ReceiptTracker() as tracker:
+        receipts = tracker.wait(
+            listOfTxSent,
+            on_progress=printProgress,
+            drop_unknown=True,
+            nonces=nonces,
+        )
+    for tx, receipt in receipts.items():
+        # Logging these only if running in debug level
+        if receipt is None:
+            logging.debug("Previous transaction replaced or dropped. Hash: " + tx)
+        else:
             logging.debug(
                 "Previous transaction succesfully included in a block. Hash and receipt:"
             )
             logging.debug(receipt)
+            if receipt.status == 0:
+                printAndLog("Previous transaction reverted. Hash: " + tx)
+
+
+def writeAirdropReport(filename, report):
+    with open(filename, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(["kind", "address", "expected", "airdropped"])
+        for holder, balance in report["missing"]:
+            writer.writerow(["missing", holder, balance, 0])
+        for receiver, amount in report["extra"]:
+            writer.writerow(["extra", receiver, 0, amount])
+        for receiver, amount in report["duplicate"]:
+            writer.writerow(["duplicate", receiver, 0, amount])
+        for holder, balance, amount in report["mismatched"]:
+            writer.writerow(["mismatched", holder, balance, amount])
 
 
 def readCSVSnapshotChecksum(snapshot_csv):
@@ -686,6 +1054,38 @@ def readCSVSnapshotChecksum(snapshot_csv):
             assert int(numberHolders[1]) == len(holderAccounts)
             assert totalSupply == int(b)
 
+    return checkSnapshotHolders(holderAccounts, holderBalances, totalSupply)
+
+
+# Same as readCSVSnapshotChecksum for the binary snapshot. The checksum is the payload digest
+# and the total balance stored in the header.
+def readBinarySnapshotChecksum(snapshot_bin):
+    printAndLog("Reading snapshot from file: " + snapshot_bin)
+
+    snapshotFile = SnapshotFile(snapshot_bin)
+    print("Checksum verification")
+    snapshotFile.verify()
+    holderAccounts = [snapshotFile.address(i) for i in range(len(snapshotFile))]
+    holderBalances = [snapshotFile.balance(i) for i in range(len(snapshotFile))]
+    totalSupply = snapshotFile.totalBalance
+    snapshotFile.close()
+
+    return checkSnapshotHolders(holderAccounts, holderBalances, totalSupply)
+
+
+# Read the binary snapshot stored along the csv if there is one, otherwise the csv
+def readSnapshotChecksum(snapshot_csv):
+    snapshot_bin = getBinarySnapshotFilename(snapshot_csv)
+    if os.path.exists(snapshot_bin):
+        return readBinarySnapshotChecksum(snapshot_bin)
+    return readCSVSnapshotChecksum(snapshot_csv)
+
+
+def getBinarySnapshotFilename(snapshot_csv):
+    return os.path.splitext(snapshot_csv)[0] + ".bin"
+
+
+def checkSnapshotHolders(holderAccounts, holderBalances, totalSupply):
     # We get the holder amounts ordered in a descending order
     # Health check that the biggest holder is the old FLIP deployer and the
     # second one is the StakeMangaer
@@ -0,0 +1,204 @@
+import os
+from utils import *
+from batch_planner import BatchPlanner
+from receipt_tracker import ReceiptTracker
+from tx_pipeline import TxPipeline, TxRevertedError, wait_for_pending_transactions
+from eth_abi import encode_abi
+
+# ERC20 airdrops through an `airdropERC20(token, recipients, amounts, total)` contract (e.g. the
+# wenTokens airdrop tool) split in batches sized by gas.
+#
+# The plan is a json file with the batches (slices of the recipients and amounts) and their
+# status. It's written before anything is sent and updated as the batches are broadcasted
+# (`txHashes`, including gas-bumped replacements) and confirmed (`blockNumber`), so a rerun
+# can tell which batches landed and only send the rest.
+
+AIRDROP_GAS_CEILING = 10000000
+AIRDROP_TX_WINDOW = 64
+
+
+# State override that sets the allowance of `owner` for `spender` to `amount`, so the batches
+# can be estimated (and reviewed) before the approval is sent. The slot of the allowances
+# mapping is found by overriding the first storage slots in eth_call. Returns None if it
+# isn't found or the node doesn't support state overrides.
+def allowance_override(token, owner, spender, amount, max_slot=16):
+    call = {"to": token.address, "data": token.allowance.encode_input(owner, spender)}
+    for slot in range(max_slot):
+        ownerSlot = keccak(encode_abi(["address", "uint256"], [str(owner), slot]))
+        key = keccak(encode_abi(["address", "bytes32"], [str(spender), ownerSlot]))
+        override = {
+            token.address: {
+                "stateDiff": {
+                    "0x" + key.hex(): "0x" + encode_abi(["uint256"], [amount]).hex()
+                }
+            }
+        }
+        try:
+            result = web3.eth.call(call, "latest", override)
+        except ValueError:
+            return None
+        if int.from_bytes(result, "big") == amount:
+            return override
+    return None
+
+
+# Pack the transfers in batches, checking each of them with eth_estimateGas. The sender must
+# have approved the airdrop contract for the estimates to succeed, or `state_override` (see
+# allowance_override) has to simulate the approval. Nodes that don't support state overrides
+# in eth_estimateGas raise a ValueError.
+def plan_airdrop(
+    airdrop_contract,
+    token,
+    sender,
+    recipients,
+    amounts,
+    gas_ceiling=AIRDROP_GAS_CEILING,
+    state_override=None,
+):
+    def encode_batch(indexes):
+        start, end = indexes[0], indexes[-1] + 1
+        return airdrop_contract.airdropERC20.encode_input(
+            token, recipients[start:end], amounts[start:end], sum(amounts[start:end])
+        )
+
+    def estimate_gas(data):
+        tx = {"from": str(sender), "to": airdrop_contract.address, "data": data}
+        if state_override is None:
+            return web3.eth.estimate_gas(tx)
+        # web3.py has no state override for eth_estimateGas
+        gas = web3.manager.request_blocking(
+            "eth_estimateGas", [tx, "latest", state_override]
+        )
+        return gas if isinstance(gas, int) else int(gas, 16)
+
+    planner = BatchPlanner(
+        encode_batch,
+        # Each transfer adds an address and an amount to the calldata
+        lambda i: encode_abi(["address", "uint256"], [str(recipients[i]), amounts[i]]),
+        estimate_gas,
+        gas_ceiling,
+    )
+    batches = []
+    for indexes, gas in planner.verify(planner.plan(range(len(recipients)))):
+        start, end = indexes[0], indexes[-1] + 1
+        batches.append(
+            {
+                "recipients": [str(recipient) for recipient in recipients[start:end]],
+                "amounts": amounts[start:end],
+                "total": sum(amounts[start:end]),
+                "gas": gas,
+                "txHashes": [],
+                "blockNumber": None,
+            }
+        )
+    return {"token": str(token), "batches": batches}
+
+
+def write_airdrop_plan(filename, plan):
+    with open(filename + ".tmp", "w") as f:
+        json.dump(plan, f, indent=1)
+    os.replace(filename + ".tmp", filename)
+
+
+# Load a plan, checking that it's for the same token and transfers
+def read_airdrop_plan(filename, token, recipients, amounts):
+    with open(filename, "r") as f:
+        plan = json.load(f)
+    batches = plan["batches"]
+    assert (
+        plan["token"] == str(token)
+        and [r for batch in batches for r in batch["recipients"]]
+        == [str(recipient) for recipient in recipients]
+        and [a for batch in batches for a in batch["amounts"]] == list(amounts)
+    ), f"{filename} doesn't match the transfers, remove it to start a new airdrop"
+    return plan
+
+
+def pending_batches(plan):
+    return [batch for batch in plan["batches"] if batch["blockNumber"] is None]
+
+
+# Check the batches sent by a previous run once all the transactions of the sender are mined.
+# The ones without a successful receipt are sent again.
+def update_sent_batches(plan, sender):
+    wait_for_pending_transactions(sender)
+    sent = [batch for batch in pending_batches(plan) if batch["txHashes"]]
+    with ReceiptTracker() as tracker:
+        receipts = tracker.get_receipts(
+            [txHash for batch in sent for txHash in batch["txHashes"]]
+        )
+    for batch in sent:
+        for txHash in batch["txHashes"]:
+            receipt = receipts[txHash]
+            if receipt is not None and receipt["status"] == 1:
+                batch["blockNumber"] = receipt["blockNumber"]
+        if batch["blockNumber"] is None:
+            batch["txHashes"] = []
+
+
+# Sign and broadcast all the pending batches with consecutive nonces without waiting for
+# the previous ones, then wait for all of them. If a batch reverts or fails to broadcast, the
+# batches broadcasted before or after it can still land, so once they are mined the plan is
+# updated and the batches that landed are reported before raising.
+def send_airdrop_batches(
+    filename,
+    plan,
+    airdrop_contract,
+    token,
+    sender,
+    window=AIRDROP_TX_WINDOW,
+    on_sent=None,
+):
+    batches = plan["batches"]
+
+    def record_sent(i, txHash):
+        batches[i]["txHashes"].append(txHash)
+        write_airdrop_plan(filename, plan)
+        if on_sent is not None:
+            on_sent(i, txHash)
+
+    def record_confirmed(i, receipt):
+        batches[i]["blockNumber"] = receipt["blockNumber"]
+        write_airdrop_plan(filename, plan)
+
+    def report_landed():
+        update_sent_batches(plan, sender)
+        write_airdrop_plan(filename, plan)
+        landed = [i for i, batch in enumerate(batches) if batch["blockNumber"]]
+        print(f"Batches airdropped: {landed}")
+        print(
+            f"Batches not airdropped: {sorted(set(range(len(batches))) - set(landed))}"
+        )
+
+    pipeline = TxPipeline(
+        sender, window=window, on_sent=record_sent, on_confirmed=record_confirmed
+    )
+    try:
+        for i, batch in enumerate(batches):
+            if batch["blockNumber"] is not None:
+                continue
+            pipeline.send(
+                {
+                    "to": airdrop_contract.address,
+                    "data": airdrop_contract.airdropERC20.encode_input(
+                        token, batch["recipients"], batch["amounts"], batch["total"]
+                    ),
+                    "gas": int(batch["gas"] * pipeline.gas_buffer),
+                },
+                label=i,
+            )
+        pipeline.wait_all()
+    except TxRevertedError as e:
+        print(
+            f"Airdrop batch {e.label} reverted in {e.receipt['transactionHash'].hex()}"
+        )
+        report_landed()
+        raise
+    # Nodes that throw on transaction failures (e.g. hardhat's throwOnTransactionFailures)
+    # raise on the broadcast of a reverting batch instead of returning its hash
+    except ValueError as e:
+        print(f"Airdrop batch failed: {e}")
+        report_landed()
+        raise
+    finally:
+        pipeline.close()
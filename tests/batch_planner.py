@@ -0,0 +1,109 @@
+from utils import *
+
+# Packs items (e.g. transfers) into transactions sized by a gas budget instead of a fixed
+# number of items per transaction.
+#
+# The gas of a batch is modelled as `base_gas + sum(item_gas(item))`. Both are calibrated by
+# estimating the gas of a batch with a single item and of a probe batch with several items,
+# so the model covers the execution and the calldata of the actual call. Batches are then
+# filled greedily up to the gas ceiling and each one is verified with eth_estimateGas, being
+# split in half if the estimate is over the ceiling.
+
+# Calldata gas per byte (EIP-2028)
+ZERO_BYTE_GAS = 4
+NONZERO_BYTE_GAS = 16
+
+
+def calldata_gas(data):
+    data = bytes.fromhex(cleanHexStr(data))
+    zeros = data.count(0)
+    return zeros * ZERO_BYTE_GAS + (len(data) - zeros) * NONZERO_BYTE_GAS
+
+
+class BatchPlanner:
+    # `encode_batch(items)` returns the calldata of a batch, `estimate_gas(calldata)` its gas
+    # and `encode_item(item)` the calldata bytes that a single item adds to a batch.
+    def __init__(
+        self,
+        encode_batch,
+        encode_item,
+        estimate_gas,
+        gas_ceiling,
+        max_items=None,
+        probe_size=10,
+    ):
+        self.encode_batch = encode_batch
+        self.encode_item = encode_item
+        self.estimate_gas = estimate_gas
+        self.gas_ceiling = gas_ceiling
+        self.max_items = max_items
+        self.probe_size = probe_size
+        self.base_gas = None
+        self.execution_gas = None
+
+    def item_gas(self, item):
+        return self.execution_gas + calldata_gas(self.encode_item(item))
+
+    def batch_gas(self, items):
+        return self.base_gas + sum(self.item_gas(item) for item in items)
+
+    def _estimate(self, items):
+        return self.estimate_gas(self.encode_batch(items))
+
+    # Derive the per-item execution gas from the difference between a single item batch and
+    # a probe batch, excluding the calldata that is accounted for per item
+    def calibrate(self, items):
+        probe = items[: self.probe_size]
+        single_gas = self._estimate(probe[:1])
+        single_calldata = calldata_gas(self.encode_item(probe[0]))
+        if len(probe) > 1:
+            probe_gas = self._estimate(probe)
+            probe_calldata = sum(calldata_gas(self.encode_item(item)) for item in probe)
+            self.execution_gas = -(
+                -(probe_gas - single_gas - (probe_calldata - single_calldata))
+                // (len(probe) - 1)
+            )
+        else:
+            self.execution_gas = 0
+        self.base_gas = single_gas - self.execution_gas - single_calldata
+
+    # Greedily fill batches up to the gas ceiling (and max_items)
+    def plan(self, items):
+        items = list(items)
+        if not items:
+            return []
+        if self.base_gas is None:
+            self.calibrate(items)
+
+        batches = []
+        batch = []
+        gas = self.base_gas
+        for item in items:
+            item_gas = self.item_gas(item)
+            if batch and (
+                gas + item_gas > self.gas_ceiling
+                or (self.max_items is not None and len(batch) == self.max_items)
+            ):
+                batches.append(batch)
+                batch = []
+                gas = self.base_gas
+            batch.append(item)
+            gas += item_gas
+        batches.append(batch)
+        return batches
+
+    # Estimate each batch, splitting the ones over the ceiling. Returns [(batch, gas)]. Raises
+    # if a single item doesn't fit.
+    def verify(self, batches):
+        verified = []
+        pending = list(reversed(batches))
+        while pending:
+            batch = pending.pop()
+            gas = self._estimate(batch)
+            if gas <= self.gas_ceiling:
+                verified.append((batch, gas))
+                continue
+            assert len(batch) > 1, f"Item doesn't fit in the gas ceiling: {batch[0]}"
+            middle = len(batch) // 2
+            pending.extend([batch[middle:], batch[:middle]])
+        return verified
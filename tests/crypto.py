@@ -4,10 +4,201 @@ import umbral
 from umbral import SecretKey
 from py_ecc.secp256k1 import secp256k1
 from eth_abi import encode_abi
+from eth_abi.encoding import TupleEncoder
+from eth_abi.grammar import TupleType, parse
+from eth_abi.registry import registry
+from hexbytes import HexBytes
 from brownie.convert import to_bytes
+from brownie.convert.datatypes import EthAddress
 from brownie.convert.utils import get_type_strings
-from brownie.convert.normalize import format_input
-import copy
+from brownie.convert.normalize import format_input, _check_array, _format_single
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+import json
+import os
+
+# ----- secp256k1 fixed-base multiplication -----
+# py_ecc's `secp256k1.multiply` runs a generic double-and-add for every call. Signing only
+# ever multiplies the generator, so we precompute, for every 8-bit window i of the scalar,
+# the multiples d * 2^(8*i) * G in affine coordinates. k*G is then at most 32 mixed
+# Jacobian-affine additions and a single modular inversion. The table (~8k points) is
+# built lazily the first time a signature is produced. Inversions use py_ecc's `inv` as
+# `pow(x, -1, P)` needs Python 3.8.
+G_WINDOW_BITS = 8
+_generatorTable = None
+
+
+def _affineAdd(p, q):
+    (x1, y1), (x2, y2) = p, q
+    if x1 == x2:
+        slope = 3 * x1 * x1 * secp256k1.inv(2 * y1, secp256k1.P) % secp256k1.P
+    else:
+        slope = (y2 - y1) * secp256k1.inv(x2 - x1, secp256k1.P) % secp256k1.P
+    x3 = (slope * slope - x1 - x2) % secp256k1.P
+    return (x3, (slope * (x1 - x3) - y1) % secp256k1.P)
+
+
+def _jacobianDouble(X, Y, Z):
+    P = secp256k1.P
+    if Y == 0:
+        return (0, 0, 0)
+    YY = Y * Y % P
+    S = 4 * X * YY % P
+    M = 3 * X * X % P
+    X3 = (M * M - 2 * S) % P
+    return (X3, (M * (S - X3) - 8 * YY * YY) % P, 2 * Y * Z % P)
+
+
+# Add an affine point (x2, y2) to a Jacobian point. Z1 == 0 is the point at infinity.
+def _jacobianAddAffine(X1, Y1, Z1, x2, y2):
+    P = secp256k1.P
+    if Z1 == 0:
+        return (x2, y2, 1)
+    Z1Z1 = Z1 * Z1 % P
+    H = (x2 * Z1Z1 - X1) % P
+    r = (y2 * Z1 * Z1Z1 - Y1) % P
+    if H == 0:
+        return _jacobianDouble(X1, Y1, Z1) if r == 0 else (0, 0, 0)
+    HH = H * H % P
+    HHH = H * HH % P
+    V = X1 * HH % P
+    X3 = (r * r - HHH - 2 * V) % P
+    return (X3, (r * (V - X3) - Y1 * HHH) % P, Z1 * H % P)
+
+
+def _getGeneratorTable():
+    global _generatorTable
+    if _generatorTable is None:
+        table = []
+        base = secp256k1.G
+        for _ in range(-(-256 // G_WINDOW_BITS)):
+            # row[d] = d * base, row[0] is never used
+            row = [None, base]
+            for _ in range(2, 1 << G_WINDOW_BITS):
+                row.append(_affineAdd(row[-1], base))
+            table.append(row)
+            base = _affineAdd(row[-1], base)
+        _generatorTable = table
+    return _generatorTable
+
+
+# Equivalent to `secp256k1.multiply(secp256k1.G, k)`, including returning (0, 0) for
+# the point at infinity.
+def multiplyGenerator(k):
+    table = _getGeneratorTable()
+    k %= secp256k1.N
+    mask = (1 << G_WINDOW_BITS) - 1
+    (X, Y, Z) = (0, 0, 0)
+    window = 0
+    while k:
+        digit = k & mask
+        if digit:
+            (X, Y, Z) = _jacobianAddAffine(X, Y, Z, *table[window][digit])
+        k >>= G_WINDOW_BITS
+        window += 1
+
+    if Z == 0:
+        return (0, 0)
+    zInv = secp256k1.inv(Z, secp256k1.P)
+    zInv2 = zInv * zInv % secp256k1.P
+    return (X * zInv2 % secp256k1.P, Y * zInv2 * zInv % secp256k1.P)
+
+
+# Addresses are passed to the encoder as raw bytes, so eth_abi doesn't checksum them again.
+# Raw 20-byte addresses are used as they are. Anything else (strings, accounts, contracts)
+# is converted by EthAddress like brownie's format_input does, which accepts any casing.
+def _formatAddress(value):
+    if isinstance(value, bytes) and len(value) == 20:
+        return bytes(value)
+    return bytes.fromhex(EthAddress(value)[2:])
+
+
+# Build a function that formats a value of the given ABI type in the same way as brownie's
+# `format_input` so we don't have to walk through the ABI types on every call.
+def _compileFormatter(abiType):
+    if abiType.is_array:
+        itemFormatter = _compileFormatter(abiType.item_type)
+        length = abiType.arrlist[-1][0] if len(abiType.arrlist[-1]) else None
+
+        def formatArray(values):
+            _check_array(values, length)
+            return [itemFormatter(value) for value in values]
+
+        return formatArray
+
+    if isinstance(abiType, TupleType):
+        componentFormatters = [_compileFormatter(c) for c in abiType.components]
+
+        def formatTuple(values):
+            _check_array(values, len(componentFormatters))
+            return [
+                formatter(value)
+                for formatter, value in zip(componentFormatters, values)
+            ]
+
+        return formatTuple
+
+    typeStr = abiType.to_type_str()
+    if typeStr == "address":
+        return _formatAddress
+    return lambda value: _format_single(typeStr, value)
+
+
+# Everything needed to compute the contractMsgHash of a signed function that only depends
+# on its ABI: the bytes4 selector, the formatter for the arguments and the encoder for
+# (bytes4, *args). This way only the arguments are encoded on every call.
+class ContractMsgEncoder:
+    def __init__(self, fcn):
+        self.name = fcn.abi["name"]
+        self.fcnSig = to_bytes(fcn.signature, "bytes4")
+
+        # First parameter (sigData) is replaced by the function selector
+        types = get_type_strings(fcn.abi["inputs"])
+        assert types[0] == "(uint256,uint256,address)"
+        self.numArgs = len(types) - 1
+        self.formatArgs = _compileFormatter(parse("(" + ",".join(types[1:]) + ")"))
+        self.encoder = TupleEncoder(
+            encoders=[
+                registry.get_encoder(typeStr) for typeStr in ["bytes4", *types[1:]]
+            ]
+        )
+
+    def encode(self, args):
+        # Health check - function arguments contains an extra sigData
+        assert len(args) == self.numArgs
+
+        # Format inputs according to abi, otherwise brownie accounts fail to be understood as addresses
+        try:
+            formatted_args = self.formatArgs(args)
+        except Exception as e:
+            raise type(e)(f"{self.name} {e}") from None
+
+        return HexBytes(keccak(self.encoder([self.fcnSig, *formatted_args])))
+
+
+# LRU cache of ContractMsgEncoders keyed by (contract address, function signature, ABI hash)
+CONTRACT_MSG_ENCODER_CACHE_SIZE = 256
+_contractMsgEncoders = OrderedDict()
+
+
+def getContractMsgEncoder(fcn):
+    key = (fcn._address, fcn.signature, hash(json.dumps(fcn.abi, sort_keys=True)))
+    encoder = _contractMsgEncoders.get(key)
+    if encoder is None:
+        encoder = ContractMsgEncoder(fcn)
+        _contractMsgEncoders[key] = encoder
+        if len(_contractMsgEncoders) > CONTRACT_MSG_ENCODER_CACHE_SIZE:
+            _contractMsgEncoders.popitem(last=False)
+    else:
+        _contractMsgEncoders.move_to_end(key)
+    return encoder
+
+
+# Sign a list of msgHashes with a given key. Module level so it can be run in a process pool.
+def _signMsgHashes(privKeyHex, msgHashes):
+    signer = Signer(privKeyHex, Signer.AGG, None)
+    return [signer.sign(msgHash) for msgHash in msgHashes]
+
 
 # Fcns return a list instead of a tuple since they need to be modified
 # for some tests (e.g. to make them revert)
@@ -17,8 +208,10 @@ class Signer:
     Q_INT = int(Q, 16)
     HALF_Q_INT = (Q_INT >> 1) + 1
     AGG = "Agg"
+    # Batches of at least this size are signed in a process pool by `sign_batch`
+    SIGN_BATCH_POOL_THRESHOLD = 2000
 
-    def __init__(self, privKeyHex, keyID, nonces):
+    def __init__(self, privKeyHex, keyID, nonces, signatureCacheSize=0):
         self.privKeyHex = privKeyHex
         self.privKey = SecretKey._from_exact_bytes(bytes.fromhex(privKeyHex))
         self.privKeyInt = int(self.privKeyHex, 16)
@@ -31,8 +224,49 @@ class Signer:
         self.pubKeyYPar = 0 if cleanHexStr(bytes(self.pubKey)[:1]) == "02" else 1
         self.pubKeyYParHex = "00" if self.pubKeyYPar == 0 else "01"
 
+        # Constant prefix of the Schnorr challenge (pubKeyX, pubKeyYParity)
+        self.challengePrefix = self.pubKeyX.rjust(32, b"\x00") + bytes(
+            [self.pubKeyYPar]
+        )
+
         self.nonces = nonces
 
+        # Optional LRU cache msgHash => [s, nonceTimesGeneratorAddress]. Since k is derived
+        # from the msgHash, re-signing the same message always yields the same signature.
+        self.enableSignatureCache(signatureCacheSize)
+
+    # A size of 0 disables the cache. Resets the cache and its counters.
+    def enableSignatureCache(self, size):
+        self.signatureCacheSize = size
+        self.signatureCache = OrderedDict()
+        self.signatureCacheHits = 0
+        self.signatureCacheMisses = 0
+
+    def getSignatureCacheStats(self):
+        return {
+            "hits": self.signatureCacheHits,
+            "misses": self.signatureCacheMisses,
+            "size": len(self.signatureCache),
+        }
+
+    # Returns None if the cache is disabled or if the msgHash has not been signed before
+    def getCachedSignature(self, msgHash):
+        if not self.signatureCacheSize:
+            return None
+        signature = self.signatureCache.get(msgHash)
+        if signature is None:
+            self.signatureCacheMisses += 1
+            return None
+        self.signatureCacheHits += 1
+        self.signatureCache.move_to_end(msgHash)
+        return list(signature)
+
+    def cacheSignature(self, msgHash, signature):
+        if self.signatureCacheSize:
+            self.signatureCache[msgHash] = tuple(signature)
+            if len(self.signatureCache) > self.signatureCacheSize:
+                self.signatureCache.popitem(last=False)
+
     @classmethod
     def priv_key_to_pubX_int(cls, privKey):
         pubKey = privKey.public_key()
@@ -90,33 +324,84 @@ class Signer:
         nonces[self.AGG] += 1
         return sigData
 
-    # Generate the contractMsgHash by hashing the function selector and the function arguments
+    # Sign a batch of messages in one call. Each element of the batch is either a (fcn, args)
+    # tuple, as in `getSigDataWithNonces`, or an already computed msgHash, as in `generate_sigData`.
+    # A contiguous range of nonces is reserved up front, so the i-th element is signed with
+    # nonce `nonces[AGG] + i`. Raw msgHashes must therefore have been generated with that nonce.
+    # Returns the list of sigData in the same order as the batch.
+    def sign_batch(self, keyManager, batch, nonces=None, **kwargs):
+        nonces = self.nonces if nonces is None else nonces
+        processes = kwargs.get("processes") or os.cpu_count() or 1
+
+        firstNonce = nonces[self.AGG]
+        nonces[self.AGG] += len(batch)
+
+        # The msgHash fields are all static types so the abi encoding is just the concatenation
+        # of 32-byte words. Only the contractMsgHash and the nonce change between elements.
+        keyManagerAddress = to_bytes(str(keyManager), "bytes32")
+        consumerSuffixes = {}
+
+        msgHashes = []
+        for i, element in enumerate(batch):
+            if isinstance(element, (str, bytes)):
+                msgHashes.append(cleanHexStr(element))
+                continue
+
+            (fcn, args) = element
+            if fcn._address not in consumerSuffixes:
+                # Not querying the chainId unless there is something to hash
+                chainId = kwargs["chainId"] if "chainId" in kwargs else chain.id
+                consumerSuffixes[fcn._address] = (
+                    to_bytes(fcn._address, "bytes32")
+                    + chainId.to_bytes(32, byteorder="big")
+                    + keyManagerAddress
+                )
+            msgHashes.append(
+                keccak(
+                    Signer.generate_contractMsgHash(fcn, *args)
+                    + (firstNonce + i).to_bytes(32, byteorder="big")
+                    + consumerSuffixes[fcn._address]
+                ).hex()
+            )
+
+        if len(msgHashes) >= self.SIGN_BATCH_POOL_THRESHOLD and processes > 1:
+            signatures = [
+                self.getCachedSignature(bytes.fromhex(msgHash)) for msgHash in msgHashes
+            ]
+            missing = [i for i, signature in enumerate(signatures) if signature is None]
+
+            # Build the generator table before forking so the workers inherit it
+            _getGeneratorTable()
+            chunkSize = max(1, -(-len(missing) // processes))
+            chunks = [
+                [msgHashes[j] for j in missing[i : i + chunkSize]]
+                for i in range(0, len(missing), chunkSize)
+            ]
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                newSignatures = [
+                    signature
+                    for chunk in executor.map(
+                        _signMsgHashes, [self.privKeyHex] * len(chunks), chunks
+                    )
+                    for signature in chunk
+                ]
+
+            for i, signature in zip(missing, newSignatures):
+                signatures[i] = signature
+                self.cacheSignature(bytes.fromhex(msgHashes[i]), signature)
+        else:
+            signatures = [self.sign(msgHash) for msgHash in msgHashes]
+
+        return [
+            [s, firstNonce + i, nonceTimesGeneratorAddress]
+            for i, (s, nonceTimesGeneratorAddress) in enumerate(signatures)
+        ]
+
+    # Generate the contractMsgHash by hashing the function selector and the function arguments.
+    # The ABI dependent part is precomputed once per function, see `ContractMsgEncoder`.
     @staticmethod
     def generate_contractMsgHash(fcn, *args):
-        # Health check - function arguments contains an extra sigData
-        assert len(fcn.abi["inputs"]) == len(args) + 1
-
-        # Get the function selector signature
-        fcnSig = fcn.signature
-        fcnSig = to_bytes(fcnSig, "bytes4")
-
-        # Get the function types from the abi
-        types = get_type_strings(fcn.abi["inputs"])
-
-        # Replace the first parameter (sigData) for the selector
-        type_fcnSig = "bytes4"
-        assert types[0] == "(uint256,uint256,address)"
-        types[0] = type_fcnSig
-
-        # Format inputs according to abi, otherwise brownie accounts fail to be understood as addresses
-        # Remove sigData input to match args. We need to first remove sigData
-        modified_abi = copy.deepcopy(fcn.abi)
-        # Remove sigData type
-        modified_abi["inputs"].pop(0)
-        formatted_args = format_input(modified_abi, args)
-
-        contractMsgToHash = encode_abi(types, [fcnSig, *formatted_args])
-        return web3.keccak(contractMsgToHash)
+        return getContractMsgEncoder(fcn).encode(args)
 
     # Generate the msgHash by hashing the contractMsgHash, the nonces, the keyManager address and the chainID
     @staticmethod
@@ -154,7 +439,37 @@ class Signer:
         return cleanHexStr(web3.keccak(msgToHash))
 
     # @dev reference /contracts/abstract/SchnorrSECP256k1.sol
+    # Works on raw bytes and uses the precomputed generator table. It returns exactly the same
+    # [s, nonceTimesGeneratorAddress] as `sign_py_ecc`.
     def sign(self, msgHashHex):
+        msgHash = bytes.fromhex(cleanHexStr(msgHashHex))
+
+        signature = self.getCachedSignature(msgHash)
+        if signature is None:
+            signature = self.sign_bytes(msgHash)
+            self.cacheSignature(msgHash, signature)
+        return signature
+
+    def sign_bytes(self, msgHash):
+        # Pick a "random" nonce (k)
+        k = int.from_bytes(keccak(msgHash), "big")
+        (kTimesGXInt, kTimesGYInt) = multiplyGenerator(k)
+
+        # Last 20 bytes of the hash of the concatenated (uncompressed) k*G key
+        nonceTimesGeneratorAddressBytes = keccak(
+            kTimesGXInt.to_bytes(32, "big") + kTimesGYInt.to_bytes(32, "big")
+        )[-20:]
+
+        e = keccak(self.challengePrefix + msgHash + nonceTimesGeneratorAddressBytes)
+        eInt = int.from_bytes(e, "big")
+
+        s = (k - (self.privKeyInt * eInt)) % self.Q_INT
+
+        return [s, toChecksumAddressFromBytes(nonceTimesGeneratorAddressBytes)]
+
+    # Original implementation of `sign` on top of py_ecc and web3. Kept as the reference
+    # to check and benchmark the fast path against.
+    def sign_py_ecc(self, msgHashHex):
         # Pick a "random" nonce (k)
         k = int(web3.keccak(hexstr=msgHashHex).hex(), 16)
         kTimesG = tuple(secp256k1.multiply(secp256k1.G, k))
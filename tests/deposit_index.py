@@ -0,0 +1,225 @@
+import os
+import json
+import heapq
+import mmap
+import struct
+from array import array
+from utils import *
+
+# On-disk reverse index of Deposit (CREATE2) addresses: address => (swapID, token).
+#
+# The index is a directory with a `manifest.json` and one immutable segment file per call to
+# `append`, so adding a new range of swapIDs (or new tokens) doesn't rewrite existing data.
+# Each segment holds the records sorted by address plus a table of offsets keyed by the
+# first `prefixBits` bits of the address. A lookup reads two offsets and scans a bucket of
+# a handful of records for each segment, all through mmap without loading the file.
+#
+# Segments are merged by size tiers: after an append, the newest segments are merged while
+# the previous one is no larger than TIER_RATIO times the newest one. Segment sizes then
+# decrease geometrically, so a lookup checks O(log n) segments, and large (older) segments
+# are only rewritten once as much data has been appended after them. Merges stream the
+# records from the mmapped segments into the new file without loading them in memory.
+#
+# Segment layout:
+#   header:       magic (4 bytes) | prefixBits (uint32) | number of records (uint64)
+#   prefix table: 2^prefixBits + 1 uint32 record offsets (native endianness)
+#   records:      address (20 bytes) | swapID (32 bytes) | token index (uint16, big endian)
+
+SEGMENT_MAGIC = b"CFDI"
+SEGMENT_HEADER = struct.Struct("<4sIQ")
+RECORD_SIZE = 20 + 32 + 2
+MIN_PREFIX_BITS = 8
+MAX_PREFIX_BITS = 20
+TIER_RATIO = 2
+
+
+class DepositAddressIndex:
+    def __init__(self, path, vaultAddress, contractContainer):
+        self.path = path
+        self.vaultAddress = str(vaultAddress)
+        self.contractContainer = contractContainer
+        self.bytecodeHash = keccak(
+            bytes.fromhex(cleanHexStr(contractContainer.bytecode))
+        ).hex()
+
+        manifestPath = os.path.join(path, "manifest.json")
+        if os.path.exists(manifestPath):
+            with open(manifestPath) as f:
+                self.manifest = json.load(f)
+            assert (
+                self.manifest["vault"].lower() == self.vaultAddress.lower()
+            ), "Index was built for a different Vault"
+            assert (
+                self.manifest["bytecodeHash"] == self.bytecodeHash
+            ), "Index was built for a different Deposit bytecode"
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.manifest = {
+                "vault": self.vaultAddress,
+                "bytecodeHash": self.bytecodeHash,
+                "tokens": [],
+                "segments": [],
+            }
+
+        self.segments = [
+            self._openSegment(s["file"]) for s in self.manifest["segments"]
+        ]
+
+    def _openSegment(self, filename):
+        with open(os.path.join(self.path, filename), "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, prefixBits, numRecords = SEGMENT_HEADER.unpack_from(mm, 0)
+        assert magic == SEGMENT_MAGIC, f"Corrupted index segment {filename}"
+        tableSize = 4 * ((1 << prefixBits) + 1)
+        offsets = memoryview(mm)[
+            SEGMENT_HEADER.size : SEGMENT_HEADER.size + tableSize
+        ].cast("I")
+        return (mm, prefixBits, offsets, SEGMENT_HEADER.size + tableSize)
+
+    def _tokenIndex(self, token):
+        token = str(token)
+        tokens = self.manifest["tokens"]
+        if token not in tokens:
+            tokens.append(token)
+        return tokens.index(token)
+
+    # Add the deposit addresses of every (swapID, token) pair as a new segment. swapIDs can
+    # be anything accepted by getCreate2Addrs (bytes32, hex strings or integers).
+    def append(self, swapIDs, tokens, processes=1):
+        swapIDs = [saltToBytes(swapID) for swapID in swapIDs]
+        records = []
+        for token in tokens:
+            tokenIndex = self._tokenIndex(token).to_bytes(2, byteorder="big")
+            addresses = getCreate2Addrs(
+                self.vaultAddress,
+                swapIDs,
+                self.contractContainer,
+                cleanHexStrPad(str(token)),
+                processes=processes,
+                checksum=False,
+            )
+            records.extend(
+                address + swapID + tokenIndex
+                for address, swapID in zip(addresses, swapIDs)
+            )
+        if not records:
+            return
+
+        records.sort()
+        self.manifest["segments"].append(
+            self._writeSegment(records, len(records), list(map(str, tokens)))
+        )
+        self._writeManifest()
+        self.segments.append(self._openSegment(self.manifest["segments"][-1]["file"]))
+
+        entries = self.manifest["segments"]
+        start = len(entries) - 1
+        while start > 0 and entries[start - 1]["records"] <= TIER_RATIO * sum(
+            entry["records"] for entry in entries[start:]
+        ):
+            start -= 1
+        if start < len(entries) - 1:
+            self._merge(start)
+
+    # Write `numRecords` sorted records (any iterable) as a new segment file. The prefix
+    # table is filled in once all the records are written. Returns its manifest entry.
+    def _writeSegment(self, records, numRecords, tokens):
+        # Aim for a few records per bucket
+        prefixBits = min(
+            max(numRecords.bit_length() - 2, MIN_PREFIX_BITS), MAX_PREFIX_BITS
+        )
+        offsets = array("I", [0]) * ((1 << prefixBits) + 1)
+
+        # Segment files are never reused, not even after a compaction
+        segmentId = self.manifest.get("nextSegment", len(self.manifest["segments"]))
+        self.manifest["nextSegment"] = segmentId + 1
+        filename = f"segment_{segmentId}.bin"
+        with open(os.path.join(self.path, filename), "wb") as f:
+            f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, prefixBits, numRecords))
+            f.write(offsets.tobytes())
+            written = 0
+            for record in records:
+                offsets[
+                    (int.from_bytes(record[:4], "big") >> (32 - prefixBits)) + 1
+                ] += 1
+                f.write(record)
+                written += 1
+            assert written == numRecords, "Wrong number of records in segment"
+
+            for i in range(1, len(offsets)):
+                offsets[i] += offsets[i - 1]
+            f.seek(SEGMENT_HEADER.size)
+            f.write(offsets.tobytes())
+        return {"file": filename, "records": numRecords, "tokens": tokens}
+
+    # Segments are only registered (or removed) once the files are fully written
+    def _writeManifest(self):
+        manifestPath = os.path.join(self.path, "manifest.json")
+        with open(manifestPath + ".tmp", "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(manifestPath + ".tmp", manifestPath)
+
+    def _records(self, segment, numRecords):
+        mm, _, _, recordsStart = segment
+        for i in range(numRecords):
+            position = recordsStart + i * RECORD_SIZE
+            yield mm[position : position + RECORD_SIZE]
+
+    # Merge the segments from `start` onwards into a single one
+    def _merge(self, start):
+        entries = self.manifest["segments"]
+        oldEntries, oldSegments = entries[start:], self.segments[start:]
+        if len(oldEntries) < 2:
+            return
+        records = heapq.merge(
+            *[
+                self._records(segment, entry["records"])
+                for segment, entry in zip(oldSegments, oldEntries)
+            ]
+        )
+        tokens = list(
+            dict.fromkeys(token for entry in oldEntries for token in entry["tokens"])
+        )
+        merged = self._writeSegment(
+            records, sum(entry["records"] for entry in oldEntries), tokens
+        )
+        self.manifest["segments"] = entries[:start] + [merged]
+        self._writeManifest()
+
+        for segment in oldSegments:
+            segment[2].release()
+            segment[0].close()
+        for entry in oldEntries:
+            os.remove(os.path.join(self.path, entry["file"]))
+        self.segments = self.segments[:start] + [self._openSegment(merged["file"])]
+
+    # Merge all the segments into a single one
+    def compact(self):
+        self._merge(0)
+
+    # Returns (swapID hex string, token) for a deposit address or None if it's not indexed
+    def lookup(self, address):
+        addressBytes = bytes.fromhex(cleanHexStr(str(address)))
+        prefix = int.from_bytes(addressBytes[:4], "big")
+
+        for mm, prefixBits, offsets, recordsStart in self.segments:
+            bucket = prefix >> (32 - prefixBits)
+            for i in range(offsets[bucket], offsets[bucket + 1]):
+                position = recordsStart + i * RECORD_SIZE
+                if mm[position : position + 20] == addressBytes:
+                    swapID = mm[position + 20 : position + 52]
+                    tokenIndex = int.from_bytes(
+                        mm[position + 52 : position + 54], "big"
+                    )
+                    return ("0x" + swapID.hex(), self.manifest["tokens"][tokenIndex])
+        return None
+
+    def __len__(self):
+        return sum(segment["records"] for segment in self.manifest["segments"])
+
+    def close(self):
+        for segment in self.segments:
+            segment[2].release()
+            segment[0].close()
+        self.segments = []
@@ -0,0 +1,207 @@
+import sqlite3
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+from utils import *
+
+# Local append-only store of raw event logs backed by SQLite so repeated runs only fetch the
+# blocks that haven't been synced yet.
+#
+# Logs are keyed by (chain ID, contract address, topic0, block number, log index) and for each
+# (chain ID, contract address, topic0) stream the `streams` table records the contiguous block
+# range that has been fully synced. The checkpoint is updated in the same transaction as the
+# logs of every chunk, so an interrupted sync resumes from the last stored chunk. The hash of
+# the last synced block is stored too, so a stream is dropped and fetched again if the chain
+# it was synced from has changed (e.g. a restarted hardhat network).
+#
+# Logs in the last `confirmations` blocks can still be reorged, so they are fetched from the
+# node but never stored.
+
+EVENT_CACHE_CONFIRMATIONS = 12
+
+EVENT_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS streams (
+    chain_id INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    topic0 TEXT NOT NULL,
+    first_block INTEGER NOT NULL,
+    synced_block INTEGER NOT NULL,
+    synced_block_hash BLOB NOT NULL,
+    PRIMARY KEY (chain_id, address, topic0)
+);
+CREATE TABLE IF NOT EXISTS logs (
+    chain_id INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    topic0 TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    block_hash BLOB NOT NULL,
+    transaction_hash BLOB NOT NULL,
+    transaction_index INTEGER NOT NULL,
+    topics BLOB NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (chain_id, address, topic0, block_number, log_index)
+) WITHOUT ROWID;
+"""
+
+
+class EventCache:
+    def __init__(self, path, w3=web3, confirmations=EVENT_CACHE_CONFIRMATIONS):
+        self.w3 = w3
+        self.confirmations = confirmations
+        self.db = sqlite3.connect(path)
+        self.db.executescript(EVENT_CACHE_SCHEMA)
+        self.chainId = w3.eth.chain_id
+
+    def close(self):
+        self.db.close()
+
+    def _key(self, address, topic0):
+        return (self.chainId, str(address).lower(), HexBytes(topic0).hex())
+
+    # Returns the synced (first_block, synced_block) range of a stream or None
+    def synced_range(self, address, topic0):
+        row = self._stream(self._key(address, topic0))
+        return None if row is None else row[:2]
+
+    def _stream(self, key):
+        return self.db.execute(
+            "SELECT first_block, synced_block, synced_block_hash FROM streams"
+            " WHERE chain_id=? AND address=? AND topic0=?",
+            key,
+        ).fetchone()
+
+    def _drop_stream(self, key):
+        with self.db:
+            for table in ["streams", "logs"]:
+                self.db.execute(
+                    f"DELETE FROM {table} WHERE chain_id=? AND address=? AND topic0=?",
+                    key,
+                )
+
+    # `range_start` is the first block of the range being fetched, which only becomes part of
+    # the synced range once every chunk up to the already synced blocks is stored
+    def _store_chunk(self, key, range_start, start, end, logs):
+        rows = [
+            key
+            + (
+                log["blockNumber"],
+                log["logIndex"],
+                bytes(log["blockHash"]),
+                bytes(log["transactionHash"]),
+                log["transactionIndex"],
+                b"".join(bytes(topic) for topic in log["topics"]),
+                bytes(HexBytes(log["data"])),
+            )
+            for log in logs
+        ]
+        with self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO logs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            stream = self._stream(key)
+            if stream is None:
+                stream = (start, start - 1, None)
+            # Only extend the checkpoint over contiguous ranges
+            if start <= stream[1] + 1 and end >= stream[0] - 1:
+                if end > stream[1]:
+                    stream = (stream[0], end, bytes(self.w3.eth.get_block(end)["hash"]))
+                stream = (min(stream[0], range_start),) + stream[1:]
+                self.db.execute(
+                    "INSERT OR REPLACE INTO streams VALUES (?, ?, ?, ?, ?, ?)",
+                    key + stream,
+                )
+
+    def _fetch_range(self, key, range_start, from_block, to_block, **kwargs):
+        params = {"address": self.w3.toChecksumAddress(key[1]), "topics": [key[2]]}
+        for start, end, logs in fetch_log_chunks(
+            params, from_block, to_block, w3=self.w3, **kwargs
+        ):
+            self._store_chunk(key, range_start, start, end, logs)
+
+    # Make sure all the logs of a contract's event from `from_block` to `to_block` (capped to
+    # the latest confirmed block) are stored. Only the blocks outside the synced range are
+    # fetched. Extra kwargs are passed to fetch_log_chunks (chunk_size, max_workers...).
+    def sync(self, address, topic0, from_block, to_block, **kwargs):
+        key = self._key(address, topic0)
+        to_block = min(to_block, self.w3.eth.block_number - self.confirmations)
+        if to_block < from_block:
+            return
+
+        stream = self._stream(key)
+        if stream is not None and stream[2] != bytes(
+            self.w3.eth.get_block(stream[1])["hash"]
+        ):
+            self._drop_stream(key)
+            stream = None
+
+        if stream is None:
+            self._fetch_range(key, from_block, from_block, to_block, **kwargs)
+            return
+
+        first_block, synced_block, _ = stream
+        if from_block < first_block:
+            self._fetch_range(key, from_block, from_block, first_block - 1, **kwargs)
+        if to_block > synced_block:
+            self._fetch_range(
+                key, synced_block + 1, synced_block + 1, to_block, **kwargs
+            )
+
+    # Yields the stored raw logs in block order, in the same format as eth_getLogs
+    def logs(self, address, topic0, from_block, to_block):
+        key = self._key(address, topic0)
+        cursor = self.db.execute(
+            "SELECT address, block_number, log_index, block_hash, transaction_hash, transaction_index, topics, data"
+            " FROM logs WHERE chain_id=? AND address=? AND topic0=? AND block_number BETWEEN ? AND ?"
+            " ORDER BY block_number, log_index",
+            key + (from_block, to_block),
+        )
+        address = self.w3.toChecksumAddress(key[1])
+        for row in cursor:
+            topics = row[6]
+            yield AttributeDict(
+                {
+                    "address": address,
+                    "blockNumber": row[1],
+                    "logIndex": row[2],
+                    "blockHash": HexBytes(row[3]),
+                    "transactionHash": HexBytes(row[4]),
+                    "transactionIndex": row[5],
+                    "topics": [
+                        HexBytes(topics[i : i + 32]) for i in range(0, len(topics), 32)
+                    ],
+                    "data": HexBytes(row[7]).hex(),
+                    "removed": False,
+                }
+            )
+
+    # Same as utils.fetch_events but served from the cache. Only the missing blocks are
+    # fetched from the node, and the unconfirmed ones are fetched but not stored. The contract
+    # address is taken from the event and no argument filters are supported.
+    def fetch_events(self, event, from_block, to_block="latest", **kwargs):
+        decoder = get_event_decoder(event._get_event_abi())
+        topic0 = decoder.topic0
+
+        if to_block == "latest":
+            to_block = self.w3.eth.block_number
+
+        self.sync(event.address, topic0, from_block, to_block, **kwargs)
+
+        # Blocks from `from_block` up to `synced_block` are served from the cache
+        synced = self.synced_range(event.address, topic0)
+        if synced is None or synced[0] > from_block:
+            synced_block = from_block - 1
+        else:
+            synced_block = synced[1]
+        logs = self.logs(event.address, topic0, from_block, min(to_block, synced_block))
+        yield from decoder.decode_logs(logs)
+
+        if to_block > synced_block:
+            params = {"address": event.address, "topics": [topic0]}
+            for _, _, chunk_logs in fetch_log_chunks(
+                params,
+                max(from_block, synced_block + 1),
+                to_block,
+                w3=self.w3,
+                **kwargs,
+            ):
+                yield from decoder.decode_logs(chunk_logs)
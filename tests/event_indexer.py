@@ -0,0 +1,280 @@
+import sqlite3
+from web3.datastructures import AttributeDict
+from web3.exceptions import BlockNotFound
+from utils import *
+
+# Local index of all the events emitted by a set of Chainflip contracts.
+#
+# The ABIs are read from build/contracts and every event is registered by its contract and
+# topic0, as contracts can emit events with the same signature but different indexed
+# arguments. A log whose topics don't match its contract's event raises a ValueError. A single
+# eth_getLogs stream covering all the contract addresses is fetched in parallel ranges (see
+# fetch_log_chunks) and the decoded events are stored in SQLite, with one row per event and one
+# row per event argument, so they can be queried by contract, event name, block range and any
+# argument value. Rows are keyed by the chain ID and the indexed contracts, so a database can
+# hold several indexes. The hash of the last synced block is stored too, and the index is
+# dropped and rebuilt if the chain it was synced from has changed (e.g. a restarted localnet).
+# The last `confirmations` blocks are never indexed as they can be reorged.
+#
+# e.g. all SwapNative events for a destination token in a block range:
+#   indexer.query("SwapNative", from_block=start, to_block=end, dstToken=token)
+
+EVENT_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync (
+    chain_id INTEGER NOT NULL,
+    contracts TEXT NOT NULL,
+    first_block INTEGER NOT NULL,
+    synced_block INTEGER NOT NULL,
+    synced_block_hash BLOB,
+    PRIMARY KEY (chain_id, contracts)
+);
+CREATE TABLE IF NOT EXISTS events (
+    chain_id INTEGER NOT NULL,
+    contracts TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    transaction_hash TEXT NOT NULL,
+    contract TEXT NOT NULL,
+    address TEXT NOT NULL,
+    event TEXT NOT NULL,
+    topic0 TEXT NOT NULL,
+    args TEXT NOT NULL,
+    PRIMARY KEY (chain_id, contracts, block_number, log_index)
+);
+CREATE INDEX IF NOT EXISTS events_by_event
+    ON events (chain_id, contracts, event, block_number);
+CREATE INDEX IF NOT EXISTS events_by_contract
+    ON events (chain_id, contracts, contract, event, block_number);
+CREATE INDEX IF NOT EXISTS events_by_topic
+    ON events (chain_id, contracts, topic0, block_number);
+CREATE TABLE IF NOT EXISTS event_args (
+    chain_id INTEGER NOT NULL,
+    contracts TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (chain_id, contracts, block_number, log_index, name)
+);
+CREATE INDEX IF NOT EXISTS event_args_by_value
+    ON event_args (chain_id, contracts, name, value);
+"""
+
+EVENT_INDEX_CONFIRMATIONS = 12
+
+
+# Arguments are stored and queried as text. Addresses and byte strings are lowercase hex.
+def _encode_argument(value):
+    value = normalize_argument(value)
+    if isinstance(value, (list, tuple)):
+        return json.dumps([_encode_argument(v) for v in value])
+    return str(value)
+
+
+# All the arguments of an event as json. Byte strings are returned as hex strings by `query`.
+def _encode_arguments(args):
+    return json.dumps(dict(args), default=lambda value: "0x" + value.hex())
+
+
+class EventIndexer:
+    # `contracts` maps contract names in build/contracts (e.g. "Vault", "StateChainGateway",
+    # "KeyManager", "FLIP") to their deployed addresses
+    def __init__(
+        self, path, contracts, w3=web3, confirmations=EVENT_INDEX_CONFIRMATIONS
+    ):
+        self.w3 = w3
+        self.confirmations = confirmations
+        self.db = sqlite3.connect(path)
+        self.db.executescript(EVENT_INDEX_SCHEMA)
+        self.chainId = w3.eth.chain_id
+
+        self.contracts = {
+            w3.toChecksumAddress(str(address)): name
+            for name, address in contracts.items()
+        }
+        self.key = (
+            self.chainId,
+            ",".join(sorted(f"{name}:{addr}" for addr, name in self.contracts.items())),
+        )
+
+        # contract name => topic0 => decoder for every event of the contract
+        self.events = {}
+        for name in set(self.contracts.values()):
+            with open("build/contracts/" + name + ".json") as f:
+                abi = json.load(f)["abi"]
+            self.events[name] = {}
+            for entry in abi:
+                if entry["type"] == "event" and not entry.get("anonymous"):
+                    decoder = get_event_decoder(entry)
+                    self.events[name][decoder.topic0] = decoder
+
+    def close(self):
+        self.db.close()
+
+    def synced_range(self):
+        row = self._sync_row()
+        return None if row is None else row[:2]
+
+    def _sync_row(self):
+        return self.db.execute(
+            "SELECT first_block, synced_block, synced_block_hash FROM sync"
+            " WHERE chain_id=? AND contracts=?",
+            self.key,
+        ).fetchone()
+
+    def _drop_index(self):
+        with self.db:
+            for table in ["sync", "events", "event_args"]:
+                self.db.execute(
+                    f"DELETE FROM {table} WHERE chain_id=? AND contracts=?", self.key
+                )
+
+    def _store_chunk(self, end, logs):
+        events = []
+        event_args = []
+        for log in logs:
+            topic0 = log["topics"][0].hex() if log["topics"] else None
+            address = self.w3.toChecksumAddress(log["address"])
+            if address not in self.contracts:
+                continue
+            decoder = self.events[self.contracts[address]].get(topic0)
+            if decoder is None:
+                continue
+            if not decoder.matches(log):
+                raise ValueError(
+                    f"{self.contracts[address]} log with topic0 {topic0} doesn't match the"
+                    f" indexed arguments of {decoder.name}"
+                    f" ({len(log['topics'])} topics): {log['transactionHash'].hex()}"
+                )
+            data = decoder.decode(log)
+            events.append(
+                self.key
+                + (
+                    data.blockNumber,
+                    data.logIndex,
+                    data.transactionHash.hex(),
+                    self.contracts[address],
+                    address,
+                    data.event,
+                    topic0,
+                    _encode_arguments(data.args),
+                )
+            )
+            event_args.extend(
+                self.key
+                + (data.blockNumber, data.logIndex, name, _encode_argument(value))
+                for name, value in data.args.items()
+            )
+
+        with self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                events,
+            )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO event_args VALUES (?, ?, ?, ?, ?, ?)", event_args
+            )
+            first_block, _ = self.synced_range()
+            self.db.execute(
+                "INSERT OR REPLACE INTO sync VALUES (?, ?, ?, ?, ?)",
+                self.key
+                + (first_block, end, bytes(self.w3.eth.get_block(end)["hash"])),
+            )
+
+    # Index all the events from `from_block` (only used on the first sync) up to `to_block`
+    # capped to the latest confirmed block. Extra kwargs are passed to fetch_log_chunks.
+    def sync(self, from_block=0, to_block="latest", **kwargs):
+        latest = self.w3.eth.block_number
+        to_block = latest if to_block == "latest" else to_block
+        to_block = min(to_block, latest - self.confirmations)
+
+        synced = self._sync_row()
+        # Rebuilt from its first block if the last synced block is no longer in the chain
+        if synced is not None and synced[2] is not None:
+            try:
+                reorged = synced[2] != bytes(self.w3.eth.get_block(synced[1])["hash"])
+            except BlockNotFound:
+                reorged = True
+            if reorged:
+                self._drop_index()
+                from_block = synced[0]
+                synced = None
+
+        if synced is None:
+            with self.db:
+                self.db.execute(
+                    "INSERT INTO sync VALUES (?, ?, ?, ?, ?)",
+                    self.key + (from_block, from_block - 1, None),
+                )
+        else:
+            assert from_block >= synced[0], "Index starts after from_block"
+            from_block = synced[1] + 1
+        if to_block < from_block:
+            return
+
+        params = {"address": list(self.contracts.keys())}
+        for _, end, logs in fetch_log_chunks(
+            params, from_block, to_block, w3=self.w3, **kwargs
+        ):
+            self._store_chunk(end, logs)
+
+    # Query the indexed events in block order. Argument filters can be a single value or a
+    # list of accepted values. Returns the events in the same format as fetch_events.
+    def query(
+        self, event=None, contract=None, from_block=None, to_block=None, **arguments
+    ):
+        conditions = ["e.chain_id = ?", "e.contracts = ?"]
+        params = list(self.key)
+        for column, value in [("event", event), ("contract", contract)]:
+            if value is not None:
+                conditions.append(f"e.{column} = ?")
+                params.append(value)
+        if from_block is not None:
+            conditions.append("e.block_number >= ?")
+            params.append(from_block)
+        if to_block is not None:
+            conditions.append("e.block_number <= ?")
+            params.append(to_block)
+        for name, value in arguments.items():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            conditions.append(
+                "EXISTS (SELECT 1 FROM event_args a WHERE a.chain_id = e.chain_id"
+                " AND a.contracts = e.contracts AND a.block_number = e.block_number"
+                " AND a.log_index = e.log_index AND a.name = ? AND a.value IN ("
+                + ", ".join("?" * len(values))
+                + "))"
+            )
+            params.append(name)
+            params.extend(_encode_argument(v) for v in values)
+
+        query = (
+            "SELECT block_number, log_index, transaction_hash, address, event, args"
+            " FROM events e WHERE "
+            + " AND ".join(conditions)
+            + " ORDER BY block_number, log_index"
+        )
+
+        return [
+            AttributeDict(
+                {
+                    "args": AttributeDict(json.loads(row[5])),
+                    "event": row[4],
+                    "logIndex": row[1],
+                    "transactionHash": row[2],
+                    "address": row[3],
+                    "blockNumber": row[0],
+                }
+            )
+            for row in self.db.execute(query, params)
+        ]
+
+    # First block with a timestamp >= `timestamp`, to query events by date
+    def block_at_timestamp(self, timestamp):
+        low, high = 0, self.w3.eth.block_number
+        while low < high:
+            middle = (low + high) // 2
+            if self.w3.eth.get_block(middle)["timestamp"] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
@@ -1,3 +1,4 @@
+import pytest
 from consts import *
 from brownie import reverts
 from brownie.test import given, strategy
@@ -426,3 +427,52 @@ def newKeyManager_replay_test(
             *args,
             {"from": st_sender},
         )
+
+
+def test_contractMsgHash_encoder_cache(cf):
+    args = [[NATIVE_ADDR, cf.ALICE, TEST_AMNT]]
+    encoder = getContractMsgEncoder(cf.vault.transfer)
+
+    # Same function reuses the encoder, a different selector gets its own one
+    assert getContractMsgEncoder(cf.vault.transfer) is encoder
+    assert getContractMsgEncoder(cf.vault.transferFallback) is not encoder
+
+    # Same result as encoding through the full abi path
+    modified_abi = {"inputs": cf.vault.transfer.abi["inputs"][1:]}
+    assert Signer.generate_contractMsgHash(cf.vault.transfer, *args) == web3.keccak(
+        encode_abi(
+            ["bytes4", "(address,address,uint256)"],
+            [
+                to_bytes(cf.vault.transfer.signature, "bytes4"),
+                *format_input(modified_abi, args),
+            ],
+        )
+    )
+    assert Signer.generate_contractMsgHash(
+        cf.vault.transfer, *args
+    ) != Signer.generate_contractMsgHash(cf.vault.transferFallback, *args)
+
+
+# Addresses are encoded the same way as brownie's format_input, whatever their format
+def test_contractMsgHash_address_formats(cf):
+    alice = str(cf.ALICE)
+    contractMsgHash = Signer.generate_contractMsgHash(
+        cf.vault.transfer, [NATIVE_ADDR, alice, TEST_AMNT]
+    )
+
+    # A mixed-case string with a wrong checksum is accepted, as in format_input
+    i = next(i for i, c in enumerate(alice) if c.isalpha() and i > 1)
+    badChecksum = alice[:i] + alice[i].swapcase() + alice[i + 1 :]
+    for address in [bytes.fromhex(alice[2:]), alice.lower(), cf.ALICE, badChecksum]:
+        assert (
+            Signer.generate_contractMsgHash(
+                cf.vault.transfer, [NATIVE_ADDR, address, TEST_AMNT]
+            )
+            == contractMsgHash
+        )
+
+    # Not an address
+    with pytest.raises(ValueError):
+        Signer.generate_contractMsgHash(
+            cf.vault.transfer, [NATIVE_ADDR, alice[:-2], TEST_AMNT]
+        )
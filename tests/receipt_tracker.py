@@ -0,0 +1,248 @@
+import asyncio
+import time
+import aiohttp
+from web3._utils.method_formatters import receipt_formatter
+from web3.datastructures import AttributeDict
+from web3.exceptions import TransactionNotFound, TimeExhausted
+from hexbytes import HexBytes
+from utils import *
+
+# Tracks the receipts of many transactions at once. Receipts are requested with batched
+# JSON-RPC calls (web3.py has no batch support) sent concurrently to the HTTP endpoint of the
+# provider. Providers without an HTTP endpoint fall back to one web3 request per transaction.
+
+# Seconds a transaction can be unknown to the node before it's considered dropped, as a node
+# might not have indexed a transaction right after it's broadcasted
+DROP_TIMEOUT = 60
+
+# Seconds to wait for all the transactions before raising a TimeExhausted, same default as
+# web3's wait_for_transaction_receipt. None waits indefinitely.
+TIMEOUT = 120
+
+
+class ReceiptTracker:
+    def __init__(
+        self,
+        batch_size=100,
+        max_concurrency=4,
+        poll_interval=1,
+        required_confs=1,
+        drop_timeout=DROP_TIMEOUT,
+        timeout=TIMEOUT,
+        w3=web3,
+    ):
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.poll_interval = poll_interval
+        self.required_confs = required_confs
+        self.drop_timeout = drop_timeout
+        self.timeout = timeout
+        self.w3 = w3
+        provider = getattr(w3, "provider", None)
+        self.endpoint_uri = getattr(provider, "endpoint_uri", None)
+        # Event loop and HTTP session of the synchronous wrappers, kept until `close` so that
+        # repeated calls (e.g. TxPipeline polling) reuse the connections
+        self._loop = None
+        self._session = None
+
+    async def _rpc_batch(self, session, method, paramsList):
+        request = [
+            {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+            for i, params in enumerate(paramsList)
+        ]
+        async with session.post(str(self.endpoint_uri), json=request) as response:
+            response.raise_for_status()
+            results = await response.json()
+        if isinstance(results, dict):
+            raise ValueError(results.get("error", results))
+        results = sorted(results, key=lambda result: result["id"])
+        for result in results:
+            if "error" in result:
+                raise ValueError(result["error"])
+        return [result["result"] for result in results]
+
+    # Send a request per entry of `paramsList`, in batches of `batch_size` requests
+    async def _fetch(self, session, method, paramsList):
+        chunks = [
+            paramsList[i : i + self.batch_size]
+            for i in range(0, len(paramsList), self.batch_size)
+        ]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def fetch_chunk(chunk):
+            async with semaphore:
+                return await self._rpc_batch(session, method, chunk)
+
+        results = await asyncio.gather(*[fetch_chunk(chunk) for chunk in chunks])
+        return [result for chunkResults in results for result in chunkResults]
+
+    # Returns {txHash: receipt or None} and the set of hashes that the node doesn't know at
+    # all (not indexed yet, dropped or replaced). Unknown hashes are only checked if
+    # `check_dropped` is set.
+    async def fetch(self, session, hashes, check_dropped=False):
+        if self.endpoint_uri is None:
+            return self._fetch_sequential(hashes, check_dropped)
+
+        receipts = await self._fetch(
+            session, "eth_getTransactionReceipt", [[txHash] for txHash in hashes]
+        )
+        receipts = {
+            txHash: None
+            if receipt is None
+            else AttributeDict.recursive(receipt_formatter(receipt))
+            for txHash, receipt in zip(hashes, receipts)
+        }
+        unknown = set()
+        if check_dropped:
+            missing = [txHash for txHash in hashes if receipts[txHash] is None]
+            transactions = await self._fetch(
+                session, "eth_getTransactionByHash", [[txHash] for txHash in missing]
+            )
+            unknown = {
+                txHash
+                for txHash, transaction in zip(missing, transactions)
+                if transaction is None
+            }
+        return receipts, unknown
+
+    def _fetch_sequential(self, hashes, check_dropped):
+        receipts = {}
+        unknown = set()
+        for txHash in hashes:
+            try:
+                receipts[txHash] = self.w3.eth.get_transaction_receipt(txHash)
+            except TransactionNotFound:
+                receipts[txHash] = None
+                if check_dropped:
+                    try:
+                        self.w3.eth.get_transaction(txHash)
+                    except TransactionNotFound:
+                        unknown.add(txHash)
+        return receipts, unknown
+
+    # Poll the receipts until every transaction has `required_confs` confirmations or is
+    # dropped (if `drop_unknown` is set). A transaction is dropped once the node hasn't known it
+    # for `drop_timeout` seconds or, if its sender and nonce are given in `nonces` ({txHash:
+    # (sender, nonce)}), as soon as another transaction has been included with its nonce.
+    # `on_progress(confirmed, total)` is called after every round. Returns {txHash: receipt},
+    # with None for the dropped transactions. Raises a TimeExhausted if they are not all
+    # confirmed or dropped within `timeout` seconds.
+    async def track(self, hashes, on_progress=None, drop_unknown=False, nonces=None):
+        async with aiohttp.ClientSession() as session:
+            return await self._track(session, hashes, on_progress, drop_unknown, nonces)
+
+    async def _track(self, session, hashes, on_progress, drop_unknown, nonces):
+        hashes = list(dict.fromkeys(hashes))
+        nonces = nonces or {}
+        results = {}
+        # Time at which each transaction was first found unknown to the node
+        unknown_since = {}
+        start = time.time()
+        while len(results) < len(hashes):
+            pending = [txHash for txHash in hashes if txHash not in results]
+            # Nonces are checked before the receipts, so a transaction included in between
+            # has its receipt returned instead of being taken as replaced
+            used_nonces = {
+                sender: self.w3.eth.get_transaction_count(sender)
+                for sender in {
+                    nonces[txHash][0] for txHash in pending if txHash in nonces
+                }
+            }
+            receipts, unknown = await self.fetch(
+                session, pending, check_dropped=drop_unknown
+            )
+            now = time.time()
+            block_number = self.w3.eth.block_number
+            for txHash, receipt in receipts.items():
+                if txHash in unknown:
+                    since = unknown_since.setdefault(txHash, now)
+                    sender, nonce = nonces.get(txHash, (None, None))
+                    if now - since >= self.drop_timeout or (
+                        sender is not None and nonce < used_nonces[sender]
+                    ):
+                        results[txHash] = None
+                    continue
+                unknown_since.pop(txHash, None)
+                if (
+                    receipt is not None
+                    and block_number - receipt["blockNumber"] + 1 >= self.required_confs
+                ):
+                    results[txHash] = receipt
+            if on_progress is not None:
+                on_progress(len(results), len(hashes))
+            if len(results) < len(hashes):
+                if self.timeout is not None and now - start >= self.timeout:
+                    raise TimeExhausted(
+                        f"{len(hashes) - len(results)} transactions not confirmed after "
+                        f"{self.timeout} seconds"
+                    )
+                await asyncio.sleep(self.poll_interval)
+        return results
+
+    # Run `request(session)` in the event loop of the synchronous wrappers
+    def _run(self, request):
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+
+        async def run():
+            if self._session is None:
+                self._session = aiohttp.ClientSession()
+            return await request(self._session)
+
+        return self._loop.run_until_complete(run())
+
+    # Close the session and event loop of the synchronous wrappers. They are created again
+    # if the tracker is used afterwards.
+    def close(self):
+        if self._session is not None:
+            self._loop.run_until_complete(self._session.close())
+            self._session = None
+        if self._loop is not None:
+            self._loop.close()
+            self._loop = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Synchronous wrappers for scripts
+    def wait(self, hashes, on_progress=None, drop_unknown=False, nonces=None):
+        return self._run(
+            lambda session: self._track(
+                session, hashes, on_progress, drop_unknown, nonces
+            )
+        )
+
+    def get_receipts(self, hashes):
+        async def get_receipts(session):
+            return (await self.fetch(session, list(hashes)))[0]
+
+        return self._run(get_receipts)
+
+
+# eth_call of many (to, data) pairs at `block_identifier` in batched JSON-RPC requests, e.g. to
+# check the state of many contracts at once. Returns the raw output of each call.
+def batch_eth_call(calls, block_identifier="latest", w3=web3, **kwargs):
+    tracker = ReceiptTracker(w3=w3, **kwargs)
+    if isinstance(block_identifier, int):
+        block_identifier = hex(block_identifier)
+    if tracker.endpoint_uri is None:
+        return [
+            w3.eth.call({"to": to, "data": data}, block_identifier)
+            for to, data in calls
+        ]
+
+    async def fetch():
+        async with aiohttp.ClientSession() as session:
+            return await tracker._fetch(
+                session,
+                "eth_call",
+                [
+                    [{"to": str(to), "data": data}, block_identifier]
+                    for to, data in calls
+                ],
+            )
+
+    return [HexBytes(result) for result in asyncio.run(fetch())]
@@ -0,0 +1,94 @@
+import mmap
+import os
+import struct
+from utils import *
+
+# Binary columnar snapshot of token holders and balances.
+#
+# Layout:
+#   header:   magic (4 bytes) | number of holders (uint64) | snapshot block (uint64) |
+#             total balance (32 bytes, big endian) | keccak256 of the payload (32 bytes)
+#   payload:  addresses column (20 bytes each) | balances column (32 bytes each, big endian)
+#
+# The file is read through mmap, so the columns are sliced without copying and any record can
+# be read without parsing the ones before it.
+
+SNAPSHOT_MAGIC = b"CFSS"
+SNAPSHOT_HEADER = struct.Struct(">4sQQ32s32s")
+ADDRESS_SIZE = 20
+BALANCE_SIZE = 32
+
+
+def write_snapshot_file(
+    filename, holders, balances, totalBalance, snapshot_blocknumber
+):
+    addresses = b"".join(bytes.fromhex(cleanHexStr(str(holder))) for holder in holders)
+    balances = b"".join(
+        int(balance).to_bytes(BALANCE_SIZE, "big") for balance in balances
+    )
+    assert len(addresses) // ADDRESS_SIZE == len(balances) // BALANCE_SIZE
+    payload = addresses + balances
+
+    with open(filename + ".tmp", "wb") as f:
+        f.write(
+            SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC,
+                len(addresses) // ADDRESS_SIZE,
+                snapshot_blocknumber,
+                int(totalBalance).to_bytes(32, "big"),
+                keccak(payload),
+            )
+        )
+        f.write(payload)
+    os.replace(filename + ".tmp", filename)
+
+
+class SnapshotFile:
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (
+            magic,
+            self.count,
+            self.snapshot_blocknumber,
+            totalBalance,
+            self.digest,
+        ) = SNAPSHOT_HEADER.unpack_from(self.mm, 0)
+        assert magic == SNAPSHOT_MAGIC, f"Not a snapshot file: {filename}"
+        self.totalBalance = int.from_bytes(totalBalance, "big")
+
+        start = SNAPSHOT_HEADER.size
+        middle = start + self.count * ADDRESS_SIZE
+        end = middle + self.count * BALANCE_SIZE
+        assert len(self.mm) == end, f"Truncated snapshot file: {filename}"
+        view = memoryview(self.mm)
+        self.payload = view[start:end]
+        self.addresses = view[start:middle]
+        self.balances = view[middle:end]
+
+    def __len__(self):
+        return self.count
+
+    def address_bytes(self, i):
+        return self.addresses[i * ADDRESS_SIZE : (i + 1) * ADDRESS_SIZE]
+
+    def address(self, i):
+        return toChecksumAddressFromBytes(bytes(self.address_bytes(i)))
+
+    def balance(self, i):
+        return int.from_bytes(
+            self.balances[i * BALANCE_SIZE : (i + 1) * BALANCE_SIZE], "big"
+        )
+
+    # Check the payload digest and that the balances add up to the total in the header
+    def verify(self):
+        assert keccak(self.payload) == self.digest, "Snapshot digest mismatch"
+        assert (
+            sum(self.balance(i) for i in range(self.count)) == self.totalBalance
+        ), "Snapshot total balance mismatch"
+
+    def close(self):
+        for view in [self.addresses, self.balances, self.payload]:
+            view.release()
+        self.mm.close()
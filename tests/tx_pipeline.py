@@ -0,0 +1,226 @@
+import time
+from utils import *
+from receipt_tracker import ReceiptTracker
+
+# Sends transactions from a local account without waiting for each one to be confirmed before
+# sending the next one. Pipelines should be closed once done (`with TxPipeline(...) as p:`).
+#
+# Nonces are assigned locally and transactions are signed (and their gas estimated) before a
+# slot in the window is available, so up to `window` transactions are in flight at any time.
+# Transactions that are not included after `resubmit_timeout` seconds are signed again with the
+# same nonce and bumped fees. Every broadcasted hash (including replacements) is passed to
+# `on_sent(label, txHash)` so scripts can log it for crash recovery, and every successful
+# receipt to `on_confirmed(label, receipt)`.
+
+# Minimum bump accepted by geth to replace a transaction is 10%
+GAS_BUMP = 1.125
+
+# Errors returned when resubmitting a transaction that don't stop the pipeline. The nonce may
+# have been used by one of the previous hashes in the meantime, the node may already have the
+# replacement or not accept the bump (it's bumped again on the next resubmission). The
+# previous hashes are still tracked in every case.
+RESUBMIT_ERRORS = [
+    "nonce too low",
+    "already known",
+    "known transaction",
+    "replacement transaction underpriced",
+]
+
+
+class TxRevertedError(Exception):
+    def __init__(self, label, receipt):
+        super().__init__(
+            f"Transaction {label} reverted: {receipt['transactionHash'].hex()}"
+        )
+        self.label = label
+        self.receipt = receipt
+
+
+class TxPipeline:
+    def __init__(
+        self,
+        account,
+        window=16,
+        required_confs=1,
+        priority_fee=None,
+        gas_buffer=1.2,
+        resubmit_timeout=180,
+        poll_interval=1,
+        on_sent=None,
+        on_confirmed=None,
+        w3=web3,
+    ):
+        self.account = account
+        self.address = str(account)
+        self.window = window
+        self.required_confs = required_confs
+        self.priority_fee = priority_fee
+        self.gas_buffer = gas_buffer
+        self.resubmit_timeout = resubmit_timeout
+        self.poll_interval = poll_interval
+        self.on_sent = on_sent
+        self.on_confirmed = on_confirmed
+        self.w3 = w3
+        # Receipts of all the transactions in flight are requested in a single batch, reusing
+        # the tracker's connection until the pipeline is closed
+        self.tracker = ReceiptTracker(w3=w3)
+        self.chainId = w3.eth.chain_id
+        self.nonce = w3.eth.get_transaction_count(self.address, "pending")
+        # Transactions in flight by nonce
+        self.pending = {}
+        # Receipts of the confirmed transactions by label
+        self.receipts = {}
+        # Nonce of every broadcasted hash, set before `on_sent` is called
+        self.nonces = {}
+        self.labels = []
+
+    def _fees(self):
+        return get_fees(self.priority_fee, w3=self.w3)
+
+    def _sign(self, tx):
+        return self.w3.eth.account.sign_transaction(tx, self.account.private_key)
+
+    # Sign a transaction with the next nonce and broadcast it once there is a slot in the
+    # window. `tx` needs at least "to" and "data" (only "data" for contract deployments).
+    # Labels must be unique and default to the index of the transaction. Returns the
+    # transaction hash.
+    def send(self, tx, label=None):
+        label = len(self.labels) if label is None else label
+        tx = dict(tx)
+        tx.setdefault("value", 0)
+        if "gas" not in tx:
+            tx["gas"] = int(
+                self.w3.eth.estimate_gas(dict(tx, **{"from": self.address}))
+                * self.gas_buffer
+            )
+        tx.update(self._fees(), chainId=self.chainId, nonce=self.nonce)
+        signedTx = self._sign(tx)
+        self.nonce += 1
+
+        while len(self.pending) >= self.window:
+            self._wait()
+
+        txHash = self._broadcast(label, signedTx, tx["nonce"])
+        self.labels.append(label)
+        self.pending[tx["nonce"]] = {
+            "label": label,
+            "tx": tx,
+            "hashes": [txHash],
+            "sent": time.time(),
+        }
+        return txHash
+
+    def _broadcast(self, label, signedTx, nonce):
+        txHash = self.w3.eth.send_raw_transaction(signedTx.rawTransaction).hex()
+        self.nonces[txHash] = nonce
+        if self.on_sent is not None:
+            self.on_sent(label, txHash)
+        return txHash
+
+    def _resubmit(self, entry):
+        tx = entry["tx"]
+        for fee in ["gasPrice", "maxFeePerGas", "maxPriorityFeePerGas"]:
+            if fee in tx:
+                tx[fee] = int(tx[fee] * GAS_BUMP) + 1
+        signedTx = self._sign(tx)
+        try:
+            entry["hashes"].append(
+                self._broadcast(entry["label"], signedTx, tx["nonce"])
+            )
+        except ValueError as e:
+            message = str(e).lower()
+            if not any(error in message for error in RESUBMIT_ERRORS):
+                raise
+            # The node has this exact transaction, so it can be included
+            known = "already known" in message or "known transaction" in message
+            txHash = signedTx.hash.hex()
+            if known and txHash not in entry["hashes"]:
+                entry["hashes"].append(txHash)
+                self.nonces[txHash] = tx["nonce"]
+                if self.on_sent is not None:
+                    self.on_sent(entry["label"], txHash)
+        entry["sent"] = time.time()
+
+    # Check the receipts of the transactions in flight once. Resubmits the stuck ones and
+    # raises a TxRevertedError if any of them has reverted. Returns the number of transactions
+    # confirmed.
+    def poll(self):
+        block_number = self.w3.eth.block_number
+        receipts = self.tracker.get_receipts(
+            [txHash for entry in self.pending.values() for txHash in entry["hashes"]]
+        )
+        confirmed = 0
+        for nonce, entry in sorted(self.pending.items()):
+            receipt = None
+            for txHash in entry["hashes"]:
+                receipt = receipts[txHash]
+                if receipt is not None:
+                    break
+
+            if receipt is None:
+                if time.time() - entry["sent"] > self.resubmit_timeout:
+                    self._resubmit(entry)
+                continue
+            if block_number - receipt["blockNumber"] + 1 < self.required_confs:
+                continue
+
+            del self.pending[nonce]
+            self.receipts[entry["label"]] = receipt
+            confirmed += 1
+            if receipt["status"] == 0:
+                raise TxRevertedError(entry["label"], receipt)
+            if self.on_confirmed is not None:
+                self.on_confirmed(entry["label"], receipt)
+        return confirmed
+
+    def _wait(self):
+        if self.poll() == 0:
+            time.sleep(self.poll_interval)
+
+    # Wait until all the transactions are confirmed. Returns the receipts in the order in
+    # which the transactions were sent.
+    def wait_all(self):
+        while self.pending:
+            self._wait()
+        return [self.receipts[label] for label in self.labels]
+
+    # Close the connection used to poll the receipts. `send` and `wait_all` can raise (e.g. a
+    # TxRevertedError), so use the pipeline as a context manager or close it in a `finally`.
+    def close(self):
+        self.tracker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# EIP-1559 fees with room for the base fee to double, or the legacy gas price on chains
+# without a base fee
+def get_fees(priority_fee=None, w3=web3):
+    block = w3.eth.get_block("latest")
+    if block.get("baseFeePerGas") is None:
+        return {"gasPrice": w3.eth.gas_price}
+    if priority_fee is None:
+        priority_fee = w3.eth.max_priority_fee
+    return {
+        "maxFeePerGas": 2 * block["baseFeePerGas"] + priority_fee,
+        "maxPriorityFeePerGas": priority_fee,
+    }
+
+
+# Wait until there are no transactions from `address` left in the mempool, so that all the
+# transactions sent by a previous run are included before the chain state is checked
+def wait_for_pending_transactions(address, poll_interval=1, w3=web3):
+    address = str(address)
+    while w3.eth.get_transaction_count(
+        address, "pending"
+    ) > w3.eth.get_transaction_count(address, "latest"):
+        time.sleep(poll_interval)
+
+
+# Wait until `block_number` has `confirmations` confirmations (the block itself counts as one)
+def wait_for_confirmations(block_number, confirmations, poll_interval=1, w3=web3):
+    while w3.eth.block_number - block_number + 1 < confirmations:
+        time.sleep(poll_interval)
@@ -84,3 +84,36 @@ def test_verifySignature_rev_msgHash_zero(schnorrTest):
         schnorrTest.testVerifySignature(
             0, sigData[0], *AGG_SIGNER_1.getPubData(), sigData[2]
         )
+
+
+@given(st_msgHash=strategy("bytes32"))
+def test_sign_matches_py_ecc(schnorrTest, st_msgHash):
+    msgHashHex = cleanHexStr(st_msgHash)
+
+    for signer in [AGG_SIGNER_1, AGG_SIGNER_2]:
+        [s, nonceTimesGeneratorAddress] = signer.sign(msgHashHex)
+        assert [s, nonceTimesGeneratorAddress] == signer.sign_py_ecc(msgHashHex)
+
+        if int(msgHashHex, 16) != 0:
+            schnorrTest.testVerifySignature(
+                int(msgHashHex, 16), s, *signer.getPubData(), nonceTimesGeneratorAddress
+            )
+
+
+def test_sign_cache(schnorrTest):
+    signer = Signer(AGG_PRIV_HEX_1, AGG, nonces, signatureCacheSize=2)
+    msgHashes = [cleanHexStrPad(i) for i in range(1, 4)]
+
+    signatures = [signer.sign(msgHash) for msgHash in msgHashes]
+    assert signer.getSignatureCacheStats() == {"hits": 0, "misses": 3, "size": 2}
+
+    # Cached signatures are the same as the uncached ones and still verify
+    assert signer.sign(msgHashes[2]) == signatures[2] == AGG_SIGNER_1.sign(msgHashes[2])
+    assert signer.getSignatureCacheStats() == {"hits": 1, "misses": 3, "size": 2}
+    schnorrTest.testVerifySignature(
+        3, signatures[2][0], *signer.getPubData(), signatures[2][1]
+    )
+
+    # The first msgHash has been evicted
+    signer.sign(msgHashes[0])
+    assert signer.getSignatureCacheStats() == {"hits": 1, "misses": 4, "size": 2}
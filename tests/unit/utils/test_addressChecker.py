@@ -33,6 +33,56 @@ def test_addressChecker_balances_gas(cf):
     )
 
 
+@given(
+    st_addresses=strategy("address[]"),
+)
+def test_addressChecker_tokenBalances(cf, st_addresses):
+    st_addresses.extend([cf.stateChainGateway, cf.SAFEKEEPER])
+    addresses_balances = [cf.flip.balanceOf(address) for address in st_addresses]
+    assert cf.addressChecker.tokenBalances(cf.flip, st_addresses) == addresses_balances
+
+
+def test_get_token_balances(cf):
+    holders = [cf.stateChainGateway, cf.SAFEKEEPER, cf.ALICE, cf.BOB] * 10
+    block = web3.eth.block_number
+    balances = [cf.flip.balanceOf(holder) for holder in holders]
+
+    cf.flip.transfer(cf.ALICE, 1, {"from": cf.SAFEKEEPER})
+
+    # Pinned to the block before the transfer
+    assert (
+        get_token_balances(
+            cf.addressChecker,
+            cf.flip,
+            holders,
+            block_identifier=block,
+            chunk_size=3,
+            max_workers=4,
+        )
+        == balances
+    )
+    assert get_token_balances(cf.addressChecker, cf.flip, holders) == [
+        cf.flip.balanceOf(holder) for holder in holders
+    ]
+
+
+# A checker deployed after the pinned block is given to the call as a state override
+def test_get_token_balances_undeployed_checker(cf, AddressChecker):
+    holders = [cf.stateChainGateway, cf.SAFEKEEPER, cf.ALICE, cf.BOB]
+    block = web3.eth.block_number
+    balances = [cf.flip.balanceOf(holder) for holder in holders]
+
+    cf.flip.transfer(cf.ALICE, 1, {"from": cf.SAFEKEEPER})
+    addressChecker = cf.deployer.deploy(AddressChecker)
+
+    assert (
+        get_token_balances(
+            addressChecker, cf.flip, holders, block_identifier=block, chunk_size=3
+        )
+        == balances
+    )
+
+
 def test_addressChecker_deploymentStatus(cf, Deposit):
 
     deployedStatus = cf.addressChecker.contractsDeployed(
@@ -0,0 +1,160 @@
+import pytest
+from consts import *
+from shared_tests import *
+from airdrop_batches import (
+    allowance_override,
+    plan_airdrop,
+    write_airdrop_plan,
+    read_airdrop_plan,
+    pending_batches,
+    update_sent_batches,
+    send_airdrop_batches,
+)
+from tx_pipeline import TxRevertedError
+from brownie import accounts, AirdropMock
+
+GAS_CEILING = 300000
+
+
+def setup_airdrop(cf, numRecipients=30):
+    airdrop = AirdropMock.deploy({"from": cf.SAFEKEEPER})
+    sender = accounts.add()
+    cf.SAFEKEEPER.transfer(sender, E_18)
+    recipients = [accounts.add().address for _ in range(numRecipients)]
+    amounts = [i + 1 for i in range(numRecipients)]
+    cf.flip.transfer(sender, sum(amounts), {"from": cf.SAFEKEEPER})
+    cf.flip.approve(airdrop, sum(amounts), {"from": sender})
+    return airdrop, sender, recipients, amounts
+
+
+def test_plan_airdrop(cf):
+    airdrop, sender, recipients, amounts = setup_airdrop(cf)
+    plan = plan_airdrop(
+        airdrop, cf.flip, sender, recipients, amounts, gas_ceiling=GAS_CEILING
+    )
+    batches = plan["batches"]
+
+    assert plan["token"] == cf.flip.address
+    assert len(batches) > 1
+    assert [r for batch in batches for r in batch["recipients"]] == recipients
+    assert [a for batch in batches for a in batch["amounts"]] == amounts
+    for batch in batches:
+        assert batch["total"] == sum(batch["amounts"])
+        assert batch["gas"] <= GAS_CEILING
+        assert batch["txHashes"] == []
+        assert batch["blockNumber"] == None
+    assert pending_batches(plan) == batches
+
+
+# The batches can be planned before the approval by overriding the allowance
+def test_plan_airdrop_allowance_override(cf):
+    airdrop, sender, recipients, amounts = setup_airdrop(cf)
+    expected = plan_airdrop(
+        airdrop, cf.flip, sender, recipients, amounts, gas_ceiling=GAS_CEILING
+    )
+    cf.flip.approve(airdrop, 0, {"from": sender})
+
+    override = allowance_override(cf.flip, sender, airdrop, sum(amounts))
+    if override is None:
+        pytest.skip("State overrides not supported by the node")
+    assert cf.flip.allowance(sender, airdrop) == 0
+    try:
+        plan = plan_airdrop(
+            airdrop,
+            cf.flip,
+            sender,
+            recipients,
+            amounts,
+            gas_ceiling=GAS_CEILING,
+            state_override=override,
+        )
+    except ValueError:
+        pytest.skip("State overrides in eth_estimateGas not supported by the node")
+    assert plan == expected
+
+
+def test_read_airdrop_plan(cf, tmp_path):
+    airdrop, sender, recipients, amounts = setup_airdrop(cf, 5)
+    plan = plan_airdrop(airdrop, cf.flip, sender, recipients, amounts)
+    filename = str(tmp_path / "plan.json")
+    write_airdrop_plan(filename, plan)
+
+    assert read_airdrop_plan(filename, cf.flip, recipients, amounts) == plan
+
+    # A plan for other transfers can't be resumed
+    for args in [
+        (cf.flip, recipients, amounts[:-1] + [amounts[-1] + 1]),
+        (cf.flip, recipients[::-1], amounts),
+        (cf.flip, recipients[:-1], amounts[:-1]),
+        (ZERO_ADDR, recipients, amounts),
+    ]:
+        with pytest.raises(AssertionError):
+            read_airdrop_plan(filename, *args)
+
+
+# A previous run landed the first batch and broadcasted the second one, which was dropped.
+# Only the batches that didn't land are sent when resuming.
+def test_send_airdrop_batches_resume(cf, tmp_path):
+    airdrop, sender, recipients, amounts = setup_airdrop(cf)
+    plan = plan_airdrop(
+        airdrop, cf.flip, sender, recipients, amounts, gas_ceiling=GAS_CEILING
+    )
+    batches = plan["batches"]
+    filename = str(tmp_path / "plan.json")
+
+    landed = batches[0]
+    tx = airdrop.airdropERC20(
+        cf.flip,
+        landed["recipients"],
+        landed["amounts"],
+        landed["total"],
+        {"from": sender},
+    )
+    landed["txHashes"].append(tx.txid)
+    batches[1]["txHashes"].append("0x" + JUNK_HEX_PAD)
+    write_airdrop_plan(filename, plan)
+
+    plan = read_airdrop_plan(filename, cf.flip, recipients, amounts)
+    update_sent_batches(plan, sender)
+    batches = plan["batches"]
+    assert batches[0]["blockNumber"] == tx.block_number
+    assert batches[1]["txHashes"] == []
+    assert pending_batches(plan) == batches[1:]
+
+    sent = []
+    send_airdrop_batches(
+        filename,
+        plan,
+        airdrop,
+        cf.flip,
+        sender,
+        window=2,
+        on_sent=lambda i, txHash: sent.append(i),
+    )
+    assert sent == list(range(1, len(batches)))
+    assert pending_batches(plan) == []
+    assert read_airdrop_plan(filename, cf.flip, recipients, amounts) == plan
+    # Every recipient got its amount exactly once
+    assert [cf.flip.balanceOf(recipient) for recipient in recipients] == amounts
+    assert cf.flip.balanceOf(sender) == 0
+
+
+# The last batch reverts for lack of allowance, either on its receipt or on the broadcast
+# (e.g. hardhat's throwOnTransactionFailures). The batches that landed are still recorded.
+def test_send_airdrop_batches_revert(cf, tmp_path):
+    airdrop, sender, recipients, amounts = setup_airdrop(cf)
+    plan = plan_airdrop(
+        airdrop, cf.flip, sender, recipients, amounts, gas_ceiling=GAS_CEILING
+    )
+    batches = plan["batches"]
+    filename = str(tmp_path / "plan.json")
+    write_airdrop_plan(filename, plan)
+    cf.flip.approve(airdrop, sum(amounts) - batches[-1]["total"], {"from": sender})
+
+    with pytest.raises((TxRevertedError, ValueError)):
+        send_airdrop_batches(filename, plan, airdrop, cf.flip, sender)
+
+    plan = read_airdrop_plan(filename, cf.flip, recipients, amounts)
+    assert pending_batches(plan) == [plan["batches"][-1]]
+    assert plan["batches"][-1]["txHashes"] == []
+    assert cf.flip.balanceOf(sender) == batches[-1]["total"]
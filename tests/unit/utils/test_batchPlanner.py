@@ -0,0 +1,59 @@
+from consts import *
+from shared_tests import *
+from batch_planner import BatchPlanner, calldata_gas
+from eth_abi import encode_abi
+from brownie import accounts, web3, MultiSend
+
+
+def test_calldata_gas():
+    assert calldata_gas("0x") == 0
+    assert calldata_gas("0x0001ff00") == 2 * 4 + 2 * 16
+
+
+def test_batchPlanner_multiSend(cf):
+    multiSend = MultiSend.deploy({"from": cf.SAFEKEEPER})
+    transfers = [[accounts.add().address, i + 1] for i in range(60)]
+    totalAmount = sum(amount for _, amount in transfers)
+    cf.flip.approve(multiSend, totalAmount, {"from": cf.SAFEKEEPER})
+
+    def encode_batch(batch):
+        return multiSend.multiSendToken.encode_input(
+            cf.flip, batch, sum(amount for _, amount in batch)
+        )
+
+    def estimate_gas(data):
+        return web3.eth.estimate_gas(
+            {"from": str(cf.SAFEKEEPER), "to": multiSend.address, "data": data}
+        )
+
+    gas_ceiling = 500000
+    planner = BatchPlanner(
+        encode_batch,
+        lambda transfer: encode_abi(["address", "uint256"], transfer),
+        estimate_gas,
+        gas_ceiling,
+    )
+    batches = planner.verify(planner.plan(transfers))
+
+    # Batches keep the order of the transfers and fit in the gas ceiling
+    assert [transfer for batch, _ in batches for transfer in batch] == transfers
+    assert len(batches) > 1
+    for batch, gas in batches:
+        assert gas <= gas_ceiling
+
+    for batch, gas in batches:
+        tx = multiSend.multiSendToken(
+            cf.flip,
+            batch,
+            sum(amount for _, amount in batch),
+            {"from": cf.SAFEKEEPER, "gas_limit": gas},
+        )
+        assert tx.gas_used <= gas_ceiling
+    for address, amount in transfers:
+        assert cf.flip.balanceOf(address) == amount
+
+    # Batches over the ceiling are split when verified
+    planner.gas_ceiling = 5 * planner.item_gas(transfers[0]) + planner.base_gas
+    batches = planner.verify([transfers])
+    assert [transfer for batch, _ in batches for transfer in batch] == transfers
+    assert all(gas <= planner.gas_ceiling for _, gas in batches)
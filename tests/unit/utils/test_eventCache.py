@@ -0,0 +1,39 @@
+from consts import *
+from shared_tests import *
+from utils import fetch_events
+from event_cache import EventCache
+from brownie import chain, web3
+
+
+def test_eventCache_fetch_events(cf, tmp_path):
+    contractObject = web3.eth.contract(address=cf.flip.address, abi=cf.flip.abi)
+    event = contractObject.events.Transfer
+    topic0 = web3.keccak(text="Transfer(address,address,uint256)")
+    cache = EventCache(str(tmp_path / "events.db"), confirmations=0)
+
+    cf.flip.transfer(cf.ALICE, 1, {"from": cf.SAFEKEEPER})
+    to_block = web3.eth.block_number
+    events = list(fetch_events(event, from_block=0, to_block=to_block))
+    assert list(cache.fetch_events(event, from_block=0, to_block=to_block)) == events
+    assert cache.synced_range(cf.flip.address, topic0) == (0, to_block)
+
+    # Only the new blocks are fetched
+    for i in range(3):
+        cf.flip.transfer(cf.BOB, i + 1, {"from": cf.SAFEKEEPER})
+        chain.mine(2)
+    to_block = web3.eth.block_number
+    events = list(fetch_events(event, from_block=0, to_block=to_block))
+    cachedEvents = list(
+        cache.fetch_events(event, from_block=0, to_block=to_block, chunk_size=2)
+    )
+    assert cachedEvents == events
+    assert cache.synced_range(cf.flip.address, topic0) == (0, to_block)
+
+    # Unconfirmed blocks are not stored
+    cache.confirmations = 5
+    cf.flip.transfer(cf.BOB, 1, {"from": cf.SAFEKEEPER})
+    events = list(fetch_events(event, from_block=0, to_block="latest"))
+    assert list(cache.fetch_events(event, from_block=0)) == events
+    assert cache.synced_range(cf.flip.address, topic0) == (0, to_block)
+
+    cache.close()
@@ -0,0 +1,63 @@
+from consts import *
+from shared_tests import *
+from utils import EventDecoder, keccak
+from web3._utils.events import get_event_data, construct_event_topic_set
+from eth_abi import encode_abi
+from hexbytes import HexBytes
+from brownie import web3
+
+ABI = {
+    "type": "event",
+    "name": "Test",
+    "anonymous": False,
+    "inputs": [
+        {"indexed": True, "name": "sender", "type": "address"},
+        {"indexed": True, "name": "tag", "type": "string"},
+        {"indexed": True, "name": "delta", "type": "int32"},
+        {"indexed": False, "name": "dstAddress", "type": "bytes"},
+        {"indexed": False, "name": "recipients", "type": "address[]"},
+        {"indexed": False, "name": "amount", "type": "uint256"},
+    ],
+}
+
+
+def test_eventDecoder_decode():
+    decoder = EventDecoder(ABI)
+    address = "0x" + "ab" * 20
+    topics, dataFilters = decoder.topics(
+        {"sender": address, "tag": "swap", "delta": -5, "amount": [1, 2]}
+    )
+    assert dataFilters == {"amount": [1, 2]}
+    assert topics[2] == "0x" + keccak(b"swap").hex()
+    referenceTopics = construct_event_topic_set(
+        ABI, web3.codec, {"sender": address, "delta": -5}
+    )
+    assert [topics[i] for i in [0, 1, 3]] == [referenceTopics[i] for i in [0, 1, 3]]
+
+    log = {
+        "address": web3.toChecksumAddress(address),
+        "topics": [HexBytes(topic) for topic in topics],
+        "data": "0x"
+        + encode_abi(
+            ["bytes", "address[]", "uint256"], [b"\x01\x02", [address], 10**30]
+        ).hex(),
+        "blockNumber": 5,
+        "logIndex": 1,
+        "transactionIndex": 0,
+        "transactionHash": HexBytes("0x" + JUNK_HEX_PAD),
+        "blockHash": HexBytes("0x" + JUNK_HEX_PAD),
+    }
+    assert decoder.decode(log) == get_event_data(web3.codec, ABI, log)
+
+    # Raw JSON-RPC logs are decoded too and the ones from other events are skipped
+    rawLog = dict(
+        log,
+        topics=topics,
+        blockNumber="0x5",
+        logIndex="0x1",
+        transactionIndex="0x0",
+        transactionHash="0x" + JUNK_HEX_PAD,
+        blockHash="0x" + JUNK_HEX_PAD,
+    )
+    otherLog = dict(rawLog, topics=["0x" + JUNK_HEX_PAD] + topics[1:])
+    assert list(decoder.decode_logs([rawLog, otherLog])) == [decoder.decode(log)]
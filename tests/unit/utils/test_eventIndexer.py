@@ -0,0 +1,93 @@
+import pytest
+from consts import *
+from shared_tests import *
+from event_indexer import EventIndexer
+from brownie import chain, web3
+
+
+def test_eventIndexer_sync_query(cf, tmp_path):
+    contracts = {
+        "FLIP": cf.flip.address,
+        "Vault": cf.vault.address,
+        "StateChainGateway": cf.stateChainGateway.address,
+        "KeyManager": cf.keyManager.address,
+    }
+    indexer = EventIndexer(str(tmp_path / "index.db"), contracts, confirmations=0)
+
+    cf.flip.transfer(cf.ALICE, 7, {"from": cf.SAFEKEEPER})
+    cf.keyManager.govAction(JUNK_HEX, {"from": cf.GOVERNOR})
+    indexer.sync(chunk_size=5)
+    assert indexer.synced_range() == (0, web3.eth.block_number)
+
+    # Only the new blocks are fetched on the next sync
+    start = web3.eth.block_number + 1
+    for i in range(3):
+        cf.flip.transfer(cf.BOB, i + 1, {"from": cf.SAFEKEEPER})
+        chain.mine(2)
+    indexer.sync(chunk_size=5)
+    assert indexer.synced_range() == (0, web3.eth.block_number)
+
+    transfers = indexer.query("Transfer", contract="FLIP", from_block=start)
+    assert [e.args.value for e in transfers] == [1, 2, 3]
+    assert all(e.args.to == cf.BOB.address for e in transfers)
+
+    # Argument filters are case-insensitive and accept a list of values
+    transfers = indexer.query("Transfer", to=cf.ALICE.address.lower())
+    assert 7 in [e.args.value for e in transfers]
+    assert len(indexer.query("Transfer", value=[2, 3])) == 2
+
+    # Events from the other contracts are indexed too
+    actions = indexer.query("GovernanceAction", contract="KeyManager")
+    assert len(actions) == 1
+
+    indexer.close()
+
+
+# Indexes of different contract sets share the database without mixing their events, and an
+# index synced from a chain that has since changed is rebuilt
+def test_eventIndexer_keys_and_reorg(cf, tmp_path):
+    path = str(tmp_path / "index.db")
+    flipIndexer = EventIndexer(path, {"FLIP": cf.flip.address}, confirmations=0)
+    vaultIndexer = EventIndexer(path, {"Vault": cf.vault.address}, confirmations=0)
+
+    snapshot_block = web3.eth.block_number
+    chain.snapshot()
+    cf.flip.transfer(cf.ALICE, 11, {"from": cf.SAFEKEEPER})
+    chain.mine(2)
+    flipIndexer.sync(from_block=snapshot_block)
+    vaultIndexer.sync(from_block=snapshot_block)
+    assert [e.args.value for e in flipIndexer.query("Transfer")] == [11]
+    assert vaultIndexer.query("Transfer") == []
+
+    chain.revert()
+    cf.flip.transfer(cf.BOB, 13, {"from": cf.SAFEKEEPER})
+    chain.mine(5)
+    flipIndexer.sync()
+    assert flipIndexer.synced_range() == (snapshot_block, web3.eth.block_number)
+    assert [(e.args.to, e.args.value) for e in flipIndexer.query("Transfer")] == [
+        (cf.BOB.address, 13)
+    ]
+
+    flipIndexer.close()
+    vaultIndexer.close()
+
+
+# Decoders are looked up by contract, and a log that doesn't match its contract's event
+# (e.g. a different number of indexed arguments) raises instead of being skipped
+def test_eventIndexer_rev_topics_mismatch(cf, tmp_path):
+    indexer = EventIndexer(
+        str(tmp_path / "index.db"), {"FLIP": cf.flip.address}, confirmations=0
+    )
+    tx = cf.flip.transfer(cf.ALICE, 7, {"from": cf.SAFEKEEPER})
+    log = dict(web3.eth.get_transaction_receipt(tx.txid)["logs"][0])
+    log["topics"] = log["topics"][:2]
+
+    with pytest.raises(ValueError, match="Transfer"):
+        indexer._store_chunk(tx.block_number, [log])
+
+    # The same log from a contract that isn't indexed is ignored
+    log["address"] = cf.vault.address
+    indexer.sync(from_block=tx.block_number)
+    indexer._store_chunk(tx.block_number, [log])
+    assert indexer.query("Transfer", to=cf.ALICE.address) != []
+    indexer.close()
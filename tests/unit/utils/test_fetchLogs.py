@@ -0,0 +1,124 @@
+import pytest
+from consts import *
+from shared_tests import *
+from utils import fetch_events, fetch_log_chunks
+from brownie import chain, web3
+
+# Stub provider that rejects any request returning more than `max_results` logs
+class LimitedLogsW3:
+    def __init__(self, logs, max_results):
+        self.eth = self
+        self.logs = logs
+        self.max_results = max_results
+        self.calls = 0
+
+    def get_logs(self, params):
+        self.calls += 1
+        logs = [
+            log
+            for log in self.logs
+            if params["fromBlock"] <= log["blockNumber"] <= params["toBlock"]
+        ]
+        if len(logs) > self.max_results:
+            raise ValueError(
+                {"code": -32005, "message": "query returned more than 10000 results"}
+            )
+        return logs
+
+
+def test_fetch_log_chunks_bisect():
+    logs = [{"blockNumber": block} for block in range(0, 1000, 3)]
+    logs += [{"blockNumber": 500}] * 4
+    logs.sort(key=lambda log: log["blockNumber"])
+    w3 = LimitedLogsW3(logs, 5)
+
+    chunks = list(fetch_log_chunks({}, 0, 999, chunk_size=100, max_workers=4, w3=w3))
+
+    # Chunks are contiguous, in block order and contain all the logs
+    assert chunks[0][0] == 0 and chunks[-1][1] == 999
+    for (_, end, _), (start, _, _) in zip(chunks, chunks[1:]):
+        assert start == end + 1
+    assert [log for (_, _, chunkLogs) in chunks for log in chunkLogs] == logs
+
+
+def test_fetch_log_chunks_rev_error():
+    w3 = LimitedLogsW3([{"blockNumber": 1}] * 2, 1)
+    # A single block can't be bisected
+    with pytest.raises(ValueError):
+        list(fetch_log_chunks({}, 1, 1, w3=w3))
+
+
+# Stub provider that rate limits the first `rate_limited` requests
+class RateLimitedLogsW3(LimitedLogsW3):
+    def __init__(self, logs, max_results, rate_limited):
+        super().__init__(logs, max_results)
+        self.rate_limited = rate_limited
+
+    def get_logs(self, params):
+        if self.rate_limited > 0:
+            self.rate_limited -= 1
+            self.calls += 1
+            raise ValueError(
+                {
+                    "code": -32005,
+                    "message": "daily request count exceeded, request rate limited",
+                }
+            )
+        return super().get_logs(params)
+
+
+def test_fetch_log_chunks_rate_limited():
+    logs = [{"blockNumber": block} for block in range(100)]
+    w3 = RateLimitedLogsW3(logs, 1000, 3)
+
+    chunks = list(
+        fetch_log_chunks({}, 0, 99, chunk_size=100, rate_limit_backoff=0, w3=w3)
+    )
+
+    # Retried without bisecting the range
+    assert chunks == [(0, 99, logs)]
+    assert w3.calls == 4
+
+    w3 = RateLimitedLogsW3(logs, 1000, 3)
+    with pytest.raises(ValueError):
+        list(
+            fetch_log_chunks(
+                {}, 0, 99, rate_limit_retries=2, rate_limit_backoff=0, w3=w3
+            )
+        )
+
+
+def test_fetch_events_chunked(cf):
+    for i in range(5):
+        cf.flip.transfer(cf.ALICE, i + 1, {"from": cf.SAFEKEEPER})
+        chain.mine(3)
+
+    from_block = 0
+    to_block = web3.eth.block_number
+    contractObject = web3.eth.contract(address=cf.flip.address, abi=cf.flip.abi)
+    event = contractObject.events.Transfer
+
+    events = list(fetch_events(event, from_block=from_block, to_block=to_block))
+    chunkedEvents = list(
+        fetch_events(
+            event, from_block=from_block, to_block=to_block, chunk_size=2, max_workers=3
+        )
+    )
+    assert len(events) > 5
+    assert chunkedEvents == events
+
+
+def test_fetch_events_argument_filters(cf):
+    cf.flip.transfer(cf.ALICE, 7, {"from": cf.SAFEKEEPER})
+    cf.flip.transfer(cf.BOB, 8, {"from": cf.SAFEKEEPER})
+    contractObject = web3.eth.contract(address=cf.flip.address, abi=cf.flip.abi)
+    event = contractObject.events.Transfer
+
+    # Indexed argument, filtered by the node
+    events = list(fetch_events(event, {"to": cf.BOB.address}, from_block=0))
+    assert len(events) > 0
+    assert all(e.args.to == cf.BOB for e in events)
+
+    # Non-indexed argument, filtered once decoded
+    events = list(fetch_events(event, {"value": [7, 8]}, from_block=0))
+    assert [e.args.value for e in events] == [7, 8]
@@ -0,0 +1,28 @@
+from consts import *
+from shared_tests import *
+from brownie import accounts, web3, MockMaths
+
+
+# Addresses are predicted before the deployments, including the first nonce (RLP encoded as
+# an empty string) and nonces skipped by other transactions
+def test_getCreateAddr_deployments(cf):
+    deployer = accounts.add()
+    cf.SAFEKEEPER.transfer(deployer, E_18)
+
+    for nonce in [0, 1, 3]:
+        # Nonce 2 is used by a transfer
+        if nonce == 3:
+            deployer.transfer(cf.SAFEKEEPER, 1)
+        assert deployer.nonce == nonce
+        expected = getCreateAddr(deployer, nonce)
+        assert MockMaths.deploy({"from": deployer}).tx.contract_address == expected
+
+
+def test_getCreateAddr_vectors():
+    sender = "0x6ac7ea33f8831ea9dcc53393aaa88b25a785dbf0"
+    for nonce, address in [
+        (0, "0xcd234a471b72ba2f1ccf0a70fcaba648a5eecd8d"),
+        (1, "0x343c43a37d37dff08ae8c4a11544c718abb4fcf8"),
+        (2, "0xf778b86fa74e846c4f0a1fbd1335fe81c00a0c91"),
+    ]:
+        assert getCreateAddr(sender, nonce) == web3.toChecksumAddress(address)
@@ -0,0 +1,87 @@
+import pytest
+from consts import *
+from shared_tests import *
+from receipt_tracker import ReceiptTracker, batch_eth_call
+from brownie import web3
+from web3.exceptions import TimeExhausted
+
+
+def test_receiptTracker_wait(cf):
+    txs = [cf.flip.transfer(cf.ALICE, i, {"from": cf.SAFEKEEPER}) for i in range(5)]
+    hashes = [tx.txid for tx in txs]
+    unknownHash = "0x" + JUNK_HEX_PAD
+
+    progress = []
+    tracker = ReceiptTracker(batch_size=2, poll_interval=0, drop_timeout=0)
+    receipts = tracker.wait(
+        hashes + [unknownHash],
+        on_progress=lambda *args: progress.append(args),
+        drop_unknown=True,
+    )
+
+    assert progress[-1] == (6, 6)
+    assert receipts[unknownHash] is None
+    for txHash in hashes:
+        assert receipts[txHash] == web3.eth.get_transaction_receipt(txHash)
+
+    # The session is reused across calls until the tracker is closed
+    assert tracker.get_receipts(hashes + [unknownHash]) == receipts
+    tracker.close()
+
+
+# Unknown transactions are only dropped once their nonce has been used or after drop_timeout
+def test_receiptTracker_drop(cf):
+    sender = str(cf.SAFEKEEPER)
+    usedNonceHash = "0x" + JUNK_HEX_PAD
+    futureNonceHash = "0x" + "1" * 64
+    nonces = {
+        usedNonceHash: (sender, 0),
+        futureNonceHash: (sender, web3.eth.get_transaction_count(sender) + 10),
+    }
+
+    progress = []
+    with ReceiptTracker(poll_interval=0.1, drop_timeout=1000) as tracker:
+        receipts = tracker.wait(
+            [usedNonceHash],
+            on_progress=lambda *args: progress.append(args),
+            drop_unknown=True,
+            nonces=nonces,
+        )
+    assert receipts == {usedNonceHash: None}
+    assert progress == [(1, 1)]
+
+    progress = []
+    with ReceiptTracker(poll_interval=0.1, drop_timeout=0.5) as tracker:
+        receipts = tracker.wait(
+            [futureNonceHash],
+            on_progress=lambda *args: progress.append(args),
+            drop_unknown=True,
+            nonces=nonces,
+        )
+    assert receipts == {futureNonceHash: None}
+    assert progress[0] == (0, 1) and progress[-1] == (1, 1)
+
+
+# Without drop_unknown an unknown transaction is waited for until the timeout
+def test_receiptTracker_timeout(cf):
+    with ReceiptTracker(poll_interval=0.1, timeout=0.5) as tracker:
+        with pytest.raises(TimeExhausted):
+            tracker.wait(
+                [
+                    cf.flip.transfer(cf.ALICE, 1, {"from": cf.SAFEKEEPER}).txid,
+                    "0x" + JUNK_HEX_PAD,
+                ]
+            )
+
+
+def test_batch_eth_call(cf):
+    holders = [cf.ALICE, cf.BOB, cf.CHARLIE]
+    block = web3.eth.block_number
+    results = batch_eth_call(
+        [(cf.flip.address, cf.flip.balanceOf.encode_input(h)) for h in holders],
+        block_identifier=block,
+        batch_size=2,
+    )
+    assert [cf.flip.balanceOf.decode_output(r.hex()) for r in results] == [
+        cf.flip.balanceOf(h, block_identifier=block) for h in holders
+    ]
@@ -0,0 +1,34 @@
+from consts import *
+from utils import reconcileAirdrop, toChecksumAddressFromBytes
+
+
+def test_reconcileAirdrop():
+    holders = [toChecksumAddressFromBytes(bytes([i]) * 20) for i in range(1, 6)]
+    expected = {holder: i * E_18 for i, holder in enumerate(holders, 1)}
+    stranger = toChecksumAddressFromBytes(b"\xaa" * 20)
+
+    report = reconcileAirdrop(
+        expected,
+        [
+            # Casing doesn't matter
+            [holders[0].lower(), E_18],
+            [holders[1], 2 * E_18],
+            [holders[1], 2 * E_18],
+            [holders[2], E_18],
+            [stranger, E_18],
+        ],
+    )
+    assert report == {
+        "missing": [(holders[3], 4 * E_18), (holders[4], 5 * E_18)],
+        "duplicate": [(holders[1], 2 * E_18)],
+        "extra": [(stranger, E_18)],
+        "mismatched": [(holders[2], 3 * E_18, E_18)],
+    }
+
+
+def test_reconcileAirdrop_complete():
+    holders = [toChecksumAddressFromBytes(bytes([i]) * 20) for i in range(1, 4)]
+    expected = {holder: str(E_18) for holder in holders}
+
+    report = reconcileAirdrop(expected, [[holder, E_18] for holder in holders])
+    assert not any(report.values())
@@ -0,0 +1,55 @@
+import pytest
+from consts import *
+from utils import toChecksumAddressFromBytes
+from snapshot_file import SnapshotFile, write_snapshot_file, SNAPSHOT_HEADER
+from brownie.test import given, strategy
+
+
+@given(
+    st_holders=strategy("address[]", unique=True),
+    # Token balances (and so their sum) fit in a uint256, which uint128 balances guarantee
+    st_balances=strategy("uint128[]"),
+)
+def test_snapshotFile(tmp_path, st_holders, st_balances):
+    holders = [str(holder) for holder in st_holders][: len(st_balances)]
+    balances = st_balances[: len(holders)]
+    filename = str(tmp_path / "snapshot.bin")
+    write_snapshot_file(filename, holders, balances, sum(balances), 1234)
+
+    snapshotFile = SnapshotFile(filename)
+    snapshotFile.verify()
+    assert len(snapshotFile) == len(holders)
+    assert snapshotFile.snapshot_blocknumber == 1234
+    assert snapshotFile.totalBalance == sum(balances)
+    assert [snapshotFile.address(i) for i in range(len(holders))] == holders
+    assert [snapshotFile.balance(i) for i in range(len(holders))] == balances
+    snapshotFile.close()
+
+
+def test_snapshotFile_rev_corrupted(tmp_path):
+    holders = [toChecksumAddressFromBytes(bytes([i]) * 20) for i in range(1, 4)]
+    balances = [3 * E_18, 2 * E_18, E_18]
+    filename = str(tmp_path / "snapshot.bin")
+
+    # Wrong total balance
+    write_snapshot_file(filename, holders, balances, sum(balances) + 1, 1)
+    snapshotFile = SnapshotFile(filename)
+    with pytest.raises(AssertionError, match="total balance"):
+        snapshotFile.verify()
+    snapshotFile.close()
+
+    # Modified balance
+    write_snapshot_file(filename, holders, balances, sum(balances), 1)
+    with open(filename, "r+b") as f:
+        f.seek(-1, 2)
+        f.write(b"\x01")
+    snapshotFile = SnapshotFile(filename)
+    with pytest.raises(AssertionError, match="digest"):
+        snapshotFile.verify()
+    snapshotFile.close()
+
+    # Truncated
+    with open(filename, "r+b") as f:
+        f.truncate(SNAPSHOT_HEADER.size + 20)
+    with pytest.raises(AssertionError, match="Truncated"):
+        SnapshotFile(filename)
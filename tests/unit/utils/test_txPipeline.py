@@ -0,0 +1,102 @@
+import pytest
+from consts import *
+from shared_tests import *
+from tx_pipeline import TxPipeline, wait_for_pending_transactions
+from brownie import accounts, web3
+from eth_account import Account
+
+
+def test_txPipeline_send(cf):
+    sender = accounts.add()
+    cf.SAFEKEEPER.transfer(sender, E_18)
+    cf.flip.transfer(sender, 100, {"from": cf.SAFEKEEPER})
+
+    sent = []
+    confirmed = []
+    nonce = sender.nonce
+    with TxPipeline(
+        sender,
+        window=3,
+        poll_interval=0,
+        on_sent=lambda *args: sent.append(args),
+        on_confirmed=lambda *args: confirmed.append(args),
+    ) as pipeline:
+        for i in range(10):
+            pipeline.send(
+                {
+                    "to": cf.flip.address,
+                    "data": cf.flip.transfer.encode_input(cf.BOB, i),
+                }
+            )
+        receipts = pipeline.wait_all()
+    assert pipeline.tracker._session is None
+
+    assert [label for label, _ in sent] == list(range(10))
+    assert [receipt.transactionHash.hex() for receipt in receipts] == [
+        txHash for _, txHash in sent
+    ]
+    assert [web3.eth.get_transaction(txHash).nonce for _, txHash in sent] == list(
+        range(nonce, nonce + 10)
+    )
+    assert all(receipt.status == 1 for receipt in receipts)
+    assert confirmed == list(zip(range(10), receipts))
+    assert cf.flip.balanceOf(sender) == 100 - sum(range(10))
+    wait_for_pending_transactions(sender)
+
+
+# Stub node that rejects every broadcast with `error`
+class RejectingW3:
+    def __init__(self, error):
+        self.eth = self
+        self.account = Account
+        self.chain_id = 1
+        self.error = error
+
+    def get_transaction_count(self, address, block_identifier):
+        return 0
+
+    def send_raw_transaction(self, rawTransaction):
+        raise ValueError({"code": -32000, "message": self.error})
+
+
+@pytest.mark.parametrize(
+    "error, tracked",
+    [
+        ("nonce too low", 1),
+        ("replacement transaction underpriced", 1),
+        ("already known", 2),
+    ],
+)
+def test_txPipeline_resubmit_errors(error, tracked):
+    pipeline = TxPipeline(accounts.add(), w3=RejectingW3(error))
+    tx = {
+        "to": ZERO_ADDR,
+        "value": 0,
+        "data": "0x",
+        "gas": 21000,
+        "gasPrice": 10**9,
+        "nonce": 0,
+        "chainId": 1,
+    }
+    entry = {"label": 0, "tx": tx, "hashes": ["0x" + JUNK_HEX_PAD], "sent": 0}
+
+    pipeline._resubmit(entry)
+    assert len(entry["hashes"]) == tracked
+    assert entry["hashes"][0] == "0x" + JUNK_HEX_PAD
+    assert entry["sent"] > 0
+    assert tx["gasPrice"] > 10**9
+
+
+def test_txPipeline_resubmit_rev_error():
+    pipeline = TxPipeline(accounts.add(), w3=RejectingW3("insufficient funds"))
+    tx = {
+        "to": ZERO_ADDR,
+        "value": 0,
+        "data": "0x",
+        "gas": 21000,
+        "gasPrice": 10**9,
+        "nonce": 0,
+        "chainId": 1,
+    }
+    with pytest.raises(ValueError):
+        pipeline._resubmit({"label": 0, "tx": tx, "hashes": [], "sent": 0})
@@ -87,3 +87,22 @@ def test_deployAndFetchBatch_rev_deployed(cf, token):
 # dependant and the results are for the github runners, so this test will fail locally.
 def test_getCreate2Addr(Deposit):
     deposit_bytecode_test(Deposit)
+
+
+@given(st_swapIDs=strategy("bytes32[]", unique=True))
+def test_getCreate2Addrs(cf, token, Deposit, st_swapIDs):
+    for tokenAddr in [NATIVE_ADDR, token.address]:
+        expectedAddrs = [
+            getCreate2Addr(
+                cf.vault.address, swapID.hex(), Deposit, cleanHexStrPad(tokenAddr)
+            )
+            for swapID in st_swapIDs
+        ]
+        args = [cf.vault, st_swapIDs, Deposit, cleanHexStrPad(tokenAddr)]
+
+        assert list(getCreate2Addrs(*args)) == expectedAddrs
+        assert list(getCreate2Addrs(*args, processes=2, chunkSize=3)) == expectedAddrs
+        assert [
+            web3.toChecksumAddress(addr)
+            for addr in getCreate2Addrs(*args, checksum=False)
+        ] == expectedAddrs
@@ -0,0 +1,70 @@
+import os
+from consts import *
+from deposit_index import DepositAddressIndex, TIER_RATIO
+
+
+def test_depositAddressIndex(cf, token, Deposit, tmp_path):
+    index = DepositAddressIndex(tmp_path, cf.vault, Deposit)
+    index.append(range(100), [NATIVE_ADDR, token])
+    assert len(index) == 200
+
+    # Reopen the index and append a new range of swapIDs for one token only
+    index.close()
+    index = DepositAddressIndex(tmp_path, cf.vault, Deposit)
+    index.append([JUNK_HEX_PAD], [token])
+    assert len(index) == 201
+
+    for swapID, tok in [
+        (0, NATIVE_ADDR),
+        (99, token.address),
+        (JUNK_INT, token.address),
+    ]:
+        depositAddr = getCreate2Addr(
+            cf.vault.address, cleanHexStrPad(swapID), Deposit, cleanHexStrPad(tok)
+        )
+        assert index.lookup(depositAddr) == ("0x" + cleanHexStrPad(swapID), tok)
+
+    # Not indexed
+    depositAddr = getCreate2Addr(
+        cf.vault.address, cleanHexStrPad(100), Deposit, cleanHexStrPad(NATIVE_ADDR)
+    )
+    assert index.lookup(depositAddr) == None
+    assert index.lookup(cf.vault.address) == None
+    index.close()
+
+
+# Small appends are merged among themselves and only into a larger segment once as much
+# data has been appended after it, so appends don't rewrite the whole index
+def test_depositAddressIndex_compaction(cf, token, Deposit, tmp_path):
+    index = DepositAddressIndex(tmp_path, cf.vault, Deposit)
+    index.append(range(100), [NATIVE_ADDR, token])
+    base = index.manifest["segments"][0]["file"]
+
+    for i in range(10, 14):
+        index.append(range(i * 10, (i + 1) * 10), [NATIVE_ADDR, token])
+        assert index.manifest["segments"][0]["file"] == base
+        sizes = [entry["records"] for entry in index.manifest["segments"]]
+        assert all(a > TIER_RATIO * b for a, b in zip(sizes, sizes[1:]))
+        assert len(index.segments) == len(sizes)
+    assert len(index) == 280
+    assert len(os.listdir(tmp_path)) == len(index.segments) + 1
+
+    # The base segment is merged once the appends add up to half of it
+    index.append(range(140, 150), [NATIVE_ADDR, token])
+    assert len(index.segments) == 1
+    assert index.manifest["segments"][0]["file"] != base
+
+    index.close()
+    index = DepositAddressIndex(tmp_path, cf.vault, Deposit)
+    assert len(index) == 300
+    for swapID in [0, 99, 100, 135, 149]:
+        for tok in [NATIVE_ADDR, token.address]:
+            depositAddr = getCreate2Addr(
+                cf.vault.address, cleanHexStrPad(swapID), Deposit, cleanHexStrPad(tok)
+            )
+            assert index.lookup(depositAddr) == ("0x" + cleanHexStrPad(swapID), tok)
+
+    index.compact()
+    assert len(index.segments) == 1
+    assert index.lookup(depositAddr) == ("0x" + cleanHexStrPad(149), token.address)
+    index.close()
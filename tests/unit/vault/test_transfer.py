@@ -136,6 +136,32 @@ def transfer_rev_amount(cf, fcn):
         signed_call_cf(cf, fcn, *args)
 
 
+def test_transfer_sign_batch(cf):
+    cf.SAFEKEEPER.transfer(cf.vault, TEST_AMNT * 3)
+    startBalRecipient = cf.BOB.balance()
+
+    args = [[NATIVE_ADDR, cf.BOB, TEST_AMNT]]
+    firstNonce = nonces[AGG]
+    sigDatas = AGG_SIGNER_1.sign_batch(
+        cf.keyManager, [(cf.vault.transfer, args)] * 3, nonces
+    )
+
+    assert nonces[AGG] == firstNonce + 3
+    assert [sigData[1] for sigData in sigDatas] == [
+        firstNonce,
+        firstNonce + 1,
+        firstNonce + 2,
+    ]
+    assert sigDatas[0] == AGG_SIGNER_1.getSigDataWithNonces(
+        cf.keyManager, cf.vault.transfer, {AGG: firstNonce}, *args
+    )
+
+    for sigData in sigDatas:
+        cf.vault.transfer(sigData, *args, {"from": cf.ALICE})
+
+    assert cf.BOB.balance() == startBalRecipient + TEST_AMNT * 3
+
+
 def test_transfer_rev_sig(cf):
     transfer_rev_sig(cf, cf.vault.transfer)
 
@@ -1,8 +1,39 @@
 import sys
 from brownie import web3, chain, history
 from web3._utils.filters import construct_event_filter_params
-from web3._utils.events import get_event_data
+from web3._utils.events import get_event_abi_types_for_decoding
+from web3._utils.method_formatters import log_entry_formatter
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from web3._utils.abi import map_abi_data, normalize_event_input_types
+from web3.datastructures import AttributeDict
+from web3.exceptions import MismatchedABI
+from eth_abi.decoding import ContextFramesBytesIO, TupleDecoder
+from eth_abi.registry import registry as default_registry
+from eth_hash.utils import auto_choose_backend
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from itertools import islice
+from functools import lru_cache
+import threading
+import time
 import json
+import rlp
+
+# Raw bytes keccak256. eth_hash's auto backend (behind `web3.keccak` and `eth_utils.keccak`)
+# resolves the backend again on every single call, so resolve it once here.
+keccak = auto_choose_backend().keccak256
+
+
+# Same output as `web3.toChecksumAddress` but straight from the 20 address bytes
+def toChecksumAddressFromBytes(addressBytes):
+    addressHex = addressBytes.hex()
+    addressHash = keccak(addressHex.encode()).hex()
+    return "0x" + "".join(
+        [
+            char.upper() if hashChar in "89abcdef" else char
+            for char, hashChar in zip(addressHex, addressHash)
+        ]
+    )
 
 
 def cleanHexStr(thing):
@@ -45,6 +76,82 @@ def getCreate2Addr(sender, saltHex, contractContainer, argsHex):
     )
 
 
+# Address of a contract deployed with CREATE by `sender` with `nonce`
+def getCreateAddr(sender, nonce):
+    return toChecksumAddressFromBytes(
+        keccak(rlp.encode([bytes.fromhex(cleanHexStr(str(sender))), nonce]))[-20:]
+    )
+
+
+# The init code hash only depends on the bytecode and the constructor arguments (the token
+# for Deposit contracts), so it's only calculated once per (bytecode, argsHex).
+_initCodeHashes = {}
+
+
+def getInitCodeHash(contractContainer, argsHex):
+    key = (contractContainer.bytecode, cleanHexStr(argsHex))
+    if key not in _initCodeHashes:
+        _initCodeHashes[key] = keccak(bytes.fromhex(cleanHexStr(key[0]) + key[1]))
+    return _initCodeHashes[key]
+
+
+# Salts can be bytes32, hex strings or integers (e.g. from a range or a numpy array)
+def saltToBytes(salt):
+    if isinstance(salt, bytes):
+        return salt
+    if isinstance(salt, str):
+        return bytes.fromhex(cleanHexStrPad(salt))
+    return int(salt).to_bytes(32, byteorder="big")
+
+
+def _getCreate2AddrsChunk(prefix, initCodeHash, salts, checksum):
+    addresses = [
+        keccak(prefix + saltToBytes(salt) + initCodeHash)[-20:] for salt in salts
+    ]
+    if checksum:
+        return [toChecksumAddressFromBytes(address) for address in addresses]
+    return addresses
+
+
+# Bulk version of getCreate2Addr for many salts (e.g. swapIDs) with the same sender, contract
+# and constructor arguments. It's a generator that yields the addresses in the same order as
+# the salts, processing them in chunks so arbitrarily long iterators can be streamed. If
+# processes > 1 the chunks are derived in a process pool, bounding the chunks in flight.
+# With checksum=False the raw 20 address bytes are returned, which saves one keccak each.
+def getCreate2Addrs(
+    sender,
+    salts,
+    contractContainer,
+    argsHex,
+    processes=1,
+    chunkSize=10000,
+    checksum=True,
+):
+    prefix = b"\xff" + bytes.fromhex(cleanHexStr(str(sender)))
+    initCodeHash = getInitCodeHash(contractContainer, argsHex)
+
+    salts = iter(salts)
+    chunks = iter(lambda: list(islice(salts, chunkSize)), [])
+
+    if processes <= 1:
+        for chunk in chunks:
+            yield from _getCreate2AddrsChunk(prefix, initCodeHash, chunk, checksum)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(
+                executor.submit(
+                    _getCreate2AddrsChunk, prefix, initCodeHash, chunk, checksum
+                )
+            )
+            if len(pending) >= 2 * processes:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
 def getKeyFromValue(dic, value):
     for key, val in dic.items():
         if val == value:
@@ -126,6 +233,382 @@ def get_contract_object(path_to_contract, address):
     return web3.eth.contract(address=address, abi=abi)
 
 
+# Substrings of the errors returned by the different RPC providers when an eth_getLogs
+# request has too many results or spans too many blocks. Error codes aren't used as some
+# providers (e.g. Infura's -32005) share them with rate limiting.
+LOG_LIMIT_ERRORS = [
+    "query returned more than",
+    "too many results",
+    "response size",
+    "block range",
+    "is limited to a",
+    "blocks are not supported",
+]
+
+# Substrings of the errors returned when requests are rate limited. These are retried after a
+# backoff instead of bisecting the range, which would only send more requests.
+RATE_LIMIT_ERRORS = [
+    "rate limit",
+    "too many requests",
+    "compute units",
+]
+
+
+def _is_log_limit_error(error):
+    message = str(error).lower()
+    return any(limit_error in message for limit_error in LOG_LIMIT_ERRORS)
+
+
+def _is_rate_limit_error(error):
+    message = str(error).lower()
+    return any(limit_error in message for limit_error in RATE_LIMIT_ERRORS)
+
+
+# Fetch the logs matching `filter_params` from `from_block` to `to_block` (both inclusive).
+# The range is split into chunks that are fetched concurrently by up to `max_workers`
+# threads. It's a generator yielding (chunk_from_block, chunk_to_block, logs) in block order.
+# When the provider rejects a chunk for having too many results it is bisected and the chunk
+# size used for the next chunks is reduced. It then grows again (up to `max_chunk_size`, by
+# default the initial chunk size) every time a chunk goes through in a single request.
+# Rate limited requests are retried up to `rate_limit_retries` times, waiting
+# `rate_limit_backoff` seconds and doubling it on every retry.
+# `w3` can be any object exposing `eth.get_logs`, e.g. a stub for testing.
+def fetch_log_chunks(
+    filter_params,
+    from_block,
+    to_block,
+    chunk_size=10000,
+    max_workers=8,
+    min_chunk_size=1,
+    max_chunk_size=None,
+    rate_limit_retries=5,
+    rate_limit_backoff=1,
+    w3=web3,
+):
+    max_chunk_size = max_chunk_size or chunk_size
+    state = {"chunk_size": chunk_size}
+    lock = threading.Lock()
+
+    # Returns the logs of the range and whether it had to be bisected
+    def get_logs(start, end):
+        params = dict(filter_params, fromBlock=start, toBlock=end)
+        for retry in range(rate_limit_retries + 1):
+            try:
+                return list(w3.eth.get_logs(params)), False
+            except Exception as e:
+                if _is_rate_limit_error(e) and retry < rate_limit_retries:
+                    time.sleep(rate_limit_backoff * 2**retry)
+                    continue
+                if not _is_log_limit_error(e) or start == end:
+                    raise
+                break
+        with lock:
+            state["chunk_size"] = max(min_chunk_size, (end - start + 1) // 2)
+        middle = (start + end) // 2
+        return get_logs(start, middle)[0] + get_logs(middle + 1, end)[0], True
+
+    def fetch_chunk(start, end):
+        logs, bisected = get_logs(start, end)
+        if not bisected:
+            with lock:
+                state["chunk_size"] = min(max_chunk_size, state["chunk_size"] * 2)
+        return (start, end, logs)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        next_block = from_block
+        while next_block <= to_block or pending:
+            while next_block <= to_block and len(pending) < 2 * max_workers:
+                end = min(next_block + state["chunk_size"] - 1, to_block)
+                pending.append(executor.submit(fetch_chunk, next_block, end))
+                next_block = end + 1
+            yield pending.popleft().result()
+
+
+# Get the ERC20 balances of `holders` through AddressChecker.tokenBalances, packing `chunk_size`
+# balanceOf lookups in a single eth_call. Chunks are queried concurrently and the balances are
+# returned in the same order as `holders`. If the AddressChecker wasn't deployed yet at
+# `block_identifier` (e.g. for a historical snapshot), its code is provided with a state override
+# in the eth_call. Nodes without state override support fall back to a separate token.balanceOf
+# call per holder, as when there is no AddressChecker, still made concurrently.
+# `on_progress(done, total)` is called as the balances come in.
+def get_token_balances(
+    addressChecker,
+    token,
+    holders,
+    block_identifier=None,
+    chunk_size=500,
+    max_workers=8,
+    on_progress=None,
+):
+    holders = list(map(str, holders))
+    state_override = None
+
+    def check_chunk(chunk):
+        tx = {
+            "to": addressChecker.address,
+            "data": addressChecker.tokenBalances.encode_input(token, chunk),
+        }
+        output = web3.eth.call(tx, block_identifier, state_override)
+        return list(addressChecker.tokenBalances.decode_output(output.hex()))
+
+    if addressChecker is not None and block_identifier is not None:
+        if len(web3.eth.get_code(addressChecker.address, block_identifier)) == 0:
+            state_override = {
+                addressChecker.address: {
+                    "code": addressChecker._build["deployedBytecode"]
+                }
+            }
+            try:
+                check_chunk(holders[:1])
+            except ValueError:
+                addressChecker = None
+    if addressChecker is None:
+        chunk_size = 1
+    chunks = [holders[i : i + chunk_size] for i in range(0, len(holders), chunk_size)]
+
+    def get_chunk(chunk):
+        if addressChecker is None:
+            return [
+                token.balanceOf(holder, block_identifier=block_identifier)
+                for holder in chunk
+            ]
+        return check_chunk(chunk)
+
+    balances = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for chunkBalances in executor.map(get_chunk, chunks):
+            balances.extend(chunkBalances)
+            if on_progress is not None:
+                on_progress(len(balances), len(holders))
+    return balances
+
+
+# Hash join of the expected balances ({address: balance}) with the airdrop transfers
+# ([address, amount]), keyed by the raw address bytes so the casing doesn't matter. Returns the
+# holders that weren't airdropped, the receivers airdropped more than once, the receivers that
+# aren't holders and the holders airdropped a different amount.
+def reconcileAirdrop(expected, airdropTXs):
+    expected = {
+        bytes.fromhex(cleanHexStr(str(account))): int(amount)
+        for account, amount in expected.items()
+    }
+
+    report = {"missing": [], "duplicate": [], "extra": [], "mismatched": []}
+    airdropped = set()
+    for receiver, amount in airdropTXs:
+        receiver = bytes.fromhex(cleanHexStr(str(receiver)))
+        amount = int(amount)
+        if receiver in airdropped:
+            report["duplicate"].append((receiver, amount))
+            continue
+        airdropped.add(receiver)
+        if receiver not in expected:
+            report["extra"].append((receiver, amount))
+        elif expected[receiver] != amount:
+            report["mismatched"].append((receiver, expected[receiver], amount))
+    report["missing"] = [
+        (holder, balance)
+        for holder, balance in expected.items()
+        if holder not in airdropped
+    ]
+
+    # Back to checksum addresses only for the (few) entries in the report
+    return {
+        kind: [
+            (toChecksumAddressFromBytes(entry[0]),) + tuple(entry[1:])
+            for entry in entries
+        ]
+        for kind, entries in report.items()
+    }
+
+
+# Checksumming costs a keccak per address and the same addresses show up in many events
+_checksumAddressFromBytes = lru_cache(maxsize=1 << 16)(toChecksumAddressFromBytes)
+
+
+# Decoder for the logs of a single event, built once from its ABI so that decoding a log
+# doesn't go through web3's generic path (ABI lookups, type normalization and a codec
+# registry lookup per argument) every time. The results are the same as get_event_data's.
+# Only the ABI is needed, so logs can be decoded without a connection to a node, including
+# raw JSON-RPC logs (hex strings).
+class EventDecoder:
+    def __init__(self, abi, registry=default_registry):
+        self.abi = abi
+        self.name = abi["name"]
+        self.anonymous = abi.get("anonymous", False)
+        self.topic0 = None
+        if not self.anonymous:
+            self.topic0 = "0x" + keccak(event_signature(abi).encode()).hex()
+
+        inputs = list(normalize_event_input_types(abi["inputs"]))
+        types = list(get_event_abi_types_for_decoding(inputs))
+        self.indexed = [
+            (input["name"], type, input["type"])
+            for input, type in zip(inputs, types)
+            if input["indexed"]
+        ]
+        self.data_names = [input["name"] for input in inputs if not input["indexed"]]
+        self.data_types = [
+            type for input, type in zip(inputs, types) if not input["indexed"]
+        ]
+        names = [name for name, _, _ in self.indexed] + self.data_names
+        assert len(set(names)) == len(names), f"Duplicated argument names: {names}"
+
+        self.topic_decoders = [
+            _topic_decoder(type, registry) for _, type, _ in self.indexed
+        ]
+        self.data_decoder = TupleDecoder(
+            decoders=[registry.get_decoder(type) for type in self.data_types]
+        )
+        self.data_normalizers = [_data_normalizer(type) for type in self.data_types]
+        self.topic_count = len(self.indexed) + (0 if self.anonymous else 1)
+
+    # Whether the log was emitted by this event (by its topic0 and number of topics)
+    def matches(self, log):
+        topics = log["topics"]
+        if len(topics) != self.topic_count:
+            return False
+        return self.anonymous or _hexStr(topics[0]) == self.topic0
+
+    def decode(self, log):
+        if isinstance(log.get("blockNumber"), str):
+            log = log_entry_formatter(log)
+        if not self.matches(log):
+            raise MismatchedABI(f"The log doesn't match the {self.name} event")
+
+        topics = log["topics"] if self.anonymous else log["topics"][1:]
+        args = {
+            name: decode(_toBytes(topic))
+            for (name, _, _), decode, topic in zip(
+                self.indexed, self.topic_decoders, topics
+            )
+        }
+        values = self.data_decoder(ContextFramesBytesIO(_toBytes(log["data"])))
+        for name, normalize, value in zip(
+            self.data_names, self.data_normalizers, values
+        ):
+            args[name] = normalize(value)
+
+        return AttributeDict(
+            {
+                "args": AttributeDict(args),
+                "event": self.name,
+                "logIndex": log["logIndex"],
+                "transactionIndex": log["transactionIndex"],
+                "transactionHash": log["transactionHash"],
+                "address": log["address"],
+                "blockHash": log["blockHash"],
+                "blockNumber": log["blockNumber"],
+            }
+        )
+
+    # Decode a batch of logs, skipping the ones from other events
+    def decode_logs(self, logs):
+        for log in logs:
+            if isinstance(log.get("blockNumber"), str):
+                log = log_entry_formatter(log)
+            if self.matches(log):
+                yield self.decode(log)
+
+    # Encode the filters on indexed arguments as topics, so the node does the filtering. A
+    # filter value can be a single value or a list of accepted values. Returns the topics and
+    # the filters on non-indexed arguments, which can only be matched once decoded.
+    def topics(self, argument_filters=None):
+        argument_filters = dict(argument_filters or {})
+        topics = [] if self.anonymous else [self.topic0]
+        for name, type, abi_type in self.indexed:
+            if name not in argument_filters:
+                topics.append(None)
+                continue
+            value = argument_filters.pop(name)
+            values = value if isinstance(value, (list, tuple)) else [value]
+            encoded = [_encode_topic(abi_type, v) for v in values]
+            topics.append(encoded[0] if len(encoded) == 1 else encoded)
+        unknown = set(argument_filters) - set(self.data_names)
+        assert not unknown, f"Unknown {self.name} arguments: {unknown}"
+        while topics and topics[-1] is None:
+            topics.pop()
+        return topics, argument_filters
+
+
+_eventDecoders = {}
+
+
+# Decoders are cached by ABI so that every call to fetch_events reuses the same one
+def get_event_decoder(abi):
+    key = json.dumps(abi, sort_keys=True)
+    if key not in _eventDecoders:
+        _eventDecoders[key] = EventDecoder(abi)
+    return _eventDecoders[key]
+
+
+def event_signature(abi):
+    return abi["name"] + "(" + ",".join(_abi_type(i) for i in abi["inputs"]) + ")"
+
+
+def _abi_type(input):
+    if input["type"].startswith("tuple"):
+        return (
+            "(" + ",".join(_abi_type(c) for c in input["components"]) + ")"
+        ) + input["type"][len("tuple") :]
+    return input["type"]
+
+
+def _hexStr(value):
+    return value.lower() if isinstance(value, str) else "0x" + bytes(value).hex()
+
+
+def _toBytes(value):
+    return bytes.fromhex(cleanHexStr(value)) if isinstance(value, str) else value
+
+
+# Indexed arguments are always a single 32 byte word, so the common types are decoded directly
+def _topic_decoder(type, registry):
+    if "[" in type or "(" in type:
+        decoder = registry.get_decoder(type)
+        return lambda topic: decoder(ContextFramesBytesIO(topic))
+    if type == "address":
+        return lambda topic: _checksumAddressFromBytes(bytes(topic[12:]))
+    if type.startswith("uint"):
+        return lambda topic: int.from_bytes(topic, "big")
+    if type.startswith("int"):
+        return lambda topic: int.from_bytes(topic, "big", signed=True)
+    if type == "bool":
+        return lambda topic: topic[-1] == 1
+    if type.startswith("bytes"):
+        size = int(type[len("bytes") :])
+        return lambda topic: bytes(topic[:size])
+    decoder = registry.get_decoder(type)
+    return lambda topic: decoder(ContextFramesBytesIO(topic))
+
+
+def _data_normalizer(type):
+    if type == "address":
+        return lambda value: _checksumAddressFromBytes(bytes.fromhex(value[2:]))
+    if "address" in type:
+        return lambda value: map_abi_data(BASE_RETURN_NORMALIZERS, [type], [value])[0]
+    return lambda value: value
+
+
+def _encode_topic(type, value):
+    if "[" in type or type.startswith("tuple"):
+        raise TypeError(f"Filtering on indexed {type} arguments is not supported")
+    if type in ["string", "bytes"]:
+        if isinstance(value, str):
+            value = value.encode() if type == "string" else _toBytes(value)
+        return "0x" + keccak(value).hex()
+    if type == "address":
+        return "0x" + cleanHexStrPad(str(value).lower())
+    if type.startswith("uint") or type.startswith("int"):
+        return "0x" + int(value).to_bytes(32, "big", signed=type[0] == "i").hex()
+    if type == "bool":
+        return "0x" + int(bool(value)).to_bytes(32, "big").hex()
+    if type.startswith("bytes"):
+        return "0x" + _toBytes(value).ljust(32, b"\0").hex()
+    raise TypeError(f"Unsupported indexed argument type {type}")
+
+
 # In order to get the event from a contract do "get_contract_object("contract_name", contract_address).events.event_name
 def fetch_events(
     event,
@@ -134,6 +617,8 @@ def fetch_events(
     to_block="latest",
     address=None,
     topics=None,
+    chunk_size=None,
+    max_workers=8,
 ):
     """Get events using eth_getLogs API.
 
@@ -146,37 +631,78 @@ def fetch_events(
     :param to_block: Fetch events until this contract
     :param address:
     :param topics:
+    :param chunk_size: If set, split the range in chunks of blocks fetched concurrently (see fetch_log_chunks)
+    :param max_workers: Number of concurrent requests when chunk_size is set
     :return:
     """
 
     if from_block is None:
         raise TypeError("Missing mandatory keyword argument to getLogs: from_Block")
 
-    abi = event._get_event_abi()
-    abi_codec = event.web3.codec
+    decoder = get_event_decoder(event._get_event_abi())
 
-    # Set up any indexed event filters if needed
-    argument_filters = dict()
-    _filters = dict(**argument_filters)
+    # Filters on indexed arguments are encoded as topics so the node does the filtering, while
+    # the rest are matched once decoded
+    event_topics, data_filters = decoder.topics(argument_filters)
+    if topics is not None:
+        if len(event_topics) > 1:
+            raise TypeError(
+                "Merging the topics argument with topics generated "
+                "from argument_filters is not supported."
+            )
+        event_topics = topics
 
-    data_filter_set, event_filter_params = construct_event_filter_params(
-        abi,
-        abi_codec,
+    _, event_filter_params = construct_event_filter_params(
+        decoder.abi,
+        event.web3.codec,
         contract_address=event.address,
-        argument_filters=_filters,
+        topics=event_topics,
         fromBlock=from_block,
         toBlock=to_block,
         address=address,
-        topics=topics,
     )
 
     # Call node over JSON-RPC API
-    logs = event.web3.eth.get_logs(event_filter_params)
+    if chunk_size is None:
+        logs = event.web3.eth.get_logs(event_filter_params)
+    else:
+        if to_block == "latest":
+            to_block = event.web3.eth.block_number
+        logs = (
+            log
+            for (_, _, chunk_logs) in fetch_log_chunks(
+                event_filter_params,
+                from_block,
+                to_block,
+                chunk_size=chunk_size,
+                max_workers=max_workers,
+                w3=event.web3,
+            )
+            for log in chunk_logs
+        )
 
     # Convert raw binary event data to easily manipulable Python objects
-    for entry in logs:
-        data = get_event_data(abi_codec, abi, entry)
-        yield data
+    for data in decoder.decode_logs(logs):
+        if match_argument_filters(data.args, data_filters):
+            yield data
+
+
+def normalize_argument(value):
+    if isinstance(value, (bytes, bytearray)):
+        return "0x" + value.hex()
+    if isinstance(value, str):
+        return value.lower()
+    return value
+
+
+# Whether the decoded event arguments match the filters. A filter value can be a single value
+# or a list of accepted values. Addresses and hex strings are compared case-insensitively.
+def match_argument_filters(args, argument_filters):
+    for name, value in argument_filters.items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        if normalize_argument(args[name]) not in map(normalize_argument, values):
+            return False
+    return True
 
 
 def prompt_user_continue_or_break(prompt, default_yes):